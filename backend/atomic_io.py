@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+原子写入：先写同目录下的临时文件，再用os.replace替换目标文件
+
+并发的转换任务或TensorBoard读取方只会看到完整的旧文件或新文件。替换会
+生成新的inode，从结果缓存硬链接来的旧文件内容不受影响。
+"""
+
+import json
+import os
+import tempfile
+
+def write_text_atomic(path, text):
+    """原子地写入文本文件，返回path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.tmp-")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        # mkstemp创建的文件只有属主可读，改为普通文件的权限
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return path
+
+def write_json_atomic(path, data, indent=2):
+    """原子地写入JSON文件，返回path"""
+    return write_text_atomic(path, json.dumps(data, indent=indent, ensure_ascii=False))
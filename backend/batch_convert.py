@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+批量转换：用进程池并行转换多个模型文件
+
+输入可以是多个文件、目录（转换其中所有.json文件）或glob模式。每个模型
+写入输出根目录下以文件名命名的独立子目录。工作进程与常驻服务共用
+converter_server.init_worker/run_job，每个进程只导入一次TensorFlow，并按
+进程数限制TensorFlow线程池，避免多个进程争抢同一批CPU核心。
+"""
+
+import glob
+import os
+import time
+import multiprocessing
+import logging
+
+from converter_server import init_worker, run_job
+from cpu_tuning import AUTO, available_cpus, resolve_thread_counts
+
+logger = logging.getLogger(__name__)
+
+GLOB_CHARS = set('*?[')
+
+def is_batch_input(paths):
+    """判断命令行输入是否需要批量模式（多个文件、目录或glob）"""
+    return len(paths) > 1 or any(os.path.isdir(p) or GLOB_CHARS & set(p) for p in paths)
+
+def expand_inputs(paths):
+    """把文件、目录和glob模式展开为去重后的模型文件列表"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(path, '*.json')))
+        elif GLOB_CHARS & set(path):
+            matches = sorted(glob.glob(path, recursive=True))
+        else:
+            matches = [path]
+        if not matches:
+            logger.warning(f"没有匹配的模型文件: {path}")
+        files.extend(os.path.abspath(m) for m in matches if not os.path.isdir(m))
+
+    seen = set()
+    return [f for f in files if not (f in seen or seen.add(f))]
+
+def _output_dirs(files, output_root):
+    """为每个模型分配独立的输出目录，文件名相同时追加序号"""
+    used = {}
+    dirs = {}
+    for path in files:
+        name = os.path.splitext(os.path.basename(path))[0]
+        count = used.get(name, 0)
+        used[name] = count + 1
+        dirs[path] = os.path.join(output_root, name if count == 0 else f"{name}-{count}")
+    return dirs
+
+def run_batch(files, output_root, workers=None, worker_options=None):
+    """并行转换所有模型文件，返回机器可读的汇总结果"""
+    workers = max(1, min(workers or available_cpus(), len(files)))
+    options = dict(worker_options or {}, concurrent_jobs=workers)
+    intra, inter = resolve_thread_counts(options.get('intra_op_threads', AUTO),
+                                         options.get('inter_op_threads', AUTO), workers)
+
+    os.makedirs(output_root, exist_ok=True)
+    output_dirs = _output_dirs(files, output_root)
+    jobs = [{'id': path, 'data_file': path, 'output_dir': output_dirs[path]} for path in files]
+
+    logger.info(f"批量转换 {len(jobs)} 个模型，工作进程: {workers}，"
+                f"每进程线程: intra={intra}, inter={inter}")
+
+    started = time.time()
+    results = []
+    # 使用spawn而不是fork，TensorFlow在fork后的子进程中不安全
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes=workers, initializer=init_worker, initargs=(options,)) as pool:
+        for result in pool.imap_unordered(run_job, jobs):
+            results.append(result)
+            logger.info(f"[{len(results)}/{len(jobs)}] {result['id']}: {result['status']} "
+                        f"({result.get('elapsed')}s)")
+
+    order = {path: i for i, path in enumerate(files)}
+    results.sort(key=lambda r: order.get(r['id'], len(order)))
+    succeeded = [r for r in results if r['status'] == 'ok']
+    return {
+        'total': len(results),
+        'succeeded': len(succeeded),
+        'failed': len(results) - len(succeeded),
+        'workers': workers,
+        'elapsed': round(time.time() - started, 3),
+        'results': [
+            {
+                'file': r['id'],
+                'status': r['status'],
+                'log_dir': r.get('log_dir'),
+                'elapsed': r.get('elapsed'),
+                'truncated': r.get('truncated'),
+                'error': r.get('error')
+            }
+            for r in results
+        ]
+    }
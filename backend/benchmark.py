@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+转换流程的基准测试
+
+按规模网格生成合成的modelStructure/edges（卷积为主、全连接为主和循环网络
+三类图，从几个节点到几百个节点），测量各阶段耗时和峰值内存:
+
+    parse       json.loads解析模型数据（进程内，取多次中的最小值）
+    sort        compile_graph建图和拓扑排序（进程内，取多次中的最小值）
+    build       构建Keras模型
+    compile     编译模型
+    fit         训练（包含TensorBoard回调写日志）
+    write_logs  其余日志写入（初始化、训练历史、模型图和摘要）
+    total       convert_tensorboard.py子进程的总耗时
+    peak_rss_mb 子进程的峰值常驻内存
+
+除parse和sort外，其余指标来自子进程写出的timings.json。结果与JSON基线文件比较，
+任一指标超过 基线 * (1 + 容差) 且绝对增量超过下限时视为性能回退，退出码为1。
+基线不存在或使用--update-baseline时写入新的基线。
+
+    python benchmark.py                         # 与基线比较
+    python benchmark.py --update-baseline       # 重新生成基线
+    python benchmark.py --kinds dense --sizes 8,256 --tolerance 0.5
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import logging
+
+from atomic_io import write_json_atomic
+from graph_compiler import compile_graph
+from timing import TIMINGS_FILE
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONVERTER = os.path.join(BASE_DIR, 'convert_tensorboard.py')
+DEFAULT_BASELINE = os.path.join(BASE_DIR, 'benchmark_baseline.json')
+
+GRAPH_KINDS = ('conv', 'dense', 'recurrent')
+DEFAULT_SIZES = (8, 48, 160)
+# 默认容差：超过基线25%视为回退
+DEFAULT_TOLERANCE = 0.25
+# 绝对增量下限，避免短阶段的计时噪声被判为回退；进程内测量的解析和排序
+# 取多次中的最小值，噪声小得多，可以使用更低的下限
+DEFAULT_MIN_DELTA = 0.05
+DEFAULT_GRAPH_MIN_DELTA = 0.0005
+GRAPH_METRICS = ('parse', 'sort')
+DEFAULT_RSS_MIN_DELTA_MB = 32
+# 子进程各阶段的叶子名称 -> 基准指标
+PHASE_METRICS = {
+    'build_model': 'build',
+    'compile': 'compile',
+    'fit': 'fit',
+    'write_history': 'write_logs',
+    'write_summaries': 'write_logs',
+    'trace': 'write_logs',
+}
+
+class _GraphBuilder:
+    """按前端的格式逐个添加节点和连接"""
+
+    def __init__(self):
+        self.structure = []
+        self.edges = []
+
+    def add(self, layer_type, config=None, inputs=()):
+        node_id = f"{layer_type}-{1700000000000 + len(self.structure)}"
+        layer_config = dict(config or {})
+        layer_config['sequenceId'] = len(self.structure)
+        self.structure.append({'id': node_id, 'type': layer_type, 'config': layer_config})
+        for source in inputs:
+            self.edges.append({'source': source, 'target': node_id})
+        return node_id
+
+    def model_data(self):
+        return {'modelStructure': self.structure, 'edges': self.edges}
+
+# 每类图的(起始层, 重复的块, 结尾层)。块中的'add'把当前分支与上一个残差点相加，
+# 起始层之后所有块的输出形状相同，因此任意规模都能通过形状检查
+_CONV = {'filters': 8, 'kernelSize': 3, 'padding': 'same', 'activation': 'relu'}
+_RNN = {'units': 16, 'returnSequences': True}
+GRAPH_TEMPLATES = {
+    'conv': (
+        [('conv2d', _CONV)],
+        [('conv2d', _CONV), ('batchNorm', {}), ('activation', {'activation': 'relu'}), ('add', {})],
+        [('flatten', {}), ('dense', {'units': 10, 'activation': 'softmax'})],
+    ),
+    'dense': (
+        [('flatten', {}), ('dense', {'units': 64, 'activation': 'relu'})],
+        [('dense', {'units': 64, 'activation': 'relu'}), ('dropout', {'rate': 0.1}), ('add', {})],
+        [('dense', {'units': 10, 'activation': 'softmax'})],
+    ),
+    'recurrent': (
+        [('lstm', _RNN)],
+        [('gru', _RNN), ('dropout', {'rate': 0.1}), ('add', {}),
+         ('lstm', _RNN), ('dropout', {'rate': 0.1}), ('add', {})],
+        [('flatten', {}), ('dense', {'units': 10, 'activation': 'softmax'})],
+    ),
+}
+
+def generate_model_data(kind, size):
+    """生成包含size个节点（含mnist数据源）的合成模型数据"""
+    head, block, tail = GRAPH_TEMPLATES[kind]
+    minimum = 1 + len(head) + len(tail)
+    if size < minimum:
+        raise ValueError(f"{kind}图至少需要{minimum}个节点")
+
+    builder = _GraphBuilder()
+    prev = builder.add('mnist')
+    for layer_type, config in head:
+        prev = builder.add(layer_type, config, [prev])
+    residual = prev
+    i = 0
+    while len(builder.structure) < size - len(tail):
+        layer_type, config = block[i % len(block)]
+        if layer_type == 'add':
+            prev = residual = builder.add(layer_type, config, [prev, residual])
+        else:
+            prev = builder.add(layer_type, config, [prev])
+        i += 1
+    for layer_type, config in tail:
+        prev = builder.add(layer_type, config, [prev])
+    return builder.model_data()
+
+def _best_of(func, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def measure_graph(model_data, repeats):
+    """进程内测量解析和拓扑排序，这两步太快，放在子进程中会被噪声淹没"""
+    text = json.dumps(model_data)
+    return {
+        'parse': _best_of(lambda: json.loads(text), repeats),
+        'sort': _best_of(lambda: compile_graph(model_data), repeats),
+    }
+
+def phase_metrics(timings):
+    """把timings.json中的阶段汇总为基准指标"""
+    metrics = {metric: 0.0 for metric in set(PHASE_METRICS.values())}
+    for entry in timings['phases']:
+        metric = PHASE_METRICS.get(entry['phase'].rpartition('/')[2])
+        if metric:
+            metrics[metric] += entry['wall']
+    metrics['total'] = timings['total_wall']
+    if timings.get('peak_rss_bytes') is not None:
+        metrics['peak_rss_mb'] = timings['peak_rss_bytes'] / 1024 / 1024
+    return metrics
+
+def run_converter(data_file, output_dir, options):
+    """在子进程中完整转换一次，返回timings.json的内容"""
+    cmd = [sys.executable, CONVERTER, data_file, '--output-dir', output_dir, '--no-cache',
+           '--log-profile', options['log_profile'], '--max-samples', str(options['max_samples'])]
+    if options.get('intra_op_threads'):
+        cmd += ['--intra-op-threads', str(options['intra_op_threads'])]
+    if options.get('inter_op_threads'):
+        cmd += ['--inter-op-threads', str(options['inter_op_threads'])]
+    proc = subprocess.run(cmd, capture_output=True, text=True, timeout=options['timeout'])
+    if proc.returncode != 0:
+        tail = '\n'.join(proc.stderr.strip().splitlines()[-5:])
+        raise RuntimeError(f"转换失败（退出码{proc.returncode}）: {tail}")
+    with open(os.path.join(output_dir, TIMINGS_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+def run_case(kind, size, workdir, options):
+    """运行一个基准用例，多次运行时每个指标取最小值"""
+    name = f"{kind}-{size}"
+    model_data = generate_model_data(kind, size)
+    data_file = os.path.join(workdir, f"{name}.json")
+    with open(data_file, 'w', encoding='utf-8') as f:
+        json.dump(model_data, f)
+
+    case = {'kind': kind, 'nodes': size, 'edges': len(model_data['edges'])}
+    metrics = measure_graph(model_data, options['graph_repeats'])
+    try:
+        for run in range(options['repeat']):
+            output_dir = os.path.join(workdir, name, f"run{run}")
+            for metric, value in phase_metrics(run_converter(data_file, output_dir, options)).items():
+                metrics[metric] = min(metrics.get(metric, value), value)
+    except (RuntimeError, subprocess.TimeoutExpired) as e:
+        logger.error(f"用例 {name} 失败: {str(e)}")
+        case.update(status='error', error=str(e))
+        return name, case
+    case['status'] = 'ok'
+    case['metrics'] = {metric: round(value, 6) for metric, value in sorted(metrics.items())}
+    return name, case
+
+def run_benchmarks(kinds, sizes, options):
+    results = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'options': {key: options[key] for key in ('log_profile', 'max_samples', 'repeat')},
+        'cases': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='tb-bench-') as workdir:
+        for kind in kinds:
+            for size in sizes:
+                logger.info(f"运行用例 {kind}-{size}")
+                name, case = run_case(kind, size, workdir, options)
+                results['cases'][name] = case
+                if case['status'] == 'ok':
+                    logger.info(f"{name}: " + ', '.join(f"{k}={v:.4g}" for k, v in case['metrics'].items()))
+    return results
+
+def compare_with_baseline(results, baseline, tolerance=None):
+    """返回超出容差的指标列表；tolerance为None时使用基线文件中的设置"""
+    settings = baseline.get('settings', {})
+    default_tolerance = tolerance if tolerance is not None else settings.get('tolerance', DEFAULT_TOLERANCE)
+    metric_tolerances = {} if tolerance is not None else settings.get('metric_tolerances', {})
+    min_delta = settings.get('min_delta', DEFAULT_MIN_DELTA)
+    graph_min_delta = settings.get('graph_min_delta', DEFAULT_GRAPH_MIN_DELTA)
+    rss_min_delta = settings.get('rss_min_delta_mb', DEFAULT_RSS_MIN_DELTA_MB)
+
+    regressions = []
+    for name, case in results['cases'].items():
+        base = baseline.get('cases', {}).get(name)
+        if not base or base.get('status') != 'ok' or case['status'] != 'ok':
+            continue
+        for metric, value in case['metrics'].items():
+            old = base['metrics'].get(metric)
+            if old is None:
+                continue
+            allowed = metric_tolerances.get(metric, default_tolerance)
+            if metric == 'peak_rss_mb':
+                floor = rss_min_delta
+            else:
+                floor = graph_min_delta if metric in GRAPH_METRICS else min_delta
+            if value > old * (1 + allowed) and value - old > floor:
+                regressions.append({
+                    'case': name,
+                    'metric': metric,
+                    'baseline': old,
+                    'current': value,
+                    'ratio': round(value / old, 3) if old else None,
+                    'tolerance': allowed,
+                })
+    return regressions
+
+def write_baseline(results, path, previous=None):
+    """写入基线，保留旧基线中手工配置的容差"""
+    baseline = dict(results)
+    baseline['settings'] = (previous or {}).get('settings', {
+        'tolerance': DEFAULT_TOLERANCE,
+        'metric_tolerances': {},
+        'min_delta': DEFAULT_MIN_DELTA,
+        'graph_min_delta': DEFAULT_GRAPH_MIN_DELTA,
+        'rss_min_delta_mb': DEFAULT_RSS_MIN_DELTA_MB,
+    })
+    write_json_atomic(path, baseline)
+    logger.info(f"已写入基线: {path}")
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='转换流程的基准测试')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线JSON文件')
+    parser.add_argument('--update-baseline', action='store_true', help='用本次结果覆盖基线')
+    parser.add_argument('--output', help='另外把本次结果写入该JSON文件')
+    parser.add_argument('--kinds', default=','.join(GRAPH_KINDS),
+                        help=f"图类型，逗号分隔（可选: {', '.join(GRAPH_KINDS)}）")
+    parser.add_argument('--sizes', type=_int_list, default=list(DEFAULT_SIZES),
+                        help='节点数网格，逗号分隔')
+    parser.add_argument('--repeat', type=int, default=1, help='每个用例完整转换的次数，指标取最小值')
+    parser.add_argument('--graph-repeats', type=int, default=50, help='进程内测量解析和排序的次数')
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help=f"允许的相对回退（默认读取基线设置，缺省为{DEFAULT_TOLERANCE}）")
+    parser.add_argument('--log-profile', default='full', help='转换使用的日志配置档')
+    parser.add_argument('--max-samples', type=int, default=256, help='每个用例的训练样本数')
+    parser.add_argument('--intra-op-threads', type=int, default=None, help='TensorFlow算子内线程数')
+    parser.add_argument('--inter-op-threads', type=int, default=None, help='TensorFlow算子间线程数')
+    parser.add_argument('--timeout', type=float, default=1800, help='单次转换的超时时间(秒)')
+    args = parser.parse_args()
+
+    args.kinds = [k.strip() for k in args.kinds.split(',') if k.strip()]
+    unknown = [k for k in args.kinds if k not in GRAPH_KINDS]
+    if unknown:
+        parser.error(f"未知的图类型: {', '.join(unknown)}")
+    for kind in args.kinds:
+        minimum = 1 + len(GRAPH_TEMPLATES[kind][0]) + len(GRAPH_TEMPLATES[kind][2])
+        if any(size < minimum for size in args.sizes):
+            parser.error(f"{kind}图的节点数不能小于{minimum}")
+    return args
+
+def main():
+    args = parse_arguments()
+    options = {
+        'log_profile': args.log_profile,
+        'max_samples': args.max_samples,
+        'repeat': max(1, args.repeat),
+        'graph_repeats': max(1, args.graph_repeats),
+        'intra_op_threads': args.intra_op_threads,
+        'inter_op_threads': args.inter_op_threads,
+        'timeout': args.timeout,
+    }
+    results = run_benchmarks(args.kinds, args.sizes, options)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    failed = [name for name, case in results['cases'].items() if case['status'] != 'ok']
+    regressions = []
+    if baseline is not None and not args.update_baseline:
+        if baseline.get('environment', {}).get('cpu_count') != results['environment']['cpu_count']:
+            logger.warning("基线在CPU核心数不同的机器上生成，比较结果可能不准确")
+        if baseline.get('options') != results['options']:
+            logger.warning(f"基线的运行参数 {baseline.get('options')} 与本次不同")
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        for r in regressions:
+            logger.error(f"性能回退: {r['case']} {r['metric']} {r['baseline']:.4g} -> {r['current']:.4g} "
+                         f"(x{r['ratio']}，容差{r['tolerance']:.0%})")
+    elif not failed:
+        write_baseline(results, args.baseline, baseline)
+
+    print(json.dumps({'failed': failed, 'regressions': regressions, 'cases': results['cases']},
+                     ensure_ascii=False))
+    sys.exit(1 if failed or regressions else 0)
+
+if __name__ == "__main__":
+    main()
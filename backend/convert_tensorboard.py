@@ -6,8 +6,33 @@ import sys
 import os
 import numpy as np
 import argparse
+import random
+import time
+import uuid
 from datetime import datetime
 import traceback
+from contextlib import nullcontext
+
+from graph_compiler import compile_graph, build_keras_model
+from result_cache import ResultCache, model_data_hash
+from shape_inference import DEFAULT_INPUT_SHAPE, NUM_CLASSES, ValidationError, validate_model_data
+from cost_model import CostBudgetError, check_budget, estimate_cost, format_cost_markdown
+from progress import ProgressReporter, keras_callback, stdout_sink
+from data_pipeline import (DEFAULT_DATA_DIR, configure_data_root, describe_data_source, load_dataset,
+                           make_tf_datasets, synthetic_dataset)
+from timing import PhaseTimer, parse_profile_batch
+from atomic_io import write_json_atomic, write_text_atomic
+from cpu_tuning import (AUTO, SWITCH_VALUES, available_cpus, configure_onednn, parse_switch,
+                        parse_thread_count, resolve_thread_counts)
+from payload_io import INPUT_FORMATS, OUTPUT_FORMATS, STDIN_PATH, decode_payload, write_result
+from hparam_sweep import write_trial_summary
+from training_budget import (COMPILE_SECONDS, DEFAULT_BATCH_SIZE, DEFAULT_EPOCHS, TRAINING_FILE, TrainingBudget,
+                             deadline_callback)
+from run_writer import DEFAULT_FLUSH_SECS, DEFAULT_MAX_QUEUE, RunWriter, writer_options
+from distributed_training import distribute_options, distributed_fit
+from incremental_build import DEFAULT_SESSION_DIR, SessionBuild, node_signatures
+from latency_benchmark import (DEFAULT_BATCH_SIZES, DEFAULT_ITERATIONS, DEFAULT_WARMUP, LATENCY_FILE,
+                               benchmark_model, latency_options, write_latency_summaries)
 
 # 设置日志记录
 import logging
@@ -17,16 +42,63 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 确保TensorFlow安装了
-try:
-    import tensorflow as tf
-    logger.info(f"TensorFlow版本: {tf.__version__}")
-except ImportError:
-    logger.error("未安装TensorFlow,请运行: pip install tensorflow>=2.4.0")
-    sys.exit(1)
+# TensorFlow延迟导入，只有真正需要构建模型时才支付导入开销
+tf = None
+
+def load_tensorflow():
+    """导入TensorFlow（只导入一次）并返回模块"""
+    global tf
+    if tf is None:
+        try:
+            import tensorflow
+        except ImportError:
+            logger.error("未安装TensorFlow,请运行: pip install tensorflow>=2.4.0")
+            raise
+        tf = tensorflow
+        logger.info(f"TensorFlow版本: {tf.__version__}")
+    return tf
+
+# 默认随机种子，保证缓存的结果可复现
+DEFAULT_SEED = 42
+# 默认最多使用的训练样本数（包含验证部分），只需要短暂训练生成日志
+DEFAULT_MAX_SAMPLES = 2048
+
+# 日志配置档：控制TensorBoard回调和额外摘要，直方图和权重图像在大模型上开销最大
+#   histogram_freq/write_graph/write_images: 传给TensorBoard回调
+#   extra_summaries: 示例标量(custom_metric)和测试图像
+#   trace: 追踪一次前向计算并导出计算图
+#   train: 为False时不编译、不训练，只导出计算图、模型摘要和层信息
+LOGGING_PROFILES = {
+    'graph-only': {'histogram_freq': 0, 'write_graph': True, 'write_images': False,
+                   'extra_summaries': False, 'trace': True, 'train': False},
+    'fast': {'histogram_freq': 0, 'write_graph': False, 'write_images': False,
+             'extra_summaries': False, 'trace': False, 'train': True},
+    'full': {'histogram_freq': 1, 'write_graph': True, 'write_images': True,
+             'extra_summaries': True, 'trace': True, 'train': True},
+}
+DEFAULT_LOGGING_PROFILE = 'full'
+
+# 日志目录中的成功标记和调试转储文件
+READY_MARKER = 'tb_ready.txt'
+DEBUG_DUMP_FILE = 'debug_data.json'
+# 生成日志失败时应急摘要的命名空间；出现时结果不写入缓存
+EMERGENCY_NAMESPACE = 'emergency'
+
+def get_logging_profile(name):
+    """返回日志配置档，名称无效时抛出ValueError"""
+    name = name or DEFAULT_LOGGING_PROFILE
+    if name not in LOGGING_PROFILES:
+        raise ValueError(f"未知的日志配置档: {name}，可选: {', '.join(LOGGING_PROFILES)}")
+    return LOGGING_PROFILES[name]
 
-def create_model_from_data(model_data):
-    """从JSON数据创建一个TensorFlow模型"""
+def create_model_from_data(model_data, input_shape=DEFAULT_INPUT_SHAPE, num_classes=NUM_CLASSES, timer=None,
+                           session_build=None):
+    """从JSON数据创建一个TensorFlow模型，input_shape和num_classes由数据源决定
+
+    session_build为SessionBuild时按会话增量构建：结构没有变化时直接加载上一次
+    训练后的模型，否则未改动的层从上一次的权重热启动。
+    """
+    timer = timer or PhaseTimer()
     # 适应新的数据结构
     structure = model_data.get('modelStructure', [])
     connections = model_data.get('edges', [])
@@ -38,261 +110,72 @@ def create_model_from_data(model_data):
         logger.error("没有找到有效的模型结构数据")
         raise ValueError("模型结构为空")
     
-    # 创建序贯模型
-    model = tf.keras.Sequential()
-    
-    # 添加层
-    input_shape_added = False
-    
-    # 检查数据源类型，确定输入形状
-    input_shape = (28, 28, 1)  # 默认MNIST格式
-    has_mnist = any(layer.get('type') == 'mnist' for layer in structure)
-    has_csv = any(layer.get('type') == 'useData' for layer in structure)
-    
-    logger.info(f"数据源: MNIST={has_mnist}, CSV={has_csv}")
+    # 编译模型图：建立索引、拓扑排序并检测环
+    with timer.phase('compile_graph'):
+        graph = compile_graph(model_data)
     
-    # 过滤掉非模型层（如数据源和训练按钮）
-    valid_layers = [layer for layer in structure if layer.get('type') not in ['useData', 'mnist', 'trainButton']]
+    # 检查数据源类型
+    has_mnist = 'mnist' in graph.data_sources
+    has_csv = 'useData' in graph.data_sources
     
-    # 对层进行排序，确保它们按照正确的顺序添加
-    if connections:
-        # 如果有连接数据，根据连接顺序排序
-        # 构建图结构
-        graph = {}
-        for layer in valid_layers:
-            graph[layer.get('config', {}).get('sequenceId', 0)] = layer
-        
-        # 找到入度为0的节点
-        in_degree = {seq_id: 0 for seq_id in graph.keys()}
-        for conn in connections:
-            for layer in valid_layers:
-                config = layer.get('config', {})
-                if conn.get('target') == f"{layer.get('type')}-{config.get('sequenceId', 0)}":
-                    in_degree[config.get('sequenceId', 0)] += 1
-        
-        # 拓扑排序
-        sorted_layers = []
-        queue = [seq_id for seq_id, degree in in_degree.items() if degree == 0]
-        while queue:
-            seq_id = queue.pop(0)
-            sorted_layers.append(graph[seq_id])
-            
-            for conn in connections:
-                source_id = conn.get('source').split('-')[1]
-                target_id = conn.get('target').split('-')[1]
-                if source_id == str(seq_id):
-                    for layer in valid_layers:
-                        layer_seq_id = layer.get('config', {}).get('sequenceId', 0)
-                        if target_id == str(layer_seq_id):
-                            in_degree[layer_seq_id] -= 1
-                            if in_degree[layer_seq_id] == 0:
-                                queue.append(layer_seq_id)
-    else:
-        # 如果没有连接数据，按照sequenceId排序
-        sorted_layers = sorted(valid_layers, key=lambda x: x.get('config', {}).get('sequenceId', 0))
+    logger.info(f"数据源: MNIST={has_mnist}, CSV={has_csv}，输入形状: {input_shape}，类别数: {num_classes}")
     
     # 记录排序后的层次序
-    logger.info(f"排序后的层: {[layer.get('type') for layer in sorted_layers]}")
+    logger.info(f"排序后的层: {graph.layer_types()}")
     
-    # 处理每个层
-    for layer in sorted_layers:
-        layer_type = layer.get('type')
-        config = layer.get('config', {})
-        
-        logger.info(f"添加层: {layer_type} (配置: {config})")
-        
-        try:
-            if layer_type == 'conv2d':
-                if not input_shape_added:
-                    model.add(tf.keras.layers.Conv2D(
-                        filters=config.get('filters', 32),
-                        kernel_size=config.get('kernelSize', 3),
-                        strides=config.get('strides', 1),
-                        padding=config.get('padding', 'valid'),
-                        activation=config.get('activation', 'relu'),
-                        input_shape=input_shape
-                    ))
-                    input_shape_added = True
-                else:
-                    model.add(tf.keras.layers.Conv2D(
-                        filters=config.get('filters', 32),
-                        kernel_size=config.get('kernelSize', 3),
-                        strides=config.get('strides', 1),
-                        padding=config.get('padding', 'valid'),
-                        activation=config.get('activation', 'relu')
-                    ))
-            
-            elif layer_type == 'maxPooling2d':
-                pool_size = config.get('poolSize', 2)
-                # 确保pool_size是一个元组
-                if isinstance(pool_size, int):
-                    pool_size = (pool_size, pool_size)
-                model.add(tf.keras.layers.MaxPooling2D(
-                    pool_size=pool_size,
-                    strides=config.get('strides', None),
-                    padding=config.get('padding', 'valid')
-                ))
-                
-            elif layer_type == 'flatten':
-                model.add(tf.keras.layers.Flatten())
-                
-            elif layer_type == 'dense':
-                model.add(tf.keras.layers.Dense(
-                    units=config.get('units', 128),
-                    activation=config.get('activation', 'relu')
-                ))
-                
-            elif layer_type == 'dropout':
-                model.add(tf.keras.layers.Dropout(
-                    rate=config.get('rate', 0.5)
-                ))
-                
-            elif layer_type == 'batchNorm':
-                model.add(tf.keras.layers.BatchNormalization())
-                
-            elif layer_type == 'activation':
-                model.add(tf.keras.layers.Activation(
-                    activation=config.get('activation', 'relu')
-                ))
-                
-            elif layer_type == 'avgPooling2d':
-                pool_size = config.get('poolSize', 2)
-                # 确保pool_size是一个元组
-                if isinstance(pool_size, int):
-                    pool_size = (pool_size, pool_size)
-                model.add(tf.keras.layers.AveragePooling2D(
-                    pool_size=pool_size,
-                    strides=config.get('strides', None),
-                    padding=config.get('padding', 'valid')
-                ))
-                
-            elif layer_type == 'lstm':
-                # 如果前一层不是序列/时间序列格式，添加Reshape层
-                if not input_shape_added:
-                    model.add(tf.keras.layers.Reshape((28, 28)))
-                    input_shape_added = True
-                model.add(tf.keras.layers.LSTM(
-                    units=config.get('units', 64),
-                    activation=config.get('activation', 'tanh'),
-                    recurrent_activation=config.get('recurrentActivation', 'sigmoid'),
-                    return_sequences=config.get('returnSequences', False)
-                ))
-                
-            elif layer_type == 'gru':
-                # 如果前一层不是序列/时间序列格式，添加Reshape层
-                if not input_shape_added:
-                    model.add(tf.keras.layers.Reshape((28, 28)))
-                    input_shape_added = True
-                model.add(tf.keras.layers.GRU(
-                    units=config.get('units', 64),
-                    activation=config.get('activation', 'tanh'),
-                    recurrent_activation=config.get('recurrentActivation', 'sigmoid'),
-                    return_sequences=config.get('returnSequences', False)
-                ))
-                
-            elif layer_type == 'reshape':
-                target_shape = config.get('targetShape', [7, 7, 16])
-                model.add(tf.keras.layers.Reshape(target_shape))
-        
-        except Exception as e:
-            logger.error(f"添加层 {layer_type} 时出错: {str(e)}")
-            logger.error(traceback.format_exc())
+    tf = load_tensorflow()
+    if session_build is not None and session_build.unchanged(node_signatures(graph, input_shape, num_classes)):
+        with timer.phase('load_previous'):
+            model = session_build.load_model(tf)
+        if model is not None:
+            return model
     
-    # 检查模型是否为空
-    if len(model.layers) == 0:
-        logger.warning("没有添加任何层到模型中")
-        
-        # 添加一个示例Conv2D层作为回退
-        model.add(tf.keras.layers.Conv2D(
-            filters=32,
-            kernel_size=3,
-            activation='relu',
-            input_shape=input_shape
-        ))
-        
-        # 添加Flatten层
-        model.add(tf.keras.layers.Flatten())
-    
-    # 确保模型以Dense输出层结束
-    if len(model.layers) > 0 and not isinstance(model.layers[-1], tf.keras.layers.Dense):
-        logger.info("添加输出层: Dense(10, activation='softmax')")
-        model.add(tf.keras.layers.Flatten())
-        model.add(tf.keras.layers.Dense(10, activation='softmax'))
-        
+    node_layers = {}
+    with timer.phase('build_model'):
+        model = build_keras_model(graph, input_shape, tf, num_classes, node_layers=node_layers)
+    if session_build is not None:
+        with timer.phase('warm_start'):
+            session_build.warm_start(tf, node_layers)
     return model
 
-def generate_tensorboard_logs(model, log_dir=None):
-    """为模型生成TensorBoard日志"""
-    # 创建日志目录
-    if log_dir is None:
-        log_dir = os.path.join(os.path.dirname(__file__), 'tb_logs', datetime.now().strftime("%Y%m%d-%H%M%S"))
-    
-    os.makedirs(log_dir, exist_ok=True)
+def make_optimizer(learning_rate=None):
+    """返回Adam优化器；没有指定学习率时使用Keras的默认设置"""
+    if learning_rate is None:
+        return 'adam'
+    return tf.keras.optimizers.Adam(learning_rate=learning_rate)
+
+def train_model(model, train_data, log_dir, validation_data=None, progress=None,
+                profile=LOGGING_PROFILES[DEFAULT_LOGGING_PROFILE], timer=None, profile_batch=0,
+                jit_compile=None, learning_rate=None, training_budget=None, writer=None):
+    """编译并短暂训练模型，把训练过程写入TensorBoard日志
+
+    train_data和validation_data为按批次产生(x, y)的tf.data管道；
+    profile为LOGGING_PROFILES中的日志配置档；profile_batch为TensorFlow性能
+    分析器采样的批次范围(start, end)，0表示不分析；
+    progress为ProgressReporter时，按批次和轮次输出结构化进度事件，
+    并关闭Keras的文本进度条。
+    jit_compile为True/False时开启/关闭XLA编译，None时使用Keras的默认行为。
+    learning_rate为Adam优化器的学习率，None时使用默认值。
+    training_budget为已规划的TrainingBudget时，按规划的轮数和步数训练，
+    并在截止时间或最大步数处停止，已完成部分的日志照常写入。
+    writer为运行的RunWriter，训练历史写入history命名空间。
+    """
+    timer = timer or PhaseTimer()
+    compile_options = {} if jit_compile is None else {'jit_compile': jit_compile}
     
-    logger.info(f"TensorBoard日志目录: {log_dir}")
-    logger.info(f"日志目录绝对路径: {os.path.abspath(log_dir)}")
+    # 创建专用的日志子目录
+    train_log_dir = os.path.join(log_dir, 'train')
+    os.makedirs(train_log_dir, exist_ok=True)
     
-    try:
-        # 创建一个简单的摘要文件，确保目录不为空
-        with tf.summary.create_file_writer(log_dir).as_default():
-            tf.summary.scalar("initialization", 1.0, step=0)
-            tf.summary.flush()
-        
-        # 检查是否生成了摘要文件
-        log_files = os.listdir(log_dir)
-        logger.info(f"初始化后的日志文件列表: {log_files}")
-        
-        if not any(f.startswith('events.out.tfevents') for f in log_files):
-            logger.warning("未找到TensorFlow事件文件，手动创建一个...")
-            # 创建另一个tf.summary以确保生成事件文件
-            with tf.summary.create_file_writer(log_dir).as_default():
-                for i in range(5):
-                    tf.summary.scalar("manual_init", float(i), step=i)
-                tf.summary.flush()
-            
-            # 再次检查
-            log_files = os.listdir(log_dir)
-            logger.info(f"手动创建后的日志文件列表: {log_files}")
-        
-        # 获取模型输入形状
-        input_shape = None
-        if len(model.layers) > 0:
-            if hasattr(model.layers[0], 'input_shape'):
-                input_shape = model.layers[0].input_shape
-                logger.info(f"检测到模型输入形状: {input_shape}")
-            else:
-                logger.warning("无法检测到模型第一层的输入形状")
-                
-        # 默认为MNIST形状
-        if not input_shape or input_shape[1:] == (None, None, None):
-            logger.info("使用默认MNIST输入形状")
-            x_train = np.random.random((100, 28, 28, 1))
-            y_train = np.random.randint(0, 10, (100,))
-        else:
-            logger.info(f"根据检测到的输入形状创建训练数据")
-            # 排除batch维度
-            shape = list(input_shape[1:])
-            # 替换所有None为合理的值
-            shape = [s if s is not None else 10 for s in shape]
-            logger.info(f"调整后的输入形状: {shape}")
-            
-            # 创建适合这个形状的随机数据
-            x_train = np.random.random((100, *shape))
-            y_train = np.random.randint(0, 10, (100,))
-            
-        logger.info(f"创建的训练数据形状: x={x_train.shape}, y={y_train.shape}")
-        
-        # 创建专用的日志子目录
-        train_log_dir = os.path.join(log_dir, 'train')
-        os.makedirs(train_log_dir, exist_ok=True)
-        
-        # 编译模型
-        logger.info("编译模型...")
+    # 编译模型；优化器变量在模型所属的strategy作用域内创建（数据并行时为MultiWorkerMirroredStrategy）
+    logger.info("编译模型...")
+    with timer.phase('compile'), model.distribute_strategy.scope():
         try:
             model.compile(
-                optimizer='adam',
+                optimizer=make_optimizer(learning_rate),
                 loss='sparse_categorical_crossentropy',
-                metrics=['accuracy']
+                metrics=['accuracy'],
+                **compile_options
             )
         except Exception as e:
             logger.error(f"模型编译失败: {str(e)}")
@@ -302,123 +185,315 @@ def generate_tensorboard_logs(model, log_dir=None):
             logger.info("尝试使用categorical_crossentropy损失函数...")
             try:
                 # 将标签转换为one-hot编码
-                from tensorflow.keras.utils import to_categorical
-                y_train_cat = to_categorical(y_train, num_classes=10)
+                num_classes = model.output_shape[-1]
+                to_one_hot = lambda x, y: (x, tf.one_hot(y, num_classes))
                 
                 model.compile(
-                    optimizer='adam',
+                    optimizer=make_optimizer(learning_rate),
                     loss='categorical_crossentropy',
-                    metrics=['accuracy']
+                    metrics=['accuracy'],
+                    **compile_options
                 )
                 
-                # 更新y_train
-                y_train = y_train_cat
+                # 更新标签
+                train_data = train_data.map(to_one_hot)
+                if validation_data is not None:
+                    validation_data = validation_data.map(to_one_hot)
             except Exception as e2:
                 logger.error(f"备选编译也失败: {str(e2)}")
                 logger.error(traceback.format_exc())
                 raise ValueError("模型编译失败，无法继续")
-        
-        # 创建TensorBoard回调
-        tensorboard_callback = tf.keras.callbacks.TensorBoard(
-            log_dir=train_log_dir,
-            histogram_freq=1,
-            write_graph=True,
-            write_images=True,
-            update_freq='epoch',
-            profile_batch=0
-        )
-        
-        # 进行一次简短的训练以生成日志
-        logger.info("开始训练模型...")
-        try:
-            history = model.fit(
-                x_train, y_train,
-                epochs=2,  # 减少训练轮数以加快处理
-                batch_size=32,
-                validation_split=0.2,
-                callbacks=[tensorboard_callback],
-                verbose=1
+    
+    # 创建TensorBoard回调
+    tensorboard_callback = tf.keras.callbacks.TensorBoard(
+        log_dir=train_log_dir,
+        histogram_freq=profile['histogram_freq'],
+        write_graph=profile['write_graph'],
+        write_images=profile['write_images'],
+        update_freq='epoch',
+        profile_batch=profile_batch
+    )
+    
+    callbacks = [tensorboard_callback]
+    if progress is not None:
+        callbacks.append(keras_callback(tf, progress))
+    
+    epochs = DEFAULT_EPOCHS
+    plan = training_budget.plan if training_budget is not None else None
+    if plan:
+        # 用take截取每轮的批次：每轮重新遍历（并重新打乱）数据，不会出现数据耗尽
+        epochs = plan['epochs']
+        if plan['steps_per_epoch'] < plan['full_steps_per_epoch']:
+            train_data = train_data.take(plan['steps_per_epoch'])
+            if validation_data is not None:
+                validation_data = validation_data.take(plan['validation_steps'])
+        callbacks.append(deadline_callback(tf, training_budget, progress))
+    
+    # 数据并行的工作进程用strategy.run逐批训练，接口与model.fit相同
+    fit = model.fit
+    if isinstance(model.distribute_strategy, tf.distribute.MultiWorkerMirroredStrategy):
+        fit = lambda *args, **kwargs: distributed_fit(tf, model, *args, **kwargs)
+    
+    # 进行一次简短的训练以生成日志
+    logger.info("开始训练模型...")
+    try:
+        with timer.phase('fit'):
+            history = fit(
+                train_data,
+                epochs=epochs,  # 只需短暂训练生成日志
+                validation_data=validation_data,
+                callbacks=callbacks,
+                verbose=0 if progress is not None else 1
             )
-            
-            # 记录训练历史
-            history_log_dir = os.path.join(log_dir, 'history')
-            os.makedirs(history_log_dir, exist_ok=True)
-            
-            # 手动写入训练历史
-            with tf.summary.create_file_writer(history_log_dir).as_default():
+        
+        # 手动写入训练历史
+        with timer.phase('write_history'):
+            with writer.scope('history'):
                 for key, values in history.history.items():
                     for step, value in enumerate(values):
                         tf.summary.scalar(key, value, step=step)
-                tf.summary.flush()
-                
-        except Exception as e:
-            logger.error(f"模型训练失败: {str(e)}")
-            logger.error(traceback.format_exc())
             
-            # 尝试记录模型结构而不训练
-            logger.info("跳过训练，仅记录模型结构...")
+    except Exception as e:
+        logger.error(f"模型训练失败: {str(e)}")
+        logger.error(traceback.format_exc())
+        
+        # 尝试记录模型结构而不训练
+        logger.info("跳过训练，仅记录模型结构...")
+        
+        # 直接写入模型图
+        try:
+            model_log_dir = os.path.join(log_dir, 'model')
+            os.makedirs(model_log_dir, exist_ok=True)
+            
+            # 保存模型图像
+            model_image_path = os.path.join(model_log_dir, 'model.png')
+            tf.keras.utils.plot_model(
+                model,
+                to_file=model_image_path,
+                show_shapes=True,
+                show_layer_names=True
+            )
+            logger.info(f"模型图像已保存到: {model_image_path}")
             
-            # 直接写入模型图
-            try:
-                model_log_dir = os.path.join(log_dir, 'model')
-                os.makedirs(model_log_dir, exist_ok=True)
-                
-                # 保存模型图像
-                model_image_path = os.path.join(model_log_dir, 'model.png')
-                tf.keras.utils.plot_model(
-                    model,
-                    to_file=model_image_path,
-                    show_shapes=True,
-                    show_layer_names=True
-                )
-                logger.info(f"模型图像已保存到: {model_image_path}")
+            # 创建一个静态的模型摘要
+            with writer.scope('model'):
+                # 记录一些基本的模型信息
+                for i, layer in enumerate(describe_layers(model)):
+                    tf.summary.text(
+                        f"layer_{i}_{layer['name']}", 
+                        f"类型: {layer['class']}, 输出形状: {layer['output_shape']}", 
+                        step=0
+                    )
+        except Exception as plot_error:
+            logger.error(f"无法绘制模型图: {str(plot_error)}")
+            logger.error(traceback.format_exc())
+
+def describe_layers(model):
+    """返回每层的名称、类型、输出形状和参数量"""
+    layers = []
+    for layer in model.layers:
+        try:
+            output_shape = [d for d in layer.output.shape]
+        except Exception:
+            output_shape = None
+        layers.append({
+            'name': layer.name,
+            'class': layer.__class__.__name__,
+            'output_shape': output_shape,
+            'params': int(layer.count_params()),
+            'trainable_params': int(sum(np.prod(w.shape) for w in layer.trainable_weights)),
+        })
+    return layers
+
+def write_model_summaries(model, cost_report=None):
+    """把模型摘要、层信息和开销估算写入当前默认的摘要写入器"""
+    # 记录模型结构作为文本
+    model_summary = []
+    model.summary(print_fn=lambda x, **kwargs: model_summary.append(x))
+    tf.summary.text("model_summary", "\n".join(model_summary), step=0)
+    
+    # 记录每层的元数据
+    lines = ["| 层 | 类型 | 输出形状 | 参数量 |", "|---|---|---|---|"]
+    for layer in describe_layers(model):
+        lines.append(f"| {layer['name']} | {layer['class']} | {layer['output_shape']} | {layer['params']} |")
+    tf.summary.text("layers", "\n".join(lines), step=0)
+    
+    # 记录开销估算：文本表格 + 总量标量 + 按层序号记录的每层标量
+    if cost_report and cost_report.get('totals'):
+        tf.summary.text("cost_report", format_cost_markdown(cost_report), step=0)
+        totals = cost_report['totals']
+        tf.summary.scalar("cost/total_params", totals['params'], step=0)
+        tf.summary.scalar("cost/total_flops", totals['flops'], step=0)
+        tf.summary.scalar("cost/training_flops_per_step", totals['training_flops_per_step'], step=0)
+        tf.summary.scalar("cost/peak_activation_mb", totals['peak_activation_bytes'] / 1024 / 1024, step=0)
+        for i, layer in enumerate(cost_report['layers']):
+            tf.summary.scalar("cost/layer_flops", layer['flops'], step=i)
+            tf.summary.scalar("cost/layer_params", layer['params'], step=i)
+            tf.summary.scalar("cost/layer_activation_kb", layer['activation_bytes'] / 1024, step=i)
+
+def write_graph_trace(model, sample):
+    """用tf.function追踪一次前向计算，把计算图导出到当前默认的摘要写入器"""
+    @tf.function
+    def forward(x):
+        return model(x, training=False)
+    
+    tf.summary.trace_on(graph=True, profiler=False)
+    try:
+        forward(tf.constant(sample, dtype=tf.float32))
+        tf.summary.trace_export(name="model_trace", step=0)
+    finally:
+        tf.summary.trace_off()
+
+def generate_graph_logs(model, log_dir, cost_report=None, progress=None, timer=None, writer=None):
+    """只导出模型结构：追踪一次前向计算写入计算图，再写模型摘要和层信息，不编译也不训练
+
+    writer为运行的RunWriter，摘要写入graph命名空间；为None时自行创建并关闭。
+    """
+    timer = timer or PhaseTimer()
+    os.makedirs(log_dir, exist_ok=True)
+    if progress is not None:
+        progress.phase('write_logs')
+    
+    own_writer = writer is None
+    if own_writer:
+        writer = RunWriter(tf, log_dir)
+    sample = np.zeros((1, *[d if d is not None else 1 for d in model.input_shape[1:]]), dtype=np.float32)
+    try:
+        with writer.scope('graph'):
+            with timer.phase('trace'):
+                write_graph_trace(model, sample)
+            with timer.phase('write_summaries'):
+                write_model_summaries(model, cost_report)
+    finally:
+        if own_writer:
+            writer.close()
+    
+    write_json_atomic(os.path.join(log_dir, 'layers.json'), describe_layers(model))
+    if cost_report:
+        write_json_atomic(os.path.join(log_dir, 'cost_report.json'), cost_report)
+    
+    logger.info(f"已导出模型图: {log_dir}")
+    return log_dir
+
+def generate_tensorboard_logs(model, log_dir=None, cost_report=None, train=True, progress=None,
+                              dataset=None, max_samples=DEFAULT_MAX_SAMPLES, seed=None,
+                              profile=LOGGING_PROFILES[DEFAULT_LOGGING_PROFILE], timer=None,
+                              profile_batch=0, jit_compile=None, learning_rate=None, training_budget=None,
+                              writer=None):
+    """为模型生成TensorBoard日志
+    
+    cost_report为cost_model.estimate_cost的结果，会与model_summary一起写入；
+    train为False时跳过编译和训练（用于超出开销预算的降级任务）；
+    progress为ProgressReporter时输出阶段和训练进度事件；
+    dataset为data_pipeline.Dataset，为None时使用与模型输入形状一致的随机数据；
+    profile为LOGGING_PROFILES中的日志配置档，决定写入哪些回调和摘要；
+    timer为PhaseTimer时记录各阶段耗时，profile_batch、jit_compile和learning_rate见train_model。
+    training_budget为TrainingBudget时，按开销估算和剩余时间规划批大小与步数，
+    截止时间已过时不再训练；规划和截断情况写入training.json。
+    writer为运行的RunWriter（根目录下唯一的事件文件），为None时自行创建并在返回前关闭。
+    """
+    timer = timer or PhaseTimer()
+    
+    # 创建日志目录
+    if log_dir is None:
+        log_dir = default_log_dir()
+    
+    os.makedirs(log_dir, exist_ok=True)
+    
+    logger.info(f"TensorBoard日志目录: {log_dir}")
+    logger.info(f"日志目录绝对路径: {os.path.abspath(log_dir)}")
+    
+    # 写入器创建时即生成事件文件，日志目录不会为空
+    own_writer = writer is None
+    if own_writer:
+        writer = RunWriter(tf, log_dir)
+    
+    try:
+        # 获取模型输入形状
+        input_shape = None
+        try:
+            input_shape = tuple(model.input_shape)
+            logger.info(f"检测到模型输入形状: {input_shape}")
+        except Exception:
+            logger.warning("无法检测到模型的输入形状")
                 
-                # 创建一个静态的模型摘要
-                with tf.summary.create_file_writer(model_log_dir).as_default():
-                    # 记录一些基本的模型信息
-                    for i, layer in enumerate(model.layers):
-                        tf.summary.text(
-                            f"layer_{i}_{layer.name}", 
-                            f"类型: {layer.__class__.__name__}, 输出形状: {layer.output_shape}", 
-                            step=0
-                        )
-                    tf.summary.flush()
-            except Exception as plot_error:
-                logger.error(f"无法绘制模型图: {str(plot_error)}")
-                logger.error(traceback.format_exc())
+        if dataset is None:
+            # 没有数据源时退化为随机数据
+            if not input_shape or input_shape[1:] == (None, None, None):
+                logger.info("使用默认MNIST输入形状")
+                shape = DEFAULT_INPUT_SHAPE
+            else:
+                # 排除batch维度，替换所有None为合理的值
+                shape = [s if s is not None else 10 for s in input_shape[1:]]
+            logger.info(f"没有可用的数据源，使用随机数据，形状: {shape}")
+            dataset = synthetic_dataset(shape, num_classes=model.output_shape[-1], seed=seed)
+        
+        x_train = dataset.x
+        logger.info(f"训练数据: {len(dataset)} 个样本，形状: {x_train.shape}，最多使用 {max_samples or len(dataset)} 个")
+        
+        budgeted = training_budget is not None and training_budget.active
+        # 第一个批次包含追踪，回调无法中断；剩余时间不够编译时直接跳过训练
+        if train and budgeted and training_budget.expired(lookahead=COMPILE_SECONDS):
+            logger.warning("时间预算的剩余时间不足以编译和训练，跳过训练，仅记录模型结构")
+            training_budget.mark_truncated('time_budget')
+            if progress is not None:
+                progress.emit('truncated', reason='time_budget', steps=0)
+            train = False
+        if train:
+            if progress is not None:
+                progress.phase('train')
+            batch_size = DEFAULT_BATCH_SIZE
+            if budgeted:
+                num_samples = min(len(dataset), max_samples) if max_samples else len(dataset)
+                threads = tf.config.threading.get_intra_op_parallelism_threads() or available_cpus()
+                plan = training_budget.plan_training(cost_report, num_samples, validation_split=0.2,
+                                                     threads=threads)
+                batch_size = plan['batch_size']
+                logger.info(f"训练规划: 批大小={batch_size}，{plan['epochs']}轮，每轮{plan['steps_per_epoch']}"
+                            f"/{plan['full_steps_per_epoch']}步，验证{plan['validation_steps']}步")
+            train_data, validation_data = make_tf_datasets(
+                tf, dataset, batch_size=batch_size, validation_split=0.2, max_samples=max_samples, seed=seed)
+            with timer.phase('train'):
+                train_model(model, train_data, log_dir, validation_data=validation_data, progress=progress,
+                            profile=profile, timer=timer, profile_batch=profile_batch,
+                            jit_compile=jit_compile, learning_rate=learning_rate,
+                            training_budget=training_budget if budgeted else None, writer=writer)
+            if budgeted and training_budget.truncated:
+                logger.warning(f"训练被截断（{training_budget.reason}），已完成 {training_budget.steps} 步")
+        else:
+            logger.info("按开销预算降级：跳过训练，仅记录模型结构")
         
         # 生成一些额外的自定义指标
         logger.info("生成额外的可视化指标...")
-        metrics_log_dir = os.path.join(log_dir, 'metrics')
-        os.makedirs(metrics_log_dir, exist_ok=True)
+        if progress is not None:
+            progress.phase('write_logs')
         
-        file_writer = tf.summary.create_file_writer(metrics_log_dir)
-        with file_writer.as_default():
-            # 添加一些自定义标量
-            for i in range(10):
-                value = np.random.random()
-                tf.summary.scalar('custom_metric', value, step=i)
+        # 截止时间已过时只写必要的摘要，跳过随机指标、样本图像和计算图追踪
+        expired = budgeted and training_budget.expired()
+        with timer.phase('write_summaries'):
+            with writer.scope('metrics'):
+                if profile['extra_summaries'] and not expired:
+                    # 添加一些自定义标量
+                    for i in range(10):
+                        value = np.random.random()
+                        tf.summary.scalar('custom_metric', value, step=i)
+                        
+                    # 添加一些测试图像
+                    if len(x_train.shape) == 4 and x_train.shape[3] in [1, 3]:
+                        # 只对图像数据添加图像摘要
+                        test_images = np.asarray(x_train[:5])
+                        tf.summary.image("test_images", test_images, max_outputs=5, step=0)
                 
-            # 添加一些测试图像
-            if len(x_train.shape) == 4 and x_train.shape[3] in [1, 3]:
-                # 只对图像数据添加图像摘要
-                test_images = x_train[:5]
-                tf.summary.image("test_images", test_images, max_outputs=5, step=0)
-            
-            # 记录模型结构作为文本
-            model_summary = []
-            model.summary(print_fn=lambda x: model_summary.append(x))
-            tf.summary.text("model_summary", "\n".join(model_summary), step=0)
-            
-            # 添加模型图
-            tf.summary.trace_export(
-                name="model_trace",
-                step=0,
-                profiler_outdir=metrics_log_dir
-            )
-            
-            # 确保所有摘要都被写入
-            tf.summary.flush()
+                # 记录模型摘要、层信息和开销估算
+                write_model_summaries(model, cost_report)
+                
+                # 添加模型图：追踪一次前向计算后导出
+                if profile['trace'] and not expired:
+                    write_graph_trace(model, np.asarray(x_train[:1]))
+                
+                if budgeted and training_budget.truncated:
+                    tf.summary.text("truncated", f"训练被截断: {training_budget.reason}，"
+                                    f"完成 {training_budget.steps} 步", step=0)
         
         # 最终检查生成的日志文件
         all_files = []
@@ -431,14 +506,19 @@ def generate_tensorboard_logs(model, log_dir=None):
         
         # 创建样本数据点文件，确保TensorBoard能找到一些数据
         sample_data_file = os.path.join(log_dir, 'sample_data.json')
-        with open(sample_data_file, 'w') as f:
-            sample_data = {
-                "model_name": "TensorFlow Model",
-                "layers": [layer.name for layer in model.layers],
-                "metrics": ["accuracy", "loss"],
-                "timestamp": datetime.now().isoformat()
-            }
-            json.dump(sample_data, f, indent=2)
+        sample_data = {
+            "model_name": "TensorFlow Model",
+            "layers": [layer.name for layer in model.layers],
+            "metrics": ["accuracy", "loss"],
+            "timestamp": datetime.now().isoformat()
+        }
+        write_json_atomic(sample_data_file, sample_data)
+        
+        # 开销报告同时以JSON保存，便于后端直接读取
+        if cost_report:
+            write_json_atomic(os.path.join(log_dir, 'cost_report.json'), cost_report)
+        if budgeted:
+            write_json_atomic(os.path.join(log_dir, TRAINING_FILE), training_budget.to_json())
         
         logger.info("TensorBoard日志生成完成")
         return log_dir
@@ -446,142 +526,677 @@ def generate_tensorboard_logs(model, log_dir=None):
         logger.error(f"生成TensorBoard日志过程中发生错误: {str(e)}")
         logger.error(traceback.format_exc())
         
-        # 创建一个最简单的日志文件以确保TensorBoard能找到它
-        emergency_log_dir = os.path.join(log_dir, 'emergency')
-        os.makedirs(emergency_log_dir, exist_ok=True)
-        
+        # 在同一个事件文件中写入应急摘要，确保TensorBoard能看到错误信息
         try:
-            with tf.summary.create_file_writer(emergency_log_dir).as_default():
+            with writer.scope(EMERGENCY_NAMESPACE):
                 for i in range(10):
                     tf.summary.scalar("emergency_metric", float(i), step=i)
                 tf.summary.text("error_message", str(e), step=0)
-                tf.summary.flush()
             
-            logger.info(f"已创建应急日志文件在: {emergency_log_dir}")
+            logger.info(f"已在日志中写入应急摘要: {EMERGENCY_NAMESPACE}/")
         except Exception as ee:
             logger.error(f"创建应急日志也失败: {str(ee)}")
         
         # 尽管发生错误，仍然返回日志目录
         # 这样TensorBoard至少可以显示任何已生成的日志
         return log_dir
+    finally:
+        if own_writer:
+            writer.close()
 
 def parse_arguments():
     """处理命令行参数"""
     parser = argparse.ArgumentParser(description='将模型结构转换为TensorBoard可视化')
-    parser.add_argument('data_file', help='包含模型结构的JSON文件')
-    parser.add_argument('--output-dir', help='TensorBoard日志输出目录')
-    return parser.parse_args()
+    parser.add_argument('data_files', nargs='*', metavar='data_file',
+                        help='包含模型结构的JSON文件，"-"表示从stdin读取（管道模式）；多个文件、目录或glob模式时进入批量模式')
+    parser.add_argument('--input-format', choices=list(INPUT_FORMATS), default=AUTO,
+                        help='模型数据格式：auto按内容判断，json或msgpack')
+    parser.add_argument('--output-format', choices=list(OUTPUT_FORMATS), default='json',
+                        help='输出到stdout的结果文档格式：紧凑的单行JSON或msgpack')
+    parser.add_argument('--output-dir', help='TensorBoard日志输出目录（批量模式下为输出根目录）')
+    parser.add_argument('--validate-only', action='store_true',
+                        help='只做形状推断和参数检查（不导入TensorFlow），把验证报告以JSON输出到stdout')
+    parser.add_argument('--cost-report', action='store_true',
+                        help='只估算每层参数量、FLOPs和激活内存（不导入TensorFlow），把报告以JSON输出到stdout')
+    parser.add_argument('--max-params', type=int, help='开销预算：最大参数量')
+    parser.add_argument('--max-flops', type=float, help='开销预算：每步训练的最大FLOPs')
+    parser.add_argument('--max-memory-mb', type=float, help='开销预算：训练内存估计上限(MB)')
+    parser.add_argument('--budget-policy', choices=['reject', 'downgrade'], default='reject',
+                        help='超出开销预算时拒绝任务，或降级为只记录模型结构')
+    parser.add_argument('--serve', action='store_true',
+                        help='以常驻服务模式运行，通过JSON-lines接收转换任务')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='服务模式下预热的工作进程数量（默认2），批量模式下的并行进程数（默认CPU核数）')
+    parser.add_argument('--intra-op-threads', type=parse_thread_count, default=AUTO,
+                        help='每个进程中TensorFlow单个运算使用的线程数；auto（默认）按可用CPU'
+                             '（含cgroup配额）和并发进程数平分，0表示TensorFlow默认值')
+    parser.add_argument('--inter-op-threads', type=parse_thread_count, default=AUTO,
+                        help='每个进程中TensorFlow并行执行运算的线程数；auto（默认）为1或2，0表示TensorFlow默认值')
+    parser.add_argument('--jit-compile', choices=list(SWITCH_VALUES), default=AUTO,
+                        help='训练时是否用XLA编译模型，auto使用Keras的默认行为')
+    parser.add_argument('--onednn', choices=list(SWITCH_VALUES), default=AUTO,
+                        help='是否启用oneDNN优化（设置TF_ENABLE_ONEDNN_OPTS），auto使用TensorFlow的默认行为')
+    parser.add_argument('--socket', help='服务模式下监听的Unix套接字路径（默认使用stdin/stdout）')
+    parser.add_argument('--max-jobs-per-worker', type=int, default=None,
+                        help='服务模式下每个工作进程处理多少个任务后重启，用于限制内存增长')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='训练使用的随机种子')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='数据源.npy缓存目录')
+    parser.add_argument('--data-root', default=None,
+                        help='数据源节点的dataPath允许读取的根目录，默认为--data-dir')
+    parser.add_argument('--profile', metavar='START,END', default=None,
+                        help='对训练的第START到END个批次运行TensorFlow性能分析器（如"2,5"，单个数字只分析一个批次）')
+    parser.add_argument('--log-profile', choices=list(LOGGING_PROFILES), default=DEFAULT_LOGGING_PROFILE,
+                        help='日志配置档：graph-only只记录模型图，fast只记录标量，full记录直方图、图像等全部内容')
+    parser.add_argument('--max-samples', type=int, default=DEFAULT_MAX_SAMPLES,
+                        help='训练最多使用的样本数（含验证部分），0表示使用全部样本')
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help='每个任务的时间预算（秒），到达后停止训练并写出已有日志，运行标记为truncated')
+    parser.add_argument('--max-steps', type=int, default=None,
+                        help='每个任务最多训练的批次数（所有轮次合计）')
+    parser.add_argument('--progress', action='store_true',
+                        help='把阶段、批次、轮次进度和最终结果以JSON-lines实时输出到stdout')
+    parser.add_argument('--debug-dump', action='store_true',
+                        help='把收到的完整模型数据保存到日志目录的debug_data.json（默认关闭）')
+    parser.add_argument('--latency-benchmark', action='store_true',
+                        help='训练前测量模型和TFLite变体的CPU推理延迟，写入latency.json和latency标量')
+    parser.add_argument('--latency-batch-sizes', default=','.join(str(b) for b in DEFAULT_BATCH_SIZES),
+                        help='延迟测量的批大小列表（逗号分隔）')
+    parser.add_argument('--latency-iterations', type=int, default=DEFAULT_ITERATIONS,
+                        help='每个批大小的计时推理次数')
+    parser.add_argument('--latency-warmup', type=int, default=DEFAULT_WARMUP, help='每个批大小计时前的预热次数')
+    parser.add_argument('--latency-no-tflite', action='store_true', help='延迟测量时跳过TFLite变体')
+    parser.add_argument('--distribute-workers', type=int, default=0,
+                        help='数据并行训练的本地工作进程数（MultiWorkerMirroredStrategy），0或1表示不开启')
+    parser.add_argument('--threads-per-worker', type=parse_thread_count, default=AUTO,
+                        help='数据并行时每个工作进程的算子内线程数；auto按可用CPU和工作进程数平分')
+    parser.add_argument('--session', help='会话标识：按会话增量构建，只重建画布上改动的部分并热启动未改动的层')
+    parser.add_argument('--session-dir', default=DEFAULT_SESSION_DIR, help='增量构建的会话状态目录')
+    parser.add_argument('--summary-max-queue', type=int, default=DEFAULT_MAX_QUEUE,
+                        help='摘要写入器在内存中最多排队的事件数，队列满时写盘')
+    parser.add_argument('--summary-flush-secs', type=float, default=DEFAULT_FLUSH_SECS,
+                        help='摘要写入器自动写盘的间隔（秒）；运行结束时总会flush并fsync一次')
+    parser.add_argument('--no-cache', action='store_true', help='禁用结果缓存')
+    parser.add_argument('--cache-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tb_cache'),
+                        help='结果缓存目录')
+    parser.add_argument('--cache-max-entries', type=int, default=200, help='结果缓存最多保留的条目数')
+    parser.add_argument('--cache-max-mb', type=int, default=2048, help='结果缓存的总大小上限(MB)')
+    parser.add_argument('--cache-max-age-hours', type=float, default=168, help='结果缓存条目的最长存活时间(小时)')
+    args = parser.parse_args()
+    if not args.serve and not args.data_files:
+        parser.error('必须提供data_file，或使用--serve启动服务模式')
+    if args.distribute_workers < 0:
+        parser.error('--distribute-workers不能为负数')
+    if args.summary_max_queue < 1 or args.summary_flush_secs <= 0:
+        parser.error('--summary-max-queue和--summary-flush-secs必须为正数')
+    if args.time_budget is not None and args.time_budget <= 0:
+        parser.error('--time-budget必须为正数')
+    if args.max_steps is not None and args.max_steps <= 0:
+        parser.error('--max-steps必须为正整数')
+    if args.progress and args.output_format != 'json':
+        parser.error('--progress的事件流只支持JSON输出')
+    if args.profile:
+        try:
+            args.profile = parse_profile_batch(args.profile)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
 
-def main():
-    """主程序入口"""
-    # 解析命令行参数
-    args = parse_arguments()
-    
-    # 加载模型数据
-    data_path = args.data_file
-    logger.info(f"加载模型数据: {data_path}")
+def load_model_data(data_path, timer=None, data_format=AUTO):
+    """从文件或stdin（data_path为'-'）加载模型数据，失败时抛出异常
+
+    data_format为auto、json或msgpack，auto时按内容判断。
+    """
+    timer = timer or PhaseTimer()
+    from_stdin = data_path == STDIN_PATH
+    logger.info(f"加载模型数据: {'stdin' if from_stdin else data_path}")
     
-    try:
-        with open(data_path, 'r', encoding='utf-8') as f:
-            model_data = json.load(f)
-            
-        # 调试：打印接收到的数据结构
-        logger.info(f"接收到的数据结构键: {json.dumps(list(model_data.keys()))}")
-        logger.info(f"modelStructure长度: {len(model_data.get('modelStructure', []))}")
-        logger.info(f"edges长度: {len(model_data.get('edges', []))}")
-        
-        # 打印完整的数据结构以进行调试
-        logger.info("完整的JSON数据:")
-        with open(os.path.join(os.path.dirname(__file__), 'debug_data.json'), 'w', encoding='utf-8') as f:
-            json.dump(model_data, f, indent=2, ensure_ascii=False)
-        logger.info(f"已将完整数据保存到debug_data.json文件中")
-        
-        # 打印更详细的结构信息
-        if 'modelStructure' in model_data and len(model_data['modelStructure']) > 0:
-            layer_types = [layer.get('type') for layer in model_data['modelStructure']]
-            logger.info(f"层类型: {layer_types}")
-            
-            # 打印第一个层的配置示例
-            first_layer = model_data['modelStructure'][0]
-            logger.info(f"第一个层 ({first_layer.get('type')}) 配置: {json.dumps(first_layer.get('config', {}))}")
+    with timer.phase('load_json'):
+        if from_stdin:
+            raw = sys.stdin.buffer.read()
         else:
-            logger.warning("没有找到有效的模型结构数据或结构为空")
-        
-        if 'edges' in model_data and len(model_data['edges']) > 0:
-            logger.info(f"连接示例: {json.dumps(model_data['edges'][0])}")
-        else:
-            logger.warning("没有找到有效的连接数据或连接为空")
-    except json.JSONDecodeError as je:
-        logger.error(f"JSON解析错误: {str(je)}")
-        logger.error(traceback.format_exc())
-        # 尝试读取文件的前100个字符以查看格式问题
+            with open(data_path, 'rb') as f:
+                raw = f.read()
         try:
-            with open(data_path, 'r', encoding='utf-8') as f:
-                content = f.read(200)
-                logger.error(f"JSON文件内容前200个字符: {content}")
-        except Exception:
-            pass
-        sys.exit(1)
-    except Exception as e:
-        logger.error(f"加载JSON数据失败: {str(e)}")
-        logger.error(traceback.format_exc())
-        sys.exit(1)
+            model_data = decode_payload(raw, data_format)
+        except ValueError as e:
+            # json.JSONDecodeError也是ValueError；数据已在内存中，不再重新读取
+            logger.error(f"模型数据解析错误: {str(e)}，前200个字节: {raw[:200]!r}")
+            raise
+    
+    layers = model_data.get('modelStructure') or []
+    edges = model_data.get('edges') or []
+    logger.info(f"模型数据: {len(raw)}字节，{len(layers)}个层，{len(edges)}条连接")
+    if not layers:
+        logger.warning("没有找到有效的模型结构数据或结构为空")
+    if not edges:
+        logger.warning("没有找到有效的连接数据或连接为空")
+    # 详细结构只在调试级别输出，避免每个请求都把整个模型再序列化一遍
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"层类型: {[layer.get('type') for layer in layers]}")
+    
+    return model_data
+
+def configure_threads(intra_op_threads=AUTO, inter_op_threads=AUTO, concurrent_jobs=1, onednn=None):
+    """设置oneDNN开关后导入TensorFlow并限制线程池大小，必须在执行任何运算之前调用
+
+    线程数为auto时按可用CPU（含cgroup配额）和同时运行的任务数自动计算，
+    为0时使用TensorFlow的默认值。返回实际设置的(intra_op, inter_op)。
+    """
+    configure_onednn(onednn)
+    tf = load_tensorflow()
+    intra_op_threads, inter_op_threads = resolve_thread_counts(
+        intra_op_threads, inter_op_threads, concurrent_jobs)
+    if intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    if intra_op_threads or inter_op_threads:
+        logger.info(f"TensorFlow线程数: intra_op={intra_op_threads}, inter_op={inter_op_threads}")
+    return intra_op_threads, inter_op_threads
+
+def set_random_seed(seed):
+    """固定Python、NumPy和TensorFlow的随机种子，使同一模型的运行结果可复现"""
+    random.seed(seed)
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+
+def default_log_dir(prefix=''):
+    """生成tb_logs下不会与并发任务冲突的日志目录"""
+    name = f"{prefix}{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tb_logs', name)
+
+def write_debug_dump(model_data, log_dir):
+    """把收到的完整模型数据保存到本任务日志目录的debug_data.json"""
+    path = write_json_atomic(os.path.join(log_dir, DEBUG_DUMP_FILE), model_data)
+    logger.info(f"已将完整数据保存到: {path}")
+    return path
+
+def finalize_log_dir(log_dir):
+    """在日志目录内原子地写入成功标记，返回成功标记路径
+
+    标记和其他产物都只写在本任务的日志目录中，不再写入父目录或创建全局logs链接，
+    因此多个任务可以同时运行。
+    """
+    success_marker = write_text_atomic(os.path.join(log_dir, READY_MARKER), os.path.abspath(log_dir))
+    logger.info(f"TensorBoard准备就绪，成功标记写入: {success_marker}")
+    logger.info(f"TensorBoard日志目录: {os.path.abspath(log_dir)}")
+    return success_marker
+
+def measure_latency(model, log_dir, options, writer):
+    """测量模型的推理延迟，写入日志目录的latency.json和运行的latency/标量，返回报告"""
+    # TFLite解释器使用与TensorFlow相同的线程数，结果可以直接比较
+    num_threads = tf.config.threading.get_intra_op_parallelism_threads() or None
+    report = benchmark_model(tf, model, options, num_threads=num_threads)
+    write_json_atomic(os.path.join(log_dir, LATENCY_FILE), report)
+    # 标签本身带latency/前缀，不再加命名空间
+    with writer.scope():
+        write_latency_summaries(tf, report)
+    for r in report['keras']:
+        logger.info(f"推理延迟 批大小={r['batch_size']}: p50={r['p50_ms']}ms, p99={r['p99_ms']}ms")
+    return report
+
+def convert_model_data(model_data, output_dir=None, cache=None, seed=DEFAULT_SEED, budget=None,
+                       progress=None, data_dir=DEFAULT_DATA_DIR, max_samples=DEFAULT_MAX_SAMPLES,
+                       log_profile=DEFAULT_LOGGING_PROFILE, timer=None, profile_batch=0,
+                       debug_dump=False, jit_compile=None, latency=None, learning_rate=None,
+                       hparams=None, training_budget=None, summary_options=None, distribute=None,
+                       strategy=None, session=None, session_dir=None, thread_options=None):
+    """根据模型数据创建模型并生成TensorBoard日志，返回日志目录
+    
+    cache为ResultCache实例时，相同内容的模型直接复用已生成的日志。
+    budget为开销预算（max_params、max_flops、max_memory_mb和policy），
+    超出预算时按policy拒绝（reject，默认）或降级为不训练（downgrade）。
+    progress为ProgressReporter时输出阶段和训练进度事件，最终结果由调用方输出。
+    数据源节点的数据缓存在data_dir中，训练最多使用max_samples个样本。
+    log_profile为日志配置档名称（graph-only、fast或full）。
+    timer为PhaseTimer，各阶段耗时写入日志目录的timings.json和timings标量；
+    profile_batch不为0时对该批次范围运行TensorFlow性能分析，此时不使用缓存。
+    debug_dump为True时把收到的模型数据保存到日志目录的debug_data.json。
+    jit_compile为True/False时开启/关闭模型的XLA编译，None时使用Keras的默认行为。
+    latency为True或延迟测量选项（batch_sizes、iterations、warmup、tflite）时，
+    在训练之前测量模型的CPU推理延迟，结果写入latency.json和latency标量。
+    learning_rate为训练使用的学习率；hparams为超参数搜索中本次试验的取值，
+    以HParams插件的格式写入日志目录。
+    training_budget为TrainingBudget时限制整个任务的时间和训练步数，调用方在返回后
+    从它读取是否被截断；被截断的结果不写入缓存。
+    summary_options为摘要写入器的max_queue和flush_secs，所有摘要写入运行根目录
+    下的同一个事件文件，结束时flush并fsync一次。
+    distribute为数据并行选项（True、工作进程数或{workers, threads_per_worker}）时，
+    需要训练的任务由新启动的工作进程以MultiWorkerMirroredStrategy完成，见
+    distributed_training.py；strategy只在这些工作进程中传入，模型在其作用域内构建。
+    session为会话标识时按会话增量构建（见incremental_build.py），状态保存在
+    session_dir下；结果缓存键包含会话状态，同一会话原样重复提交时命中缓存，
+    数据并行模式下不使用增量构建。
+    thread_options为configure_threads的参数，在真正需要TensorFlow时才导入并设置
+    线程数；验证失败、超出预算和命中缓存的任务不导入TensorFlow。
+    """
+    timer = timer or PhaseTimer()
+    latency = latency_options(latency)
+    distribute = distribute_options(distribute)
+    profile = get_logging_profile(log_profile)
+    # 使用指定的输出目录（如果提供）
+    if output_dir:
+        # 确保输出目录是绝对路径
+        log_dir = os.path.abspath(output_dir)
+        logger.info(f"使用指定的输出目录: {log_dir}")
+    else:
+        log_dir = default_log_dir()
+    if debug_dump:
+        with timer.phase('debug_dump'):
+            write_debug_dump(model_data, log_dir)
+    
+    # 导入TensorFlow之前先做形状推断和开销估算，格式错误的模型在毫秒级被拒绝
+    if progress is not None:
+        progress.phase('validate')
+    with timer.phase('validate'):
+        data_spec = describe_data_source(model_data)
+        cost = estimate_cost(model_data, input_shape=data_spec.input_shape)
+    if not cost['valid']:
+        for error in cost['errors']:
+            logger.error(f"节点 {error['id']} ({error['type']}) 验证失败: {error['message']}")
+        raise ValidationError(cost['errors'])
+    totals = cost['totals']
+    logger.info(f"模型验证通过，参数量: {totals['params']}，每步训练FLOPs: {totals['training_flops_per_step']}，"
+                f"激活内存峰值: {totals['peak_activation_bytes']}字节")
+    
+    train = True
+    if budget:
+        violations = check_budget(
+            cost,
+            max_params=budget.get('max_params'),
+            max_flops=budget.get('max_flops'),
+            max_memory_mb=budget.get('max_memory_mb')
+        )
+        if violations:
+            if budget.get('policy', 'reject') != 'downgrade':
+                logger.error(f"模型开销超出预算，拒绝任务: {violations}")
+                raise CostBudgetError(violations)
+            logger.warning(f"模型开销超出预算，降级为不训练: {violations}")
+            train = False
+    
+    # graph-only配置档只导出模型结构
+    graph_only = not profile['train']
+    if graph_only:
+        train = False
+    
+    # 增量构建（数据并行训练时不使用）的结果依赖会话状态，缓存键包含当前的状态
+    session_build = None
+    if session and strategy is None and not (distribute and train):
+        session_build = SessionBuild(session, session_dir)
+    
+    # 查找结果缓存；性能分析需要真实运行，不使用缓存
+    cache_key = None
+    salt = None
+    if cache is not None and not profile_batch:
+        salt = {'seed': seed, 'train': train, 'data': data_spec.fingerprint, 'max_samples': max_samples,
+                'log_profile': log_profile or DEFAULT_LOGGING_PROFILE}
+        if jit_compile is not None:
+            # XLA会改变数值结果；默认值不写入salt，已有的缓存条目仍然有效
+            salt['jit_compile'] = jit_compile
+        if latency:
+            salt['latency'] = latency
+        if learning_rate is not None:
+            salt['learning_rate'] = learning_rate
+        if hparams:
+            salt['hparams'] = hparams
+        if training_budget is not None and training_budget.active:
+            salt['training_budget'] = [training_budget.time_budget, training_budget.max_steps]
+        if distribute:
+            # 数据并行时全局批大小随工作进程数变化
+            salt['distribute'] = distribute['workers']
+        if session_build is not None:
+            # 命中的条目由同一状态下的上一次运行写入，会话状态不需要更新
+            salt['session'] = SessionBuild.state_key(session_build.previous)
+        cache_key = model_data_hash(model_data, salt=salt)
+        with timer.phase('cache_restore'):
+            restored = cache.restore(cache_key, log_dir)
+        if restored:
+            if progress is not None:
+                progress.phase('cache_hit', key=cache_key)
+            timer.write_json(log_dir)
+            if session_build is not None:
+                session_build.cached = True
+                session_build.write_report(log_dir)
+            finalize_log_dir(log_dir)
+            return log_dir
+    
+    started = time.time()
+    # 数据源加载失败时退回随机数据，结果与缓存键中的数据源不符，不写入缓存
+    data_fallback = False
+    
+    # 数据并行：本进程只负责启动工作进程并转发chief的进度，日志和成功标记由chief写入
+    if distribute and train and strategy is None:
+        from distributed_training import run_distributed
+        from hparam_sweep import warm_data_cache
+        if latency:
+            logger.warning("数据并行模式下不测量推理延迟")
+        if data_spec.kind is not None:
+            # 先解析一次数据源，各工作进程直接内存映射.npy缓存
+            data_fallback = not warm_data_cache(model_data, data_dir)
+        if progress is not None:
+            progress.phase('distributed', workers=distribute['workers'])
+        job = {
+            'data': model_data, 'seed': seed, 'data_dir': data_dir, 'max_samples': max_samples,
+            'log_profile': log_profile, 'profile_batch': profile_batch, 'jit_compile': jit_compile,
+            'learning_rate': learning_rate, 'hparams': hparams, 'summary_options': summary_options,
+        }
+        with timer.phase('distributed'):
+            run_distributed(job, log_dir, distribute, training_budget=training_budget, progress=progress)
+        # 工作进程的缓存键不含时间预算，由本进程按上面的键写入缓存
+        if cache_key and not data_fallback and not (training_budget is not None and training_budget.truncated):
+            with timer.phase('cache_store'):
+                cache.store(cache_key, log_dir, since=started)
+        timer.write_json(log_dir)
+        return log_dir
+    
+    # 加载数据：第一次使用时解析并写入.npy缓存，之后直接内存映射
+    dataset = None
+    if train and data_spec.kind is not None:
+        if progress is not None:
+            progress.phase('load_data', source=data_spec.kind)
+        try:
+            with timer.phase('load_data'):
+                dataset = load_dataset(data_spec, data_dir)
+        except Exception as e:
+            logger.error(f"加载数据源失败，使用随机数据: {str(e)}")
+            logger.error(traceback.format_exc())
+            data_fallback = True
+    num_classes = dataset.num_classes if dataset is not None else NUM_CLASSES
+    if num_classes != NUM_CLASSES:
+        # 输出层大小随类别数变化，重新估算开销
+        cost = estimate_cost(model_data, input_shape=data_spec.input_shape, num_classes=num_classes)
+    
+    if progress is not None:
+        progress.phase('build', params=cost['totals']['params'])
+    with timer.phase('tf_import'):
+        if thread_options is not None:
+            configure_threads(**thread_options)
+        else:
+            load_tensorflow()
+    set_random_seed(seed)
+    
     
-    # 创建模型
+    # 创建模型；数据并行时在strategy的作用域内创建，变量在各进程间镜像
     try:
-        model = create_model_from_data(model_data)
+        with timer.phase('create_model'), (strategy.scope() if strategy is not None else nullcontext()):
+            model = create_model_from_data(model_data, data_spec.input_shape, num_classes, timer=timer,
+                                           session_build=session_build)
         logger.info("模型创建成功")
         model.summary()
     except Exception as e:
         logger.error(f"创建模型失败: {str(e)}")
         logger.error(traceback.format_exc())
-        sys.exit(1)
+        raise
+    
+    if latency and strategy is not None:
+        latency = None
     
-    # 生成TensorBoard日志
+    # 整个运行只用一个摘要写入器，所有摘要按命名空间写入同一个事件文件
+    writer = RunWriter(tf, log_dir, **writer_options(**(summary_options or {})))
     try:
-        # 使用指定的输出目录（如果提供）
-        log_dir = None
-        if args.output_dir:
-            # 确保输出目录是绝对路径
-            log_dir = os.path.abspath(args.output_dir)
-            logger.info(f"使用指定的输出目录: {log_dir}")
-        
-        log_dir = generate_tensorboard_logs(model, log_dir)
-        
-        # 创建成功标记文件 - 写入绝对路径
-        success_marker = os.path.join(os.path.dirname(log_dir), 'tb_ready.txt')
-        with open(success_marker, 'w') as f:
-            f.write(os.path.abspath(log_dir))
+        # 推理延迟测量在训练之前进行，不与训练争抢CPU
+        if latency:
+            if progress is not None:
+                progress.phase('latency', batch_sizes=latency['batch_sizes'])
+            with timer.phase('latency'):
+                measure_latency(model, log_dir, latency, writer)
         
-        # 创建一个符号链接到标准logs目录以确保TensorBoard默认可以找到它
-        standard_log_dir = os.path.join(os.path.dirname(os.path.dirname(log_dir)), 'logs')
-        if not os.path.exists(standard_log_dir):
-            try:
-                # 在不同操作系统上创建符号链接或副本
-                if os.name == 'nt':  # Windows
-                    os.makedirs(os.path.dirname(standard_log_dir), exist_ok=True)
-                    import shutil
-                    if os.path.exists(standard_log_dir):
-                        shutil.rmtree(standard_log_dir)
-                    shutil.copytree(log_dir, standard_log_dir)
-                    logger.info(f"已复制日志目录到标准位置: {standard_log_dir}")
-                else:  # Unix/Linux/Mac
-                    os.makedirs(os.path.dirname(standard_log_dir), exist_ok=True)
-                    os.symlink(log_dir, standard_log_dir)
-                    logger.info(f"已创建日志目录符号链接: {log_dir} -> {standard_log_dir}")
-            except Exception as link_error:
-                logger.error(f"创建标准日志目录链接失败: {str(link_error)}")
-        
-        logger.info(f"TensorBoard准备就绪，成功标记写入: {success_marker}")
+        # 生成TensorBoard日志
+        try:
+            with timer.phase('generate_logs'):
+                if graph_only:
+                    log_dir = generate_graph_logs(model, log_dir, cost_report=cost, progress=progress,
+                                                  timer=timer, writer=writer)
+                else:
+                    log_dir = generate_tensorboard_logs(model, log_dir, cost_report=cost, train=train,
+                                                        progress=progress, dataset=dataset,
+                                                        max_samples=max_samples, seed=seed, profile=profile,
+                                                        timer=timer, profile_batch=profile_batch,
+                                                        jit_compile=jit_compile, learning_rate=learning_rate,
+                                                        training_budget=training_budget, writer=writer)
+                if hparams:
+                    write_trial_summary(writer, hparams)
+            # 训练后的模型作为这个会话下一次构建的基础；保存失败不影响本次结果
+            if session_build is not None and train:
+                try:
+                    with timer.phase('save_session'):
+                        session_build.save(model)
+                except Exception as e:
+                    logger.warning(f"保存会话 {session} 的构建状态失败: {str(e)}")
+        except Exception as e:
+            logger.error(f"生成TensorBoard日志失败: {str(e)}")
+            logger.error(traceback.format_exc())
+            raise
         
-        # 输出最终结果，包括所有可能的TensorBoard目录
-        logger.info(f"TensorBoard可以通过以下任一目录访问:")
-        logger.info(f"1. 实际日志目录: {os.path.abspath(log_dir)}")
-        logger.info(f"2. 标准logs目录: {os.path.abspath(standard_log_dir)}")
+        # 耗时标量随事件文件一起关闭；命中缓存时事件文件中的耗时是生成这份日志的那次运行的
+        timer.write_scalars(tf, writer)
+    finally:
+        writer.close()
+    
+    # 缓存以硬链接保存文件，事件文件关闭后才能写入缓存；出现应急摘要说明生成过程失败，
+    # 不写入缓存；被截断的结果与机器负载有关，退回随机数据的结果与缓存键中的数据源不符，
+    # 同样不缓存
+    truncated = training_budget is not None and training_budget.truncated
+    if cache_key and session_build is not None:
+        # 会话任务以运行后的状态为键：同一会话原样重复提交时命中这次的结果；
+        # 需要训练但会话状态没有保存成功时不缓存
+        if train and session_build.saved is None:
+            cache_key = None
+        else:
+            salt['session'] = SessionBuild.state_key(session_build.saved or session_build.previous)
+            cache_key = model_data_hash(model_data, salt=salt)
+    if cache_key and not truncated and not data_fallback and EMERGENCY_NAMESPACE not in writer.namespaces:
+        with timer.phase('cache_store'):
+            cache.store(cache_key, log_dir, since=started)
+    
+    # timings.json和incremental.json在写入缓存之后生成，缓存命中时不会带出上一次运行的内容
+    timer.write_json(log_dir)
+    if session_build is not None:
+        session_build.write_report(log_dir)
+    # 成功标记在事件文件关闭后最后写入，读取方看到它时其余文件都已完整
+    finalize_log_dir(log_dir)
+    return log_dir
+
+def cache_settings_from_args(args):
+    """根据命令行参数生成结果缓存配置，禁用缓存时返回None"""
+    if args.no_cache:
+        return None
+    return {
+        'cache_dir': args.cache_dir,
+        'max_entries': args.cache_max_entries,
+        'max_bytes': int(args.cache_max_mb * 1024 * 1024),
+        'max_age': args.cache_max_age_hours * 3600
+    }
+
+def budget_from_args(args):
+    """根据命令行参数生成开销预算，没有设置任何上限时返回None"""
+    if args.max_params is None and args.max_flops is None and args.max_memory_mb is None:
+        return None
+    return {
+        'max_params': args.max_params,
+        'max_flops': args.max_flops,
+        'max_memory_mb': args.max_memory_mb,
+        'policy': args.budget_policy
+    }
+
+def latency_from_args(args):
+    """根据命令行参数生成推理延迟测量选项，未开启时返回None"""
+    if not args.latency_benchmark:
+        return None
+    return {
+        'batch_sizes': [int(b) for b in args.latency_batch_sizes.split(',') if b.strip()],
+        'iterations': args.latency_iterations,
+        'warmup': args.latency_warmup,
+        'tflite': not args.latency_no_tflite
+    }
+
+def distribute_from_args(args):
+    """根据命令行参数生成数据并行选项，未开启时返回None"""
+    return distribute_options({'workers': args.distribute_workers, 'threads_per_worker': args.threads_per_worker}
+                              if args.distribute_workers else None)
+
+def worker_options_from_args(args):
+    """汇总工作进程（服务模式和批量模式）使用的转换选项"""
+    return {
+        'cache_settings': cache_settings_from_args(args),
+        'seed': args.seed,
+        'budget': budget_from_args(args),
+        'intra_op_threads': args.intra_op_threads,
+        'inter_op_threads': args.inter_op_threads,
+        'data_dir': args.data_dir,
+        'max_samples': args.max_samples,
+        'log_profile': args.log_profile,
+        'profile_batch': args.profile or 0,
+        'debug_dump': args.debug_dump,
+        'jit_compile': parse_switch(args.jit_compile),
+        'latency': latency_from_args(args),
+        'time_budget': args.time_budget,
+        'max_steps': args.max_steps,
+        'summary_options': writer_options(args.summary_max_queue, args.summary_flush_secs),
+        'distribute': distribute_from_args(args),
+        'session_dir': args.session_dir,
+        'onednn': parse_switch(args.onednn)
+    }
+
+def main():
+    """主程序入口"""
+    # 子命令gc：日志目录的保留、压缩和垃圾回收
+    if sys.argv[1:2] == ['gc']:
+        from log_retention import main as gc_main
+        gc_main(sys.argv[2:])
+        return
+    # 子命令export：把运行的事件文件导出为JSON，不需要TensorBoard服务
+    if sys.argv[1:2] == ['export']:
+        from event_reader import main as export_main
+        export_main(sys.argv[2:])
+        return
+    
+    # 解析命令行参数
+    args = parse_arguments()
+    timer = PhaseTimer()
+    # dataPath来自请求，只允许读取数据根目录内的文件；通过环境变量传给各工作进程
+    configure_data_root(args.data_root or args.data_dir)
+    
+    # 服务模式：预热工作进程并持续处理任务
+    if args.serve:
+        from converter_server import serve
+        serve(workers=args.workers or 2, socket_path=args.socket,
+              max_jobs_per_worker=args.max_jobs_per_worker,
+              worker_options=worker_options_from_args(args))
+        return
+    
+    # 批量模式：多个文件、目录或glob，用进程池并行转换并输出JSON汇总
+    from batch_convert import is_batch_input, expand_inputs, run_batch
+    if is_batch_input(args.data_files):
+        files = expand_inputs(args.data_files)
+        if not files:
+            logger.error("没有找到需要转换的模型文件")
+            sys.exit(1)
+        output_root = os.path.abspath(args.output_dir or default_log_dir('batch-'))
+        summary = run_batch(files, output_root, workers=args.workers,
+                            worker_options=worker_options_from_args(args))
+        print(json.dumps(summary, ensure_ascii=False))
+        sys.exit(0 if summary['failed'] == 0 else 1)
+    
+    # 管道模式（data_file为"-"）：从stdin读取模型数据，stdout只输出一个结果文档
+    pipe_mode = args.data_files[0] == STDIN_PATH
+    
+    # 加载模型数据
+    try:
+        model_data = load_model_data(args.data_files[0], timer=timer, data_format=args.input_format)
     except Exception as e:
-        logger.error(f"生成TensorBoard日志失败: {str(e)}")
+        logger.error(f"加载模型数据失败: {str(e)}")
         logger.error(traceback.format_exc())
+        if pipe_mode:
+            write_result(sys.stdout.buffer, {'status': 'error', 'error': f"加载模型数据失败: {str(e)}"},
+                         args.output_format)
+        sys.exit(1)
+    
+    # 仅验证模式：输出报告，验证失败时退出码为2
+    if args.validate_only:
+        report = validate_model_data(model_data)
+        write_result(sys.stdout.buffer, report, args.output_format)
+        sys.exit(0 if report['valid'] else 2)
+    
+    # 仅开销估算模式：超出预算时退出码为3
+    if args.cost_report:
+        cost = estimate_cost(model_data)
+        budget = budget_from_args(args)
+        if cost['valid'] and budget:
+            cost['budget_violations'] = check_budget(
+                cost, budget['max_params'], budget['max_flops'], budget['max_memory_mb'])
+        write_result(sys.stdout.buffer, cost, args.output_format)
+        if not cost['valid']:
+            sys.exit(2)
+        sys.exit(3 if cost.get('budget_violations') else 0)
+    
+    # 超参数搜索：拆分为多个试验，用进程池并行运行并输出汇总
+    if 'sweep' in model_data:
+        from hparam_sweep import run_sweep
+        output_root = os.path.abspath(args.output_dir or default_log_dir('sweep-'))
+        try:
+            summary = run_sweep(model_data, output_root, workers=args.workers,
+                                worker_options=worker_options_from_args(args))
+        except ValueError as e:
+            logger.error(f"超参数搜索配置无效: {str(e)}")
+            summary = {'status': 'error', 'error': str(e), 'failed': 1}
+        if summary['status'] == 'ok':
+            finalize_log_dir(output_root)
+        write_result(sys.stdout.buffer, summary, args.output_format)
+        sys.exit(0 if summary['failed'] == 0 else 1)
+    
+    progress = None
+    result_stream = None
+    if args.progress or pipe_mode:
+        # stdout只保留进度事件和结果：复制一份原stdout，其余输出（model.summary等）转到stderr
+        sys.stdout.flush()
+        result_stream = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    if args.progress:
+        progress = ProgressReporter(stdout_sink(result_stream))
+    
+    def emit_result(result):
+        # 进度模式下结果是最后一个事件，管道模式下是stdout上唯一的文档
+        if progress is not None:
+            progress.emit('result', **result)
+        elif pipe_mode:
+            write_result(result_stream.buffer, result, args.output_format)
+    
+    started = time.time()
+    # 时间预算从加载完模型数据开始计算，包含导入TensorFlow的时间
+    training_budget = TrainingBudget(args.time_budget, args.max_steps, started=started)
+    
+    cache_settings = cache_settings_from_args(args)
+    cache = ResultCache(**cache_settings) if cache_settings else None
+    # TensorFlow在convert_model_data中需要时才导入，拒绝和命中缓存的任务不承担导入开销
+    thread_options = {'intra_op_threads': args.intra_op_threads, 'inter_op_threads': args.inter_op_threads,
+                      'onednn': parse_switch(args.onednn)}
+    try:
+        log_dir = convert_model_data(model_data, args.output_dir, cache=cache, seed=args.seed,
+                                     budget=budget_from_args(args), progress=progress,
+                                     data_dir=args.data_dir, max_samples=args.max_samples,
+                                     log_profile=args.log_profile, timer=timer,
+                                     profile_batch=args.profile or 0, debug_dump=args.debug_dump,
+                                     jit_compile=parse_switch(args.jit_compile),
+                                     latency=latency_from_args(args), training_budget=training_budget,
+                                     summary_options=writer_options(args.summary_max_queue,
+                                                                    args.summary_flush_secs),
+                                     distribute=distribute_from_args(args), session=args.session,
+                                     session_dir=args.session_dir, thread_options=thread_options)
+    except Exception as e:
+        result = {'status': 'error', 'error': str(e), 'elapsed': round(time.time() - started, 3)}
+        # 验证失败时附带每个节点的错误，超出预算时附带超出项
+        if hasattr(e, 'errors'):
+            result['errors'] = e.errors
+        if hasattr(e, 'violations'):
+            result['budget_violations'] = e.violations
+        emit_result(result)
         sys.exit(1)
+    result = {'status': 'ok', 'log_dir': os.path.abspath(log_dir), 'elapsed': round(time.time() - started, 3)}
+    if training_budget.active:
+        result['truncated'] = training_budget.truncated
+        result['steps'] = training_budget.steps
+    emit_result(result)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+常驻转换服务：由预热的工作进程池处理模型转换任务
+
+每个工作进程启动时只导入一次TensorFlow，之后循环处理任务，避免每个请求
+都重新启动Python并支付导入TensorFlow的开销。任务通过stdin或Unix套接字以
+JSON-lines形式提交，每行一个任务，每个任务对应一行结果:
+
+    任务: {"id": "1", "data_file": "/path/model.json", "output_dir": "/path/logs"}
+          {"id": "2", "data": {"modelStructure": [...], "edges": [...]}}
+    结果: {"id": "1", "status": "ok", "log_dir": "/path/logs", "elapsed": 3.21}
+          {"id": "2", "status": "error", "error": "模型结构为空", "elapsed": 0.01}
+
+任务带"validate_only": true时只做形状推断，结果中的report为验证报告；带
+"cost_only": true时只估算开销，结果中的cost为开销报告。任务可以用"budget"
+覆盖服务启动时设置的开销预算，用"log_profile"（graph-only、fast、full）
+选择日志配置档，用"jit_compile"（true/false/"auto"）控制XLA编译，用
+"debug_dump": true把收到的模型数据保存到日志目录的debug_data.json，用
+"latency": true（或{"batch_sizes": [1, 8], "iterations": 50, "warmup": 5}）在训练前
+测量推理延迟，用"time_budget"（秒）和"max_steps"限制任务的时间和训练步数（设置
+后结果带truncated和steps），用"distribute": true（或{"workers": 4,
+"threads_per_worker": 1}）在本机新启动的多个进程上数据并行训练，用"session"按会话
+增量构建（只重建改动的层，未改动的层热启动）。data中带sweep时
+按hparam_sweep拆分为多个试验并行运行，结果为所有试验的汇总。线程数和oneDNN开关在工作进程启动时设置，任务中的
+intra_op_threads/inter_op_threads与之不同时会被忽略并记录警告。每个任务的产物
+只写入自己的output_dir，多个任务可以并发运行。
+
+任务为{"id": "3", "export": {"log_dir": "...", "cursor": {...}, "kinds": [...]}}时
+把该运行的事件文件增量导出为JSON（格式见event_reader.py），在分发进程的线程中
+完成，不占用工作进程。
+
+任务带"progress": true时，在结果之前实时输出带任务id的进度事件（格式见
+progress.py），结果行始终是该任务的最后一行:
+
+    {"id": "1", "event": "epoch", "epoch": 0, "metrics": {"loss": 2.3}, "elapsed": 1.4}
+"""
+
+import concurrent.futures
+import json
+import os
+import sys
+import time
+import threading
+import traceback
+import multiprocessing
+import socketserver
+import logging
+
+from progress import ProgressReporter
+from cpu_tuning import AUTO, parse_switch
+from event_reader import KINDS, export_run
+from hparam_sweep import domains, plan_sweep, summarize_sweep, write_experiment_summary
+from training_budget import TrainingBudget
+
+logger = logging.getLogger(__name__)
+
+# 工作进程内的转换模块（在initializer中导入，TensorFlow随之导入一次）
+_converter = None
+# 工作进程内的结果缓存和转换选项（随机种子、开销预算等）
+_cache = None
+_options = {}
+# 进度事件队列，由分发进程读取并转发
+_progress_queue = None
+# 任务中只能在工作进程启动时生效的线程设置
+THREAD_OPTIONS = ('intra_op_threads', 'inter_op_threads')
+
+def init_worker(options=None, progress_queue=None):
+    """工作进程初始化：重定向标准输出，预先导入TensorFlow并限制线程数
+
+    options可包含cache_settings、seed、budget、intra_op_threads、inter_op_threads、
+    concurrent_jobs（同时运行的工作进程数，auto线程数按它平分CPU）和onednn。
+    """
+    global _converter, _cache, _options, _progress_queue
+    # Keras的训练进度条会写stdout，重定向到stderr以免破坏JSON-lines协议
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    _options = dict(options or {})
+    _progress_queue = progress_queue
+    import convert_tensorboard
+    _converter = convert_tensorboard
+    # oneDNN开关和线程池都必须在TensorFlow初始化之前设置，每个工作进程只设置一次
+    _options['threads'] = _converter.configure_threads(
+        _options.get('intra_op_threads', AUTO), _options.get('inter_op_threads', AUTO),
+        concurrent_jobs=_options.get('concurrent_jobs', 1), onednn=_options.get('onednn'))
+    if _options.get('cache_settings'):
+        from result_cache import ResultCache
+        _cache = ResultCache(**_options['cache_settings'])
+    _options.setdefault('seed', convert_tensorboard.DEFAULT_SEED)
+    logger.info(f"工作进程 {os.getpid()} 已就绪")
+
+def run_job(job):
+    """在工作进程中执行单个转换任务"""
+    job_id = job.get('id')
+    started = time.time()
+    try:
+        if 'data' in job:
+            model_data = job['data']
+        elif job.get('data_file'):
+            model_data = _converter.load_model_data(job['data_file'])
+        else:
+            raise ValueError("任务缺少data或data_file字段")
+
+        if job.get('cost_only'):
+            cost = _converter.estimate_cost(model_data)
+            return {
+                'id': job_id,
+                'status': 'ok' if cost['valid'] else 'invalid',
+                'cost': cost,
+                'elapsed': round(time.time() - started, 3)
+            }
+
+        if job.get('validate_only'):
+            report = _converter.validate_model_data(model_data)
+            return {
+                'id': job_id,
+                'status': 'ok' if report['valid'] else 'invalid',
+                'report': report,
+                'elapsed': round(time.time() - started, 3)
+            }
+
+        if 'sweep' in model_data:
+            # 超参数搜索由分发器拆分为试验任务，工作进程内不能再启动进程池
+            raise ValueError("超参数搜索任务需要通过data字段提交给转换服务，或使用命令行直接运行")
+
+        ignored = {key: job[key] for key, actual in zip(THREAD_OPTIONS, _options['threads'])
+                   if job.get(key) not in (None, AUTO) and job[key] != actual}
+        if ignored:
+            logger.warning(f"任务 {job_id} 的线程设置 {ignored} 被忽略：工作进程的线程池已按 "
+                           f"{_options['threads']} 初始化，请在启动服务时设置")
+
+        progress = None
+        if job.get('progress') and _progress_queue is not None:
+            route = job.get('_route')
+            progress = ProgressReporter(lambda message: _progress_queue.put((route, message)))
+
+        # 时间预算从工作进程开始处理任务时计算
+        training_budget = TrainingBudget(job.get('time_budget', _options.get('time_budget')),
+                                         job.get('max_steps', _options.get('max_steps')), started=started)
+        log_dir = _converter.convert_model_data(
+            model_data, job.get('output_dir'), cache=_cache, seed=job.get('seed', _options['seed']),
+            budget=job.get('budget', _options.get('budget')), progress=progress,
+            data_dir=_options.get('data_dir', _converter.DEFAULT_DATA_DIR),
+            max_samples=job.get('max_samples', _options.get('max_samples', _converter.DEFAULT_MAX_SAMPLES)),
+            log_profile=job.get('log_profile', _options.get('log_profile')),
+            profile_batch=job.get('profile_batch', _options.get('profile_batch', 0)),
+            debug_dump=job.get('debug_dump', _options.get('debug_dump', False)),
+            jit_compile=parse_switch(job.get('jit_compile', _options.get('jit_compile'))),
+            latency=job.get('latency', _options.get('latency')),
+            learning_rate=job.get('learning_rate'),
+            hparams=job.get('hparams'),
+            training_budget=training_budget,
+            summary_options=_options.get('summary_options'),
+            distribute=job.get('distribute', _options.get('distribute')),
+            session=job.get('session'),
+            session_dir=_options.get('session_dir')
+        )
+        result = {
+            'id': job_id,
+            'status': 'ok',
+            'log_dir': os.path.abspath(log_dir),
+            'elapsed': round(time.time() - started, 3)
+        }
+        if training_budget.active:
+            result['truncated'] = training_budget.truncated
+            result['steps'] = training_budget.steps
+        return result
+    except Exception as e:
+        logger.error(f"任务 {job_id} 失败: {str(e)}")
+        logger.error(traceback.format_exc())
+        result = {
+            'id': job_id,
+            'status': 'error',
+            'error': str(e),
+            'elapsed': round(time.time() - started, 3)
+        }
+        # 验证失败时附带每个节点的错误，超出预算时附带超出项
+        if hasattr(e, 'errors'):
+            result['errors'] = e.errors
+        if hasattr(e, 'violations'):
+            result['budget_violations'] = e.violations
+        return result
+    finally:
+        # 清理Keras全局状态，避免常驻进程中的图和层名称不断累积
+        try:
+            _converter.tf.keras.backend.clear_session()
+        except Exception:
+            pass
+
+class _Waitable:
+    """给Future加上与AsyncResult一致的wait()"""
+
+    def __init__(self, future):
+        self.future = future
+
+    def wait(self, timeout=None):
+        concurrent.futures.wait([self.future], timeout=timeout)
+
+class JobDispatcher:
+    """将JSON-lines任务分发到工作进程池，并把结果写回对应的输出流"""
+
+    def __init__(self, workers, max_jobs_per_worker=None, worker_options=None):
+        # 使用spawn而不是fork，TensorFlow在fork后的子进程中不安全
+        context = multiprocessing.get_context('spawn')
+        # SimpleQueue的put是同步写管道，事件一定先于任务结果发出
+        self.progress_queue = context.SimpleQueue()
+        self.pool = context.Pool(
+            processes=workers,
+            initializer=init_worker,
+            initargs=(worker_options, self.progress_queue),
+            maxtasksperchild=max_jobs_per_worker
+        )
+        self.workers = workers
+        # 路由号 -> (任务id, reply)，任务结束后移除，迟到的进度事件直接丢弃
+        self.routes = {}
+        self.routes_lock = threading.Lock()
+        self.next_route = 0
+        self.progress_thread = threading.Thread(target=self._forward_progress, daemon=True)
+        self.progress_thread.start()
+        # 事件文件导出只读文件、不需要TensorFlow，在分发进程的线程中完成
+        self.export_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+    def _forward_progress(self):
+        """把工作进程的进度事件附上任务id，写回提交该任务的输出流"""
+        while True:
+            item = self.progress_queue.get()
+            if item is None:
+                break
+            route, message = item
+            with self.routes_lock:
+                target = self.routes.get(route)
+                if target is not None:
+                    job_id, reply = target
+                    reply(dict(message, id=job_id))
+
+    def submit_line(self, line, reply):
+        """解析一行任务并异步提交，reply(dict)在结果就绪时被调用"""
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError("任务必须是JSON对象")
+        except ValueError as e:
+            reply({'id': None, 'status': 'error', 'error': f"无效的任务JSON: {str(e)}"})
+            return None
+
+        with self.routes_lock:
+            route = self.next_route
+            self.next_route += 1
+            if job.get('progress'):
+                self.routes[route] = (job.get('id'), reply)
+        job['_route'] = route
+
+        def finish(result):
+            # 移除路由和写出结果在同一把锁内，保证结果是该任务的最后一行
+            with self.routes_lock:
+                self.routes.pop(route, None)
+                reply(result)
+
+        def on_error(e):
+            finish({'id': job.get('id'), 'status': 'error', 'error': str(e)})
+
+        if job.get('export'):
+            return self._submit_export(job, finish)
+        data = job.get('data')
+        if isinstance(data, dict) and 'sweep' in data and not (job.get('validate_only') or job.get('cost_only')):
+            return self._submit_sweep(job, reply, finish)
+        return self.pool.apply_async(run_job, (job,), callback=finish, error_callback=on_error)
+
+    def _submit_export(self, job, finish):
+        """在分发进程的线程池中导出事件文件，不占用训练的工作进程；返回可以wait()的Future"""
+        options = job['export'] if isinstance(job['export'], dict) else {}
+        started = time.time()
+
+        def export():
+            try:
+                result = export_run(options['log_dir'], cursor=options.get('cursor'),
+                                    kinds=options.get('kinds') or KINDS)
+                finish(dict(result, id=job.get('id'), status='ok', elapsed=round(time.time() - started, 3)))
+            except Exception as e:
+                logger.error(f"导出事件文件失败: {str(e)}")
+                finish({'id': job.get('id'), 'status': 'error', 'error': str(e)})
+
+        return _Waitable(self.export_executor.submit(export))
+
+    def _submit_sweep(self, job, reply, finish):
+        """把超参数搜索拆分为试验任务提交到工作进程池，全部完成后用finish写出汇总结果
+
+        每个试验使用独立的路由，进度事件带上任务id和试验名，每个试验结束时输出
+        trial事件。返回可以wait()的threading.Event。
+        """
+        from convert_tensorboard import default_log_dir, finalize_log_dir
+        job_id = job.get('id')
+        done = threading.Event()
+        output_root = os.path.abspath(job.get('output_dir') or default_log_dir('sweep-'))
+        try:
+            sweep, trials = plan_sweep(job['data'], output_root)
+            os.makedirs(output_root, exist_ok=True)
+        except ValueError as e:
+            finish({'id': job_id, 'status': 'error', 'error': str(e)})
+            done.set()
+            return done
+
+        started = time.time()
+        results = []
+        # 各试验的结构不同，不共享会话的增量构建状态
+        shared = {key: value for key, value in job.items()
+                  if key not in ('id', 'data', 'data_file', 'output_dir', 'session')}
+        trial_routes = []
+        with self.routes_lock:
+            for trial in trials:
+                route = self.next_route
+                self.next_route += 1
+                trial_routes.append(route)
+                if job.get('progress'):
+                    self.routes[route] = (job_id, lambda message, name=trial['id']: reply(dict(message, trial=name)))
+
+        def on_trial(result):
+            with self.routes_lock:
+                results.append(result)
+                complete = len(results) == len(trials)
+                if job.get('progress'):
+                    reply({'id': job_id, 'event': 'trial', 'trial': result.get('id'),
+                           'status': result.get('status'), 'completed': len(results), 'total': len(trials)})
+            if not complete:
+                return
+            try:
+                summary = summarize_sweep(sweep, trials, results, output_root, time.time() - started)
+                if summary['status'] == 'ok':
+                    finalize_log_dir(output_root)
+            except Exception as e:
+                logger.error(f"汇总超参数搜索结果失败: {str(e)}")
+                summary = {'status': 'error', 'error': str(e)}
+            with self.routes_lock:
+                for route in trial_routes:
+                    self.routes.pop(route, None)
+            finish(dict(summary, id=job_id))
+            done.set()
+
+        # 实验配置写在搜索根目录，与各试验互不依赖
+        self.pool.apply_async(write_experiment_summary, (output_root, domains(sweep)))
+        for trial, route in zip(trials, trial_routes):
+            self.pool.apply_async(
+                run_job, (dict(shared, **trial, _route=route),), callback=on_trial,
+                error_callback=lambda e, name=trial['id']: on_trial({'id': name, 'status': 'error', 'error': str(e)}))
+        return done
+
+    def close(self):
+        """等待所有任务完成并关闭工作进程"""
+        self.pool.close()
+        self.pool.join()
+        self.export_executor.shutdown(wait=True)
+        self.progress_queue.put(None)
+        self.progress_thread.join()
+
+def _make_writer(stream):
+    """创建线程安全的JSON-lines写入函数"""
+    lock = threading.Lock()
+
+    def write(message):
+        with lock:
+            stream.write(json.dumps(message, ensure_ascii=False) + '\n')
+            stream.flush()
+    return write
+
+def _serve_stdio(dispatcher):
+    """从stdin读取任务，结果写到stdout，stdin关闭时退出"""
+    reply = _make_writer(sys.stdout)
+    reply({'event': 'ready', 'workers': dispatcher.workers, 'pid': os.getpid()})
+    for line in sys.stdin:
+        dispatcher.submit_line(line, reply)
+    logger.info("stdin已关闭，等待剩余任务完成...")
+
+def _serve_socket(dispatcher, socket_path):
+    """在Unix套接字上接收任务，每个连接独立收发JSON-lines"""
+
+    class JobHandler(socketserver.StreamRequestHandler):
+        def setup(self):
+            super().setup()
+            self.wfile_text = _SocketTextWriter(self.wfile)
+
+        def handle(self):
+            reply = _make_writer(self.wfile_text)
+            pending = []
+            for line in self.rfile:
+                result = dispatcher.submit_line(line.decode('utf-8'), reply)
+                if result is not None:
+                    pending.append(result)
+            # 连接半关闭后仍需把该连接的结果全部写回
+            for result in pending:
+                result.wait()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, JobHandler)
+    server.daemon_threads = True
+    logger.info(f"转换服务监听Unix套接字: {socket_path}")
+    print(json.dumps({'event': 'ready', 'workers': dispatcher.workers, 'socket': socket_path}), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("收到中断信号，停止服务")
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+class _SocketTextWriter:
+    """将文本写入套接字的二进制流"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        self.wfile.write(text.encode('utf-8'))
+
+    def flush(self):
+        self.wfile.flush()
+
+def serve(workers=2, socket_path=None, max_jobs_per_worker=None, worker_options=None):
+    """启动常驻转换服务"""
+    workers = max(1, int(workers))
+    logger.info(f"启动转换服务，预热 {workers} 个工作进程...")
+    worker_options = dict(worker_options or {}, concurrent_jobs=workers)
+    dispatcher = JobDispatcher(workers, max_jobs_per_worker, worker_options)
+    try:
+        if socket_path:
+            _serve_socket(dispatcher, socket_path)
+        else:
+            _serve_stdio(dispatcher)
+    finally:
+        dispatcher.close()
+        logger.info("转换服务已退出")
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+模型开销的解析估算：每层参数量、MACs/FLOPs和激活内存
+
+在shape_inference推断出的形状基础上按层公式计算，不导入TensorFlow，
+后端可以在训练前按预算拒绝或降级开销过大的任务。激活内存按float32计算；
+峰值按拓扑顺序模拟张量的生命周期（张量在最后一个使用者计算完后释放）。
+"""
+
+import math
+import logging
+
+from graph_compiler import MERGE_LAYERS, parse_tuple
+from shape_inference import NUM_CLASSES, analyze_model_data
+
+logger = logging.getLogger(__name__)
+
+BYTES_PER_ELEMENT = 4  # float32
+# 训练一步约为前向计算量的3倍（前向 + 对输入和权重的两次反向）
+TRAINING_FLOPS_FACTOR = 3
+# Adam训练时每个参数需要保存权重、梯度和两个动量
+TRAINING_PARAM_COPIES = 4
+
+class CostBudgetError(ValueError):
+    """模型开销超出预算"""
+
+    def __init__(self, violations):
+        super().__init__("模型开销超出预算: " + '; '.join(violations))
+        self.violations = violations
+
+def _pair(value):
+    value = parse_tuple(value)
+    return tuple(value) if isinstance(value, (list, tuple)) else (value, value)
+
+def layer_macs(layer_type, config, input_shape, output_shape, num_inputs=1):
+    """返回单个样本的(MACs, 额外的逐元素FLOPs)"""
+    out_elements = math.prod(output_shape)
+    in_elements = math.prod(input_shape)
+
+    if layer_type == 'conv2d':
+        kh, kw = _pair(config.get('kernelSize', 3))
+        return out_elements * kh * kw * input_shape[-1], out_elements
+
+    if layer_type == 'dense':
+        return in_elements * output_shape[-1], out_elements
+
+    if layer_type in ('lstm', 'gru'):
+        if len(input_shape) == 3:
+            input_shape = (input_shape[0], input_shape[1] * input_shape[2])
+        steps, features = input_shape
+        units = config.get('units', 64)
+        gates = 4 if layer_type == 'lstm' else 3
+        # 每个时间步的门计算，外加逐元素的门激活和状态更新
+        return steps * gates * (features * units + units * units), steps * gates * units * 3
+
+    if layer_type in ('maxPooling2d', 'avgPooling2d'):
+        ph, pw = _pair(config.get('poolSize', 2))
+        return 0, out_elements * ph * pw
+
+    if layer_type == 'batchNorm':
+        return 0, 2 * out_elements
+
+    if layer_type in ('activation', 'dropout'):
+        return 0, out_elements
+
+    if layer_type in MERGE_LAYERS and layer_type != 'concatenate':
+        return 0, out_elements * max(num_inputs - 1, 0)
+
+    # flatten/reshape/concatenate只是改变视图或复制数据
+    return 0, 0
+
+def _format_count(value):
+    for unit, scale in (('G', 1e9), ('M', 1e6), ('K', 1e3)):
+        if value >= scale:
+            return f"{value / scale:.2f}{unit}"
+    return str(value)
+
+def estimate_cost(model_data, batch_size=32, input_shape=None, num_classes=NUM_CLASSES):
+    """估算模型开销，返回JSON可序列化的报告；input_shape为None时按数据源节点确定"""
+    graph, report = analyze_model_data(model_data, input_shape, num_classes)
+    input_shape = report['input_shape']
+    cost = {
+        'valid': report['valid'],
+        'batch_size': batch_size,
+        'input_shape': input_shape,
+        'errors': report['errors'],
+        'layers': [],
+    }
+    if not report['valid']:
+        return cost
+
+    input_bytes = math.prod(input_shape) * batch_size * BYTES_PER_ELEMENT
+    layers = []
+    for node in report['nodes']:
+        key = node['id']
+        config = graph.nodes[key].get('config', {}) if key in graph.nodes else {}
+        num_inputs = len(graph.inputs.get(key, [])) or 1
+        macs, elementwise = layer_macs(node['type'], config, node['input_shape'],
+                                       node['output_shape'], num_inputs)
+        activation_bytes = math.prod(node['output_shape']) * batch_size * BYTES_PER_ELEMENT
+        layers.append({
+            'id': key,
+            'type': node['type'],
+            'output_shape': node['output_shape'],
+            'params': node['params'] + node['non_trainable_params'],
+            'macs': macs * batch_size,
+            'flops': (2 * macs + elementwise) * batch_size,
+            'activation_bytes': activation_bytes,
+        })
+
+    # 模拟张量生命周期求峰值激活内存
+    remaining_uses = {}
+    for key in graph.order:
+        for pred in graph.inputs.get(key, []):
+            remaining_uses[pred] = remaining_uses.get(pred, 0) + 1
+    sizes = {layer['id']: layer['activation_bytes'] for layer in layers}
+    live = input_bytes
+    peak = live
+    for key in graph.order:
+        live += sizes[key]
+        peak = max(peak, live)
+        for pred in graph.inputs.get(key, []):
+            remaining_uses[pred] -= 1
+            if remaining_uses[pred] == 0:
+                live -= sizes[pred]
+    if '__output__' in sizes:
+        peak = max(peak, live + sizes['__output__'])
+
+    total_params = sum(layer['params'] for layer in layers)
+    total_flops = sum(layer['flops'] for layer in layers)
+    total_activation = sum(layer['activation_bytes'] for layer in layers)
+    cost['layers'] = layers
+    cost['totals'] = {
+        'params': total_params,
+        'param_bytes': total_params * BYTES_PER_ELEMENT,
+        'macs': sum(layer['macs'] for layer in layers),
+        'flops': total_flops,
+        'training_flops_per_step': total_flops * TRAINING_FLOPS_FACTOR,
+        'activation_bytes': total_activation,
+        'peak_activation_bytes': peak,
+        # 训练时所有激活都要保留到反向传播
+        'training_memory_bytes': total_params * BYTES_PER_ELEMENT * TRAINING_PARAM_COPIES
+                                 + total_activation + input_bytes,
+    }
+    return cost
+
+def check_budget(cost, max_params=None, max_flops=None, max_memory_mb=None):
+    """检查开销是否超出预算，返回超出项的描述列表"""
+    totals = cost.get('totals')
+    if not totals:
+        return []
+    violations = []
+    if max_params is not None and totals['params'] > max_params:
+        violations.append(f"参数量 {_format_count(totals['params'])} 超过上限 {_format_count(max_params)}")
+    if max_flops is not None and totals['training_flops_per_step'] > max_flops:
+        violations.append(f"每步训练FLOPs {_format_count(totals['training_flops_per_step'])} "
+                          f"超过上限 {_format_count(max_flops)}")
+    if max_memory_mb is not None and totals['training_memory_bytes'] > max_memory_mb * 1024 * 1024:
+        violations.append(f"训练内存 {totals['training_memory_bytes'] / 1024 / 1024:.1f}MB "
+                          f"超过上限 {max_memory_mb}MB")
+    return violations
+
+def format_cost_markdown(cost):
+    """把开销报告格式化为Markdown表格，用于TensorBoard文本摘要"""
+    lines = [
+        f"batch_size = {cost['batch_size']}, 输入形状 = {cost['input_shape']}",
+        "",
+        "| 层 | 类型 | 输出形状 | 参数量 | FLOPs | 激活内存 |",
+        "|---|---|---|---|---|---|",
+    ]
+    for layer in cost['layers']:
+        lines.append(
+            f"| {layer['id']} | {layer['type']} | {layer['output_shape']} | {layer['params']} "
+            f"| {_format_count(layer['flops'])} | {layer['activation_bytes'] / 1024:.1f}KB |"
+        )
+    totals = cost['totals']
+    lines += [
+        "",
+        f"总参数量: {totals['params']}，前向FLOPs: {_format_count(totals['flops'])}，"
+        f"每步训练FLOPs: {_format_count(totals['training_flops_per_step'])}",
+        f"激活内存峰值: {totals['peak_activation_bytes'] / 1024 / 1024:.2f}MB，"
+        f"训练内存估计: {totals['training_memory_bytes'] / 1024 / 1024:.2f}MB",
+    ]
+    return "\n".join(lines)
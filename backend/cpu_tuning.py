@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CPU执行调优：TensorFlow线程池、XLA JIT和oneDNN开关
+
+共享主机上多个转换任务同时使用TensorFlow的默认线程数（等于主机核数）会
+互相争抢CPU。auto模式按容器实际可用的CPU（cgroup配额和CPU亲和性中较小者）
+除以同时运行的任务数决定每个任务的线程数，训练延迟更稳定，单机也能容纳
+更多任务。线程池和oneDNN必须在TensorFlow初始化之前设置，因此是进程级的；
+jit_compile在编译模型时生效，可以按任务设置。
+"""
+
+import math
+import os
+import sys
+import logging
+
+logger = logging.getLogger(__name__)
+
+AUTO = 'auto'
+ONEDNN_ENV = 'TF_ENABLE_ONEDNN_OPTS'
+# 开关类选项的取值：auto表示使用TensorFlow的默认行为
+SWITCH_VALUES = {AUTO: None, 'on': True, 'off': False}
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def cgroup_cpu_limit():
+    """返回cgroup的CPU配额（可用核数，可能是小数），没有限制时返回None"""
+    # cgroup v2: "max 100000"或"200000 100000"
+    cpu_max = _read('/sys/fs/cgroup/cpu.max')
+    if cpu_max:
+        quota, _, period = cpu_max.partition(' ')
+        if quota != 'max' and period:
+            return int(quota) / int(period)
+        return None
+
+    # cgroup v1
+    for base in ('/sys/fs/cgroup/cpu', '/sys/fs/cgroup/cpu,cpuacct'):
+        quota = _read(os.path.join(base, 'cpu.cfs_quota_us'))
+        period = _read(os.path.join(base, 'cpu.cfs_period_us'))
+        if quota and period and int(quota) > 0:
+            return int(quota) / int(period)
+    return None
+
+def available_cpus():
+    """本进程实际可用的CPU数：CPU亲和性与cgroup配额中较小者"""
+    if hasattr(os, 'sched_getaffinity'):
+        count = len(os.sched_getaffinity(0))
+    else:
+        count = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit:
+        count = min(count, max(1, math.floor(limit)))
+    return max(1, count)
+
+def parse_thread_count(value):
+    """解析线程数参数：'auto'或非负整数（0表示使用TensorFlow的默认值）"""
+    if value is None or value == AUTO:
+        return AUTO
+    count = int(value)
+    if count < 0:
+        raise ValueError(f"线程数不能为负数: {value}")
+    return count
+
+def parse_switch(value):
+    """解析auto/on/off开关，也接受JSON中的布尔值和null"""
+    if value is None or isinstance(value, bool):
+        return value
+    if value not in SWITCH_VALUES:
+        raise ValueError(f"无效的取值: {value}，可选: {', '.join(SWITCH_VALUES)}")
+    return SWITCH_VALUES[value]
+
+def resolve_thread_counts(intra_op_threads=AUTO, inter_op_threads=AUTO, concurrent_jobs=1):
+    """把auto解析为具体的线程数，返回(intra_op, inter_op)
+
+    auto时可用CPU按同时运行的任务数平分给算子内线程池；算子间线程池只需要
+    少量线程调度互不依赖的运算。
+    """
+    share = max(1, available_cpus() // max(1, concurrent_jobs))
+    if intra_op_threads in (None, AUTO):
+        intra_op_threads = share
+    if inter_op_threads in (None, AUTO):
+        inter_op_threads = 2 if share >= 4 else 1
+    return intra_op_threads, inter_op_threads
+
+def configure_onednn(enabled):
+    """设置oneDNN优化开关，必须在导入TensorFlow之前调用；None表示保持默认"""
+    if enabled is None:
+        return
+    if 'tensorflow' in sys.modules:
+        logger.warning("TensorFlow已导入，oneDNN设置不会生效")
+        return
+    os.environ[ONEDNN_ENV] = '1' if enabled else '0'
+    logger.info(f"oneDNN优化: {'开启' if enabled else '关闭'}")
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+训练数据管道：把MNIST和用户CSV转换为float32的.npy缓存，并通过tf.data按批读取
+
+数据源节点（mnist/useData）第一次使用时解析一次，写入数据缓存目录下以
+数据指纹命名的子目录（x.npy、y.npy和meta.json），写入过程先写临时目录再
+原子改名。之后的运行直接以内存映射方式打开，只有实际读取的批次才会进入
+内存，因此数据集再大内存占用也保持平稳。CSV按行流式解析两遍（统计与写入），
+不会把整个文件读入内存。
+
+useData节点的config支持:
+    dataPath: 服务器上的CSV文件路径，必须位于数据根目录内（相对路径按数据根目录解析）
+    targetColumn: 标签列名，默认最后一列
+    normalize: 是否把特征按列缩放到[0, 1]，默认true
+mnist节点的config可以用dataPath指定本地的mnist.npz，否则下载一次。
+
+dataPath来自请求，数据根目录（环境变量CONVERTER_DATA_ROOT，命令行--data-root，
+默认为数据缓存目录）之外的路径作为验证错误拒绝，客户端不能读取服务器上的任意文件。
+"""
+
+import csv
+import hashlib
+import json
+import os
+import shutil
+import urllib.request
+import logging
+
+import numpy as np
+
+from graph_compiler import DATA_SOURCE_TYPES, resolve_node_keys
+from shape_inference import DEFAULT_INPUT_SHAPE, NUM_CLASSES, ValidationError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tb_data')
+MNIST_URL = 'https://storage.googleapis.com/tensorflow/tf-keras-datasets/mnist.npz'
+# 允许dataPath读取的根目录，由环境变量传给工作进程
+DATA_ROOT_ENV = 'CONVERTER_DATA_ROOT'
+# 数据缓存格式版本，解析逻辑变化时递增
+DATA_CACHE_VERSION = 1
+# 分类任务允许的最大类别数
+MAX_CLASSES = 1000
+# 数据集不超过该大小时由tf.data缓存在内存中，更大的数据集依赖内存映射和页缓存
+IN_MEMORY_CACHE_BYTES = 256 * 1024 * 1024
+
+class DataSpec:
+    """数据源描述：只读取元信息，不解析数据
+
+    kind: 'mnist'、'csv'或None（没有数据源时使用随机数据）
+    input_shape: 不含batch维的输入形状
+    fingerprint: 决定数据内容的参数，用作数据缓存和结果缓存的键
+    """
+
+    def __init__(self, kind, config, input_shape, fingerprint):
+        self.kind = kind
+        self.config = config
+        self.input_shape = tuple(input_shape)
+        self.fingerprint = fingerprint
+
+class Dataset:
+    """已缓存的数据集，x和y为只读的内存映射数组"""
+
+    def __init__(self, x, y, num_classes, source):
+        self.x = x
+        self.y = y
+        self.num_classes = num_classes
+        self.source = source
+
+    @property
+    def input_shape(self):
+        return tuple(self.x.shape[1:])
+
+    def __len__(self):
+        return len(self.x)
+
+def _csv_header(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        header = next(csv.reader(f), None)
+    if not header:
+        raise ValueError(f"CSV文件为空: {path}")
+    return [name.strip() for name in header]
+
+def _target_index(header, target_column):
+    if not target_column:
+        return len(header) - 1
+    if target_column not in header:
+        raise ValueError(f"CSV中没有标签列: {target_column}")
+    return header.index(target_column)
+
+def configure_data_root(path):
+    """设置dataPath允许的根目录；写入环境变量，之后启动的工作进程同样生效"""
+    os.environ[DATA_ROOT_ENV] = os.path.realpath(path)
+
+def resolve_data_path(data_path):
+    """把dataPath解析为数据根目录内的真实路径（解析符号链接），越界时抛出ValueError"""
+    root = os.path.realpath(os.environ.get(DATA_ROOT_ENV) or DEFAULT_DATA_DIR)
+    path = os.path.realpath(os.path.join(root, data_path))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"dataPath必须位于数据根目录 {root} 内，收到 {data_path}")
+    return path
+
+def describe_data_source(model_data):
+    """根据模型中的第一个数据源节点生成DataSpec
+
+    dataPath在数据根目录之外或CSV无法读取（不存在、为空或没有标签列）时抛出
+    ValidationError，错误记在数据源节点上。
+    """
+    structure = model_data.get('modelStructure', []) or []
+    keys = resolve_node_keys(structure, model_data.get('edges', []) or [])
+    sources = [(key, layer) for key, layer in zip(keys, structure) if layer.get('type') in DATA_SOURCE_TYPES]
+    if len(sources) > 1:
+        logger.warning(f"存在多个数据源节点，只使用第一个: {[key for key, _ in sources]}")
+    if not sources:
+        return DataSpec(None, {}, DEFAULT_INPUT_SHAPE, None)
+
+    key, layer = sources[0]
+    config = layer.get('config', {}) or {}
+    data_path = config.get('dataPath')
+    if data_path:
+        try:
+            data_path = resolve_data_path(data_path)
+        except ValueError as e:
+            raise ValidationError([{'id': key, 'type': layer.get('type'), 'message': str(e)}])
+
+    if layer.get('type') == 'mnist':
+        fingerprint = {'kind': 'mnist', 'path': data_path or None}
+        return DataSpec('mnist', config, DEFAULT_INPUT_SHAPE, fingerprint)
+
+    if not data_path:
+        # 前端上传的CSV只在浏览器中解析，服务器上没有文件时退化为随机数据
+        logger.warning("useData节点没有提供dataPath，使用随机数据训练")
+        return DataSpec(None, config, DEFAULT_INPUT_SHAPE, None)
+
+    try:
+        header = _csv_header(data_path)
+        _target_index(header, config.get('targetColumn'))
+        stat = os.stat(data_path)
+    except (OSError, ValueError) as e:
+        raise ValidationError([{'id': key, 'type': layer.get('type'), 'message': f"无法读取数据源: {str(e)}"}])
+    fingerprint = {
+        'kind': 'csv',
+        'path': data_path,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'target': config.get('targetColumn'),
+        'normalize': bool(config.get('normalize', True)),
+    }
+    return DataSpec('csv', config, (len(header) - 1,), fingerprint)
+
+def _cache_key(fingerprint):
+    encoded = json.dumps({'version': DATA_CACHE_VERSION, 'source': fingerprint}, sort_keys=True)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:24]
+
+def _load_mnist_arrays(data_path, download_dir):
+    """读取mnist.npz的训练集，没有指定路径时下载一次"""
+    if not data_path:
+        data_path = os.path.join(download_dir, 'mnist.npz')
+        if not os.path.exists(data_path):
+            logger.info(f"下载MNIST: {MNIST_URL}")
+            tmp_path = f"{data_path}.tmp-{os.getpid()}"
+            urllib.request.urlretrieve(MNIST_URL, tmp_path)
+            os.replace(tmp_path, data_path)
+    with np.load(data_path) as data:
+        return data['x_train'], data['y_train']
+
+def _write_mnist(spec, tmp_dir, download_dir):
+    images, labels = _load_mnist_arrays(spec.fingerprint['path'], download_dir)
+    x = np.lib.format.open_memmap(os.path.join(tmp_dir, 'x.npy'), mode='w+', dtype=np.float32,
+                                  shape=(len(images), 28, 28, 1))
+    # 分块转换，避免一次生成完整的float64中间数组
+    for start in range(0, len(images), 8192):
+        chunk = images[start:start + 8192]
+        x[start:start + len(chunk)] = (chunk.astype(np.float32) / 255.0)[..., np.newaxis]
+    x.flush()
+    np.save(os.path.join(tmp_dir, 'y.npy'), labels.astype(np.int32))
+    return {'num_classes': NUM_CLASSES, 'count': len(images)}
+
+def _write_csv(spec, tmp_dir):
+    path = spec.fingerprint['path']
+    header = _csv_header(path)
+    target = _target_index(header, spec.config.get('targetColumn'))
+    features = len(header) - 1
+
+    # 第一遍：统计行数、每列的最小/最大值和标签集合
+    count = 0
+    minimum = np.full(features, np.inf)
+    maximum = np.full(features, -np.inf)
+    labels = {}
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        for line, row in enumerate(reader, start=2):
+            if not row:
+                continue
+            if len(row) != len(header):
+                raise ValueError(f"CSV第{line}行有{len(row)}列，表头有{len(header)}列")
+            try:
+                values = np.array([float(v) for i, v in enumerate(row) if i != target])
+            except ValueError:
+                raise ValueError(f"CSV第{line}行包含非数值特征")
+            np.minimum(minimum, values, out=minimum)
+            np.maximum(maximum, values, out=maximum)
+            label = row[target].strip()
+            if label not in labels:
+                if len(labels) >= MAX_CLASSES:
+                    raise ValueError(f"标签列的取值超过{MAX_CLASSES}种，只支持分类任务")
+                labels[label] = len(labels)
+            count += 1
+    if count == 0:
+        raise ValueError(f"CSV文件没有数据行: {path}")
+
+    # 标签都是数值时按数值大小编号，否则按出现顺序编号
+    ordered = list(labels)
+    try:
+        ordered = sorted(ordered, key=lambda v: float(v))
+    except ValueError:
+        pass
+    label_index = {label: i for i, label in enumerate(ordered)}
+
+    scale = np.where(maximum > minimum, maximum - minimum, 1.0)
+    normalize = spec.fingerprint['normalize']
+
+    # 第二遍：直接写入内存映射文件
+    x = np.lib.format.open_memmap(os.path.join(tmp_dir, 'x.npy'), mode='w+', dtype=np.float32,
+                                  shape=(count, features))
+    y = np.lib.format.open_memmap(os.path.join(tmp_dir, 'y.npy'), mode='w+', dtype=np.int32,
+                                  shape=(count,))
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        i = 0
+        for row in reader:
+            if not row:
+                continue
+            values = np.array([float(v) for j, v in enumerate(row) if j != target])
+            x[i] = (values - minimum) / scale if normalize else values
+            y[i] = label_index[row[target].strip()]
+            i += 1
+    x.flush()
+    y.flush()
+    return {'num_classes': len(ordered), 'count': count, 'labels': ordered}
+
+def load_dataset(spec, data_dir=DEFAULT_DATA_DIR):
+    """返回内存映射的Dataset，第一次使用时生成.npy缓存；没有数据源时返回None"""
+    if spec.kind is None:
+        return None
+
+    key = _cache_key(spec.fingerprint)
+    entry = os.path.join(data_dir, key)
+    meta_path = os.path.join(entry, 'meta.json')
+    if not os.path.isfile(meta_path):
+        os.makedirs(data_dir, exist_ok=True)
+        tmp_dir = os.path.join(data_dir, f".tmp-{key}-{os.getpid()}")
+        os.makedirs(tmp_dir, exist_ok=True)
+        logger.info(f"解析数据源并写入数据缓存: {spec.kind} -> {entry}")
+        try:
+            if spec.kind == 'mnist':
+                meta = _write_mnist(spec, tmp_dir, data_dir)
+            else:
+                meta = _write_csv(spec, tmp_dir)
+            meta['source'] = spec.fingerprint
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            try:
+                # 并发生成同一数据集时只保留先完成的一份
+                os.rename(tmp_dir, entry)
+            except OSError:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    x = np.load(os.path.join(entry, 'x.npy'), mmap_mode='r')
+    y = np.load(os.path.join(entry, 'y.npy'), mmap_mode='r')
+    logger.info(f"使用数据缓存 {key}: {len(x)} 个样本，输入形状 {x.shape[1:]}，{meta['num_classes']} 类")
+    return Dataset(x, y, meta['num_classes'], spec.kind)
+
+def make_tf_datasets(tf, dataset, batch_size=32, validation_split=0.2, max_samples=None, seed=None):
+    """把Dataset切分为训练集和验证集的tf.data管道
+
+    每个元素是按连续下标从内存映射数组中切出的一个批次，批次顺序每轮打乱；
+    验证集与Keras的validation_split一致取末尾部分。返回(train, validation)。
+    """
+    total = len(dataset)
+    if max_samples:
+        total = min(total, max_samples)
+    val_count = int(total * validation_split)
+    train_count = total - val_count
+    x, y = dataset.x, dataset.y
+    sample_shape = dataset.input_shape
+
+    def build(begin, end, shuffle):
+        def read_batch(start):
+            start = int(start)
+            stop = min(start + batch_size, end)
+            return np.asarray(x[start:stop]), np.asarray(y[start:stop])
+
+        def to_tensors(start):
+            features, labels = tf.numpy_function(read_batch, [start], [tf.float32, tf.int32])
+            features.set_shape((None, *sample_shape))
+            labels.set_shape((None,))
+            return features, labels
+
+        ds = tf.data.Dataset.range(begin, end, batch_size)
+        ds = ds.map(to_tensors, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+        if (end - begin) * x[0].nbytes <= IN_MEMORY_CACHE_BYTES:
+            ds = ds.cache()
+        if shuffle:
+            ds = ds.shuffle((end - begin) // batch_size + 1, seed=seed, reshuffle_each_iteration=True)
+        return ds.prefetch(tf.data.AUTOTUNE)
+
+    train = build(0, train_count, shuffle=True)
+    validation = build(train_count, total, shuffle=False) if val_count else None
+    return train, validation
+
+def synthetic_dataset(input_shape, count=100, num_classes=NUM_CLASSES, seed=None):
+    """没有数据源时使用的随机数据（只用于生成日志结构，指标没有意义）"""
+    rng = np.random.default_rng(seed)
+    x = rng.random((count, *input_shape), dtype=np.float32)
+    y = rng.integers(0, num_classes, (count,), dtype=np.int32)
+    return Dataset(x, y, num_classes, None)
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+本机多进程数据并行训练：用MultiWorkerMirroredStrategy在多个工作进程上训练同一个模型
+
+集合通信必须在进程启动时配置，已经执行过运算的进程（服务的工作进程、命令行
+进程）不能再加入集群，因此每个任务都启动全新的工作进程：各进程通过localhost
+上的端口组成集群，设置好TF_CONFIG和线程数后执行相同的转换流程。0号进程是
+chief，日志和成功标记都只由它写入任务的日志目录；其余进程的日志写入临时目录，
+结束后删除。启动方转发chief的进度事件，以chief的结果作为任务结果，并由启动方
+按自己的缓存键写入结果缓存。
+
+    "distribute": true                                    # 默认2个工作进程
+    "distribute": {"workers": 4, "threads_per_worker": 1}
+
+每个批次在所有进程上同步计算梯度，各进程必须执行相同的步数：时间预算由启动方
+换算为训练可用的秒数，只用于规划步数，训练中不再按截止时间停止。一个进程失败
+时终止其余进程，避免它们在集合通信中一直等待。单CPU的机器上也可以运行。
+"""
+
+import json
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import logging
+
+from cpu_tuning import AUTO, parse_thread_count
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+MAX_WORKERS = 16
+# 工作进程导入TensorFlow、组成集群和构建模型的预计耗时，从时间预算中扣除
+WORKER_STARTUP_SECONDS = 6.0
+# 检查工作进程状态的间隔，以及chief结束后等待其余进程退出的时间
+POLL_SECONDS = 0.5
+SHUTDOWN_SECONDS = 30
+# 集合通信的算子在等待其他进程时占用算子间线程，只有1个线程时会拖慢每一步
+COLLECTIVE_INTER_OP_THREADS = 2
+
+def distribute_options(value):
+    """整理分布式训练选项：True、工作进程数或{workers, threads_per_worker}，不开启时返回None"""
+    if not value:
+        return None
+    if value is True:
+        value = {}
+    elif isinstance(value, int):
+        value = {'workers': value}
+    elif not isinstance(value, dict):
+        raise ValueError(f"无效的distribute选项: {value!r}")
+    workers = int(value.get('workers', DEFAULT_WORKERS))
+    if not 1 <= workers <= MAX_WORKERS:
+        raise ValueError(f"工作进程数 {workers} 超出范围，应为1到{MAX_WORKERS}")
+    if workers == 1:
+        return None
+    return {'workers': workers, 'threads_per_worker': parse_thread_count(value.get('threads_per_worker', AUTO))}
+
+def _free_ports(count):
+    """向系统申请count个空闲的本地端口"""
+    sockets = []
+    try:
+        for _ in range(count):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.bind(('localhost', 0))
+            sockets.append(s)
+        return [s.getsockname()[1] for s in sockets]
+    finally:
+        for s in sockets:
+            s.close()
+
+def tf_config(ports, index):
+    """第index个工作进程的TF_CONFIG"""
+    return json.dumps({
+        'cluster': {'worker': [f"localhost:{port}" for port in ports]},
+        'task': {'type': 'worker', 'index': index},
+    })
+
+def _read_lines(stream, lines):
+    for line in stream:
+        lines.put(line)
+    lines.put(None)
+
+def _terminate(procs):
+    for proc in procs:
+        if proc.poll() is None:
+            proc.kill()
+    for proc in procs:
+        proc.wait()
+
+def run_distributed(job, log_dir, options, training_budget=None, progress=None):
+    """启动options['workers']个工作进程完成转换，返回chief的结果
+
+    job为convert_model_data的参数（data、seed、max_samples等），工作进程不使用结果缓存。
+    training_budget为TrainingBudget时，把剩余时间换算为训练可用的秒数传给各进程，
+    并在返回前记录chief实际训练的步数和是否被截断。任一进程失败时抛出RuntimeError。
+    """
+    workers = options['workers']
+    ports = _free_ports(workers)
+    job = dict(job, distribute=options)
+    if training_budget is not None and training_budget.active:
+        job['max_steps'] = training_budget.max_steps
+        if training_budget.deadline is not None:
+            job['fit_seconds'] = max(training_budget.remaining() - training_budget.reserve()
+                                     - WORKER_STARTUP_SECONDS, 0)
+    scratch = tempfile.mkdtemp(prefix='distributed-')
+    logger.info(f"启动 {workers} 个数据并行工作进程，端口: {ports}")
+
+    procs = []
+    try:
+        for index in range(workers):
+            chief = index == 0
+            payload = dict(job, task_index=index,
+                           output_dir=log_dir if chief else os.path.join(scratch, f"worker-{index}"),
+                           progress=chief and progress is not None)
+            env = dict(os.environ, TF_CONFIG=tf_config(ports, index), PYTHONUNBUFFERED='1')
+            proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            proc.stdin.write(json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+            proc.stdin.close()
+            procs.append(proc)
+
+        # chief的stdout是进度事件和结果，其余进程只输出一行结果
+        lines = queue.Queue()
+        reader = threading.Thread(target=_read_lines, args=(procs[0].stdout, lines), daemon=True)
+        reader.start()
+        result = None
+        finished_at = None
+        while True:
+            try:
+                line = lines.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                line = ''
+            if line is None:
+                finished_at = finished_at or time.time()
+            elif line.strip():
+                message = json.loads(line)
+                if message.get('event') == 'result':
+                    result = {key: value for key, value in message.items() if key not in ('event', 'elapsed')}
+                elif progress is not None:
+                    progress.sink(message)
+            # chief给出结果后，其余进程在集群关闭时的报错不影响结果
+            failed = [i for i, proc in enumerate(procs) if i and proc.poll() not in (None, 0)]
+            if failed and result is None:
+                raise RuntimeError(f"数据并行工作进程 {failed} 异常退出")
+            if finished_at and procs[0].poll() is not None:
+                # chief失败时其余进程会一直等待集合通信，直接终止
+                if procs[0].returncode != 0 or all(proc.poll() is not None for proc in procs):
+                    break
+                if time.time() - finished_at > SHUTDOWN_SECONDS:
+                    raise RuntimeError("chief已结束，其余工作进程未能退出")
+        reader.join()
+
+        if procs[0].returncode != 0:
+            _terminate(procs)
+        else:
+            for index, proc in enumerate(procs[1:], start=1):
+                output = proc.stdout.read().decode('utf-8').strip()
+                worker_result = json.loads(output.splitlines()[-1]) if output else {}
+                if worker_result.get('status') != 'ok':
+                    logger.warning(f"工作进程 {index} 失败: {worker_result.get('error')}")
+    except Exception:
+        _terminate(procs)
+        raise
+    finally:
+        for proc in procs:
+            proc.stdout.close()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if result is None:
+        raise RuntimeError("数据并行的chief没有返回结果")
+    if result.get('status') != 'ok':
+        raise RuntimeError(result.get('error') or '数据并行训练失败')
+    if training_budget is not None:
+        training_budget.steps = result.get('steps', 0)
+        if result.get('truncated'):
+            training_budget.mark_truncated(result.get('reason'))
+    return result
+
+def distributed_fit(tf, model, x, epochs=1, validation_data=None, callbacks=None, verbose=0):
+    """在MultiWorkerMirroredStrategy下训练已编译的模型，返回History（接口同model.fit）
+
+    Keras 3的model.fit在多工作进程时会对整个批次结构和标量指标做跨进程归约而失败，
+    这里用strategy.run逐批训练：梯度由优化器跨进程求和，损失和准确率按样本数汇总后
+    写入logs，回调（TensorBoard、进度、截止时间）按model.fit的顺序调用。
+    x和validation_data的元素是已经分好的批次（make_tf_datasets），每个进程遍历
+    全部批次并只计算其中下标对自己取余的样本，因此各进程的步数总是相同。
+    """
+    strategy = model.distribute_strategy
+    loss_fn = tf.keras.losses.get(model.loss)
+    with strategy.scope():
+        model.optimizer.build(model.trainable_variables)
+
+    def correct(y, y_pred):
+        labels = tf.argmax(y, axis=-1) if y.shape.rank == y_pred.shape.rank else tf.reshape(y, [-1])
+        return tf.reduce_sum(tf.cast(tf.equal(tf.argmax(y_pred, axis=-1), tf.cast(labels, tf.int64)), tf.float32))
+
+    def totals(per_replica):
+        return [strategy.reduce('SUM', value, axis=None) for value in per_replica]
+
+    def train_batch(x, y, batch_size):
+        with tf.GradientTape() as tape:
+            y_pred = model(x, training=True)
+            per_example = loss_fn(y, y_pred)
+            # 除以整个批次的样本数，各进程的梯度求和后即为整个批次的平均梯度
+            loss = tf.reduce_sum(per_example) / batch_size
+            if model.losses:
+                loss += tf.nn.scale_regularization_loss(tf.add_n(model.losses))
+        grads = tape.gradient(loss, model.trainable_variables)
+        model.optimizer.apply_gradients(zip(grads, model.trainable_variables))
+        return tf.reduce_sum(per_example), correct(y, y_pred), tf.cast(tf.shape(per_example)[0], tf.float32)
+
+    def test_batch(x, y, batch_size):
+        y_pred = model(x, training=False)
+        per_example = loss_fn(y, y_pred)
+        return tf.reduce_sum(per_example), correct(y, y_pred), tf.cast(tf.shape(per_example)[0], tf.float32)
+
+    train_step = tf.function(lambda batch: totals(strategy.run(train_batch, args=batch)))
+    test_step = tf.function(lambda batch: totals(strategy.run(test_batch, args=batch)))
+
+    def metrics(sums, prefix=''):
+        loss_sum, correct_sum, count = (float(v) for v in sums)
+        count = max(count, 1.0)
+        return {f"{prefix}loss": loss_sum / count, f"{prefix}accuracy": correct_sum / count}
+
+    def distribute(dataset):
+        def shard(context):
+            index, count = context.input_pipeline_id, context.num_input_pipelines
+            return dataset.map(lambda features, labels: (
+                features[index::count], labels[index::count], tf.cast(tf.shape(labels)[0], tf.float32)))
+
+        return strategy.distribute_datasets_from_function(shard)
+
+    train_dist = distribute(x)
+    val_dist = distribute(validation_data) if validation_data is not None else None
+    steps = int(x.cardinality())
+    history = tf.keras.callbacks.History()
+    callback_list = tf.keras.callbacks.CallbackList(
+        list(callbacks or []) + [history], add_progbar=verbose != 0, model=model,
+        epochs=epochs, steps=steps if steps >= 0 else None, verbose=verbose)
+
+    model.stop_training = False
+    callback_list.on_train_begin()
+    for epoch in range(epochs):
+        callback_list.on_epoch_begin(epoch)
+        sums = [0.0, 0.0, 0.0]
+        for step, batch in enumerate(train_dist):
+            callback_list.on_train_batch_begin(step)
+            sums = [total + float(value) for total, value in zip(sums, train_step(batch))]
+            callback_list.on_train_batch_end(step, metrics(sums))
+            if model.stop_training:
+                break
+        logs = metrics(sums)
+        if val_dist is not None:
+            val_sums = [0.0, 0.0, 0.0]
+            callback_list.on_test_begin()
+            for step, batch in enumerate(val_dist):
+                callback_list.on_test_batch_begin(step)
+                val_sums = [total + float(value) for total, value in zip(val_sums, test_step(batch))]
+                callback_list.on_test_batch_end(step, metrics(val_sums))
+            callback_list.on_test_end(metrics(val_sums))
+            logs.update(metrics(val_sums, prefix='val_'))
+        callback_list.on_epoch_end(epoch, logs)
+        if model.stop_training:
+            break
+    callback_list.on_train_end(logs)
+    return history
+
+def worker_main():
+    """工作进程入口：从stdin读取任务，在MultiWorkerMirroredStrategy下执行转换"""
+    job = json.loads(sys.stdin.buffer.read())
+    # stdout只保留进度事件和结果，其余输出（model.summary等）转到stderr
+    sys.stdout.flush()
+    result_stream = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    import convert_tensorboard as converter
+    from progress import ProgressReporter, stdout_sink
+    from training_budget import TrainingBudget
+
+    options = job['distribute']
+    chief = job['task_index'] == 0
+    started = time.time()
+    # 线程数和集合通信都必须在执行任何运算之前设置
+    converter.configure_threads(options['threads_per_worker'], COLLECTIVE_INTER_OP_THREADS,
+                                concurrent_jobs=options['workers'])
+    strategy = converter.tf.distribute.MultiWorkerMirroredStrategy()
+    logger.info(f"工作进程 {job['task_index']}/{options['workers']} 已加入集群，"
+                f"副本数: {strategy.num_replicas_in_sync}")
+
+    sink = stdout_sink(result_stream)
+    progress = ProgressReporter(sink) if job.get('progress') else None
+    training_budget = TrainingBudget(max_steps=job.get('max_steps'), fit_seconds=job.get('fit_seconds'))
+    try:
+        log_dir = converter.convert_model_data(
+            job['data'], job['output_dir'], seed=job['seed'], progress=progress,
+            data_dir=job['data_dir'], max_samples=job['max_samples'], log_profile=job['log_profile'],
+            profile_batch=job.get('profile_batch', 0) if chief else 0, jit_compile=job.get('jit_compile'),
+            learning_rate=job.get('learning_rate'), hparams=job.get('hparams'),
+            training_budget=training_budget, summary_options=job.get('summary_options'),
+            distribute=options, strategy=strategy)
+        result = {'status': 'ok', 'log_dir': os.path.abspath(log_dir), 'steps': training_budget.steps,
+                  'truncated': training_budget.truncated, 'reason': training_budget.reason}
+        # chief运行着集群的协调服务，所有进程都完成后才能退出
+        barrier = converter.tf.function(
+            lambda: strategy.reduce('SUM', strategy.run(lambda: converter.tf.constant(1.0)), axis=None))
+        barrier()
+    except Exception as e:
+        logger.error(f"工作进程 {job['task_index']} 转换失败: {str(e)}")
+        result = {'status': 'error', 'error': str(e)}
+    result['elapsed'] = round(time.time() - started, 3)
+    sink(dict(result, event='result'))
+    result_stream.close()
+    sys.exit(0 if result['status'] == 'ok' else 1)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    worker_main()
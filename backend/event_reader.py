@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+无需TensorBoard服务的事件文件读取：把运行的摘要导出为紧凑JSON
+
+遍历日志目录下所有事件文件，按子目录（相对路径，根目录为"."）分组，提取
+标量、文本、直方图和计算图结构。只依赖tensorboard包中的protobuf定义，
+不导入TensorFlow，也不需要为每个会话启动tensorboard进程。
+
+读取是增量的：结果中的cursor记录每个事件文件已读到的字节偏移，以及TF2
+摘要只在第一次写入时携带的插件元数据；把cursor传回后只返回新写入的事件。
+正在写入的文件末尾不完整的记录不会被读取，下一次从该记录开头继续。
+
+    python convert_tensorboard.py export tb_logs/xxx
+    python convert_tensorboard.py export tb_logs/xxx --cursor cursor.json --kinds scalars,text
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import logging
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('scalars', 'text', 'histograms', 'graphs')
+EVENT_FILE_MARKER = 'tfevents'
+# 计算图节点数超过该值时只导出前面的节点，避免大模型的图把JSON撑大
+MAX_GRAPH_NODES = 2000
+
+def read_records(path, offset=0):
+    """从offset开始逐条读取事件文件，产生(Event, 该记录之后的偏移)
+
+    遇到截断的记录（文件仍在写入）时停止，偏移停在该记录开头；记录头校验
+    失败视为损坏，同样停止读取。
+    """
+    from tensorboard.compat.proto import event_pb2
+    from tensorboard.compat.tensorflow_stub.pywrap_tensorflow import masked_crc32c
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            header = f.read(12)
+            if len(header) < 12:
+                return
+            length, header_crc = struct.unpack('<QI', header)
+            if masked_crc32c(header[:8]) != header_crc:
+                logger.warning(f"事件文件记录头校验失败，停止读取: {path}")
+                return
+            data = f.read(length)
+            if len(data) < length or len(f.read(4)) < 4:
+                return
+            offset += 12 + length + 4
+            event = event_pb2.Event()
+            event.ParseFromString(data)
+            yield event, offset
+
+def find_event_files(log_dir):
+    """返回日志目录下所有事件文件的相对路径（排序后）"""
+    files = []
+    for root, dirs, names in os.walk(log_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in names:
+            if EVENT_FILE_MARKER in name and not name.startswith('.'):
+                files.append(os.path.relpath(os.path.join(root, name), log_dir))
+    return sorted(files)
+
+def _decode_text(array):
+    if array.ndim == 0:
+        items = [array.item()]
+    else:
+        items = array.reshape(-1).tolist()
+    return '\n'.join(i.decode('utf-8', 'replace') if isinstance(i, bytes) else str(i) for i in items)
+
+def _graph_nodes(graph):
+    """把GraphDef整理为{nodes: [{name, op, inputs}], ...}，只保留结构信息"""
+    nodes = [{'name': node.name, 'op': node.op, 'inputs': list(node.input)}
+             for node in graph.node[:MAX_GRAPH_NODES]]
+    return {'nodes': nodes, 'total_nodes': len(graph.node), 'truncated': len(graph.node) > MAX_GRAPH_NODES}
+
+def _parse_graph_def(data):
+    from tensorboard.compat.proto import graph_pb2
+    graph = graph_pb2.GraphDef()
+    graph.ParseFromString(data)
+    return _graph_nodes(graph)
+
+def _parse_trace_graph(data):
+    """tf.summary.trace_export写入的RunMetadata，取第一个函数优化前的计算图"""
+    from tensorboard.compat.proto import config_pb2
+    run_metadata = config_pb2.RunMetadata()
+    run_metadata.ParseFromString(data)
+    if not run_metadata.function_graphs:
+        return None
+    return _graph_nodes(run_metadata.function_graphs[0].pre_optimization_graph)
+
+class _RunData:
+    """单个运行（子目录）的导出结果"""
+
+    def __init__(self):
+        self.scalars = {}
+        self.text = {}
+        self.histograms = {}
+        self.graphs = {}
+
+    def to_json(self, kinds):
+        data = {kind: getattr(self, kind) for kind in kinds}
+        return {kind: values for kind, values in data.items() if values}
+
+def _plugin_of(value, plugins, key):
+    """值所属的插件；TF2摘要只在标签第一次出现时携带元数据"""
+    name = value.metadata.plugin_data.plugin_name
+    if name:
+        plugins[key] = name
+        return name
+    return plugins.get(key)
+
+def export_run(log_dir, cursor=None, kinds=KINDS):
+    """增量导出日志目录中的摘要，返回{'runs': {...}, 'cursor': {...}}
+
+    runs的键为子目录的相对路径，每个运行包含:
+      scalars: 标签 -> [[step, wall_time, value], ...]
+      text: 标签 -> [[step, 文本], ...]
+      histograms: 标签 -> [[step, [[left, right, count], ...]], ...]
+      graphs: 'graph_def'或追踪的标签 -> {nodes, total_nodes, truncated}，
+              Keras模型的标签 -> {keras_config}
+    cursor为上一次返回的cursor，为None时从头读取。
+    """
+    from tensorboard.util import tensor_util
+
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        raise ValueError(f"不支持的导出类型: {', '.join(sorted(unknown))}，可选: {', '.join(KINDS)}")
+    if not os.path.isdir(log_dir):
+        raise FileNotFoundError(f"日志目录不存在: {log_dir}")
+    cursor = cursor or {}
+    event_files = find_event_files(log_dir)
+    # 已被删除的文件（例如日志压缩合并后）不再保留偏移
+    offsets = {path: offset for path, offset in (cursor.get('offsets') or {}).items() if path in event_files}
+    plugins = dict(cursor.get('plugins') or {})
+    runs = {}
+    events_read = 0
+
+    for rel_path in event_files:
+        path = os.path.join(log_dir, rel_path)
+        start = offsets.get(rel_path, 0)
+        try:
+            if os.path.getsize(path) <= start:
+                continue
+        except OSError:
+            continue
+        run = os.path.dirname(rel_path) or '.'
+        data = runs.setdefault(run, _RunData())
+        offset = start
+        for event, offset in read_records(path, start):
+            events_read += 1
+            step = event.step
+            if event.HasField('graph_def') and 'graphs' in kinds:
+                data.graphs['graph_def'] = _parse_graph_def(event.graph_def)
+                continue
+            if not event.HasField('summary'):
+                continue
+            for value in event.summary.value:
+                key = f"{run}/{value.tag}"
+                plugin = _plugin_of(value, plugins, key)
+                kind = value.WhichOneof('value')
+                if kind == 'simple_value':
+                    if 'scalars' in kinds:
+                        data.scalars.setdefault(value.tag, []).append(
+                            [step, round(event.wall_time, 3), value.simple_value])
+                    continue
+                if kind != 'tensor':
+                    continue
+                if plugin == 'scalars' and 'scalars' in kinds:
+                    scalar = tensor_util.make_ndarray(value.tensor)
+                    data.scalars.setdefault(value.tag, []).append(
+                        [step, round(event.wall_time, 3), float(scalar)])
+                elif plugin == 'text' and 'text' in kinds:
+                    data.text.setdefault(value.tag, []).append(
+                        [step, _decode_text(tensor_util.make_ndarray(value.tensor))])
+                elif plugin == 'histograms' and 'histograms' in kinds:
+                    buckets = tensor_util.make_ndarray(value.tensor)
+                    data.histograms.setdefault(value.tag, []).append(
+                        [step, [[float(left), float(right), float(count)] for left, right, count in buckets]])
+                elif plugin == 'graph_run_metadata_graph' and 'graphs' in kinds:
+                    graph = _parse_trace_graph(tensor_util.make_ndarray(value.tensor).item())
+                    if graph:
+                        data.graphs[value.tag] = graph
+                elif plugin == 'graph_keras_model' and 'graphs' in kinds:
+                    data.graphs[value.tag] = {'keras_config': _decode_text(tensor_util.make_ndarray(value.tensor))}
+        offsets[rel_path] = offset
+
+    exported = {run: data.to_json(kinds) for run, data in sorted(runs.items())}
+    return {
+        'runs': {run: values for run, values in exported.items() if values},
+        'cursor': {'offsets': offsets, 'plugins': plugins},
+        'events_read': events_read,
+    }
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='把运行的事件文件导出为JSON（不需要TensorBoard服务）')
+    parser.add_argument('log_dir', help='运行的日志目录')
+    parser.add_argument('--cursor', help='上一次导出结果中的cursor（JSON文件路径），只导出之后写入的事件')
+    parser.add_argument('--kinds', default=','.join(KINDS), help=f"导出的类型（逗号分隔）: {', '.join(KINDS)}")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    cursor = None
+    if args.cursor:
+        with open(args.cursor, 'r', encoding='utf-8') as f:
+            cursor = json.load(f)
+    kinds = [k.strip() for k in args.kinds.split(',') if k.strip()]
+    result = export_run(args.log_dir, cursor=cursor, kinds=kinds)
+    sys.stdout.write(json.dumps(result, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
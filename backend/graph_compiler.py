@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+模型图编译：把前端画布的modelStructure/edges编译成有向无环图并构建Keras模型
+
+编译阶段只遍历一次节点和连接，建立邻接表和入度索引，再用Kahn算法做
+O(V+E)的拓扑排序并检测环。构建阶段使用Keras函数式API，多输入节点通过
+Add/Concatenate等合并层连接，因此带分支的画布也能正确构建。
+"""
+
+from collections import deque
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 数据源节点，连接到模型输入
+DATA_SOURCE_TYPES = {'mnist', 'useData'}
+# 不参与建模的节点
+NON_LAYER_TYPES = DATA_SOURCE_TYPES | {'trainButton'}
+# 合并节点类型及对应的Keras层
+MERGE_LAYERS = {
+    'add': 'Add',
+    'concatenate': 'Concatenate',
+    'multiply': 'Multiply',
+    'average': 'Average',
+}
+# 画布上只有数据源或训练按钮时的验证错误
+NO_LAYERS_MESSAGE = '模型中没有层节点（只有数据源或训练按钮）'
+# build_keras_model记录层时，自动添加的输出部分（分支拼接和输出层）使用的键
+OUTPUT_HEAD = '__output__'
+
+class GraphError(ValueError):
+    """模型图结构错误（环、无效连接等）"""
+
+    def __init__(self, message, nodes=None):
+        super().__init__(message)
+        self.nodes = list(nodes or [])
+
+class CompiledGraph:
+    """编译后的模型图
+
+    nodes: 节点键 -> modelStructure中的层定义
+    order: 拓扑顺序的节点键列表
+    inputs: 节点键 -> 前驱节点键列表（为空表示直接连接模型输入）
+    outputs: 没有后继的节点键列表
+    """
+
+    def __init__(self, nodes, order, inputs, outputs, data_sources):
+        self.nodes = nodes
+        self.order = order
+        self.inputs = inputs
+        self.outputs = outputs
+        self.data_sources = data_sources
+
+    def layer_types(self):
+        return [self.nodes[key].get('type') for key in self.order]
+
+def _id_order(node_id):
+    """按'type-时间戳'中时间戳的数值排序，即节点的创建顺序"""
+    suffix = node_id.rpartition('-')[2]
+    return (0, int(suffix), node_id) if suffix.isdigit() else (1, 0, node_id)
+
+def resolve_node_keys(structure, edges):
+    """为modelStructure中的每个节点确定在edges中使用的节点ID
+
+    新版前端在每个节点上携带id；旧数据没有id时，按类型把节点的列表顺序
+    与连接中同类型ID的创建顺序一一对应。无法对应的节点使用'type#序号'。
+    """
+    keys = [None] * len(structure)
+    explicit = set()
+    for i, layer in enumerate(structure):
+        node_id = layer.get('id')
+        if isinstance(node_id, str) and node_id:
+            keys[i] = node_id
+            explicit.add(node_id)
+
+    # 连接中出现但没有被显式声明的ID，按类型分组
+    edge_ids_by_type = {}
+    for edge in edges:
+        for node_id in (edge.get('source'), edge.get('target')):
+            if isinstance(node_id, str) and node_id not in explicit:
+                node_type = node_id.rpartition('-')[0] or node_id
+                edge_ids_by_type.setdefault(node_type, set()).add(node_id)
+    edge_ids_by_type = {t: sorted(ids, key=_id_order) for t, ids in edge_ids_by_type.items()}
+
+    ordinals = {}
+    for i, layer in enumerate(structure):
+        layer_type = layer.get('type')
+        ordinal = ordinals.get(layer_type, 0)
+        ordinals[layer_type] = ordinal + 1
+        if keys[i] is not None:
+            continue
+        candidates = edge_ids_by_type.get(layer_type, [])
+        keys[i] = candidates[ordinal] if ordinal < len(candidates) else f"{layer_type}#{ordinal}"
+    return keys
+
+def node_aliases(model_data):
+    """把节点ID映射为与时间戳无关的'type#序号'，用于内容哈希"""
+    structure = model_data.get('modelStructure', []) or []
+    edges = model_data.get('edges', []) or []
+    keys = resolve_node_keys(structure, edges)
+    aliases = {}
+    ordinals = {}
+    for key, layer in zip(keys, structure):
+        layer_type = layer.get('type')
+        ordinal = ordinals.get(layer_type, 0)
+        ordinals[layer_type] = ordinal + 1
+        aliases[key] = f"{layer_type}#{ordinal}"
+    return aliases
+
+def compile_graph(model_data):
+    """把模型数据编译为拓扑排序后的CompiledGraph"""
+    structure = model_data.get('modelStructure', []) or []
+    edges = model_data.get('edges', []) or []
+
+    keys = resolve_node_keys(structure, edges)
+    nodes = {}
+    data_source_keys = set()
+    data_sources = set()
+    for key, layer in zip(keys, structure):
+        layer_type = layer.get('type')
+        if layer_type in DATA_SOURCE_TYPES:
+            data_source_keys.add(key)
+            data_sources.add(layer_type)
+        elif layer_type not in NON_LAYER_TYPES:
+            nodes[key] = layer
+
+    # 一次遍历连接，建立邻接表和入度
+    successors = {key: [] for key in nodes}
+    predecessors = {key: [] for key in nodes}
+    connected = set()
+    for edge in edges:
+        source, target = edge.get('source'), edge.get('target')
+        if target not in nodes:
+            continue
+        if source in data_source_keys:
+            connected.add(target)
+            continue
+        if source not in nodes:
+            logger.warning(f"忽略无效连接: {source} -> {target}")
+            continue
+        if target in successors[source]:
+            continue
+        successors[source].append(target)
+        predecessors[target].append(source)
+        connected.add(source)
+        connected.add(target)
+
+    def sequence_id(key):
+        return nodes[key].get('config', {}).get('sequenceId', 0)
+
+    if not connected:
+        # 没有有效连接时，按sequenceId串成一条链
+        order = sorted(nodes, key=sequence_id)
+        inputs = {key: ([order[i - 1]] if i > 0 else []) for i, key in enumerate(order)}
+        outputs = order[-1:]
+        return CompiledGraph(nodes, order, inputs, outputs, data_sources)
+
+    # 没有任何连接的孤立节点不参与建模
+    isolated = [key for key in nodes if key not in connected]
+    if isolated:
+        logger.warning(f"忽略未连接的节点: {isolated}")
+        for key in isolated:
+            del nodes[key], successors[key], predecessors[key]
+
+    # Kahn算法，同一层级内按sequenceId保持稳定顺序
+    in_degree = {key: len(preds) for key, preds in predecessors.items()}
+    queue = deque(sorted((key for key, d in in_degree.items() if d == 0), key=sequence_id))
+    order = []
+    while queue:
+        key = queue.popleft()
+        order.append(key)
+        for target in successors[key]:
+            in_degree[target] -= 1
+            if in_degree[target] == 0:
+                queue.append(target)
+
+    if len(order) < len(nodes):
+        cycle_nodes = [key for key, d in in_degree.items() if d > 0]
+        raise GraphError(f"模型图中存在环，涉及节点: {cycle_nodes}", cycle_nodes)
+
+    outputs = [key for key in order if not successors[key]]
+    return CompiledGraph(nodes, order, predecessors, outputs, data_sources)
+
+def parse_tuple(value):
+    """把前端的元组字符串（如"(2, 2)"、"(None, 7, 4)"）解析为列表，None/null解析为None
+
+    不是字符串或无法解析的值原样返回，由调用方报错。
+    """
+    if not isinstance(value, str):
+        return value
+    items = [item.strip() for item in value.strip().strip('()[]').split(',')]
+    parsed = []
+    for item in items:
+        if not item:
+            continue
+        if item in ('None', 'null'):
+            parsed.append(None)
+            continue
+        try:
+            parsed.append(int(item))
+        except ValueError:
+            return value
+    return parsed or value
+
+def target_shape(config):
+    """Reshape的目标形状（不含batch维）
+
+    前端的默认值"(None, 7, 4)"带有batch维：开头的None去掉，其余位置的None
+    按Keras的约定视为-1（自动推断的维度）。
+    """
+    target = parse_tuple(config.get('targetShape', [7, 7, 16]))
+    if isinstance(target, list):
+        if target and target[0] is None:
+            target = target[1:]
+        target = [-1 if d is None else d for d in target]
+    return target
+
+def _pool_size(config):
+    pool_size = parse_tuple(config.get('poolSize', 2))
+    # 确保pool_size是一个元组
+    if isinstance(pool_size, int):
+        pool_size = (pool_size, pool_size)
+    return tuple(pool_size)
+
+def _applier(created):
+    """返回把层应用到输入上并把层记入created的函数"""
+    def apply(layer, x):
+        created.append(layer)
+        return layer(x)
+    return apply
+
+def _make_layer(tf, layer_type, config, x, created):
+    """根据层类型和配置把一层应用到张量x上，返回输出张量；创建的层依次加入created"""
+    layers = tf.keras.layers
+    apply = _applier(created)
+
+    if layer_type == 'conv2d':
+        return apply(layers.Conv2D(
+            filters=config.get('filters', 32),
+            kernel_size=parse_tuple(config.get('kernelSize', 3)),
+            strides=parse_tuple(config.get('strides', 1)),
+            padding=config.get('padding', 'valid'),
+            activation=config.get('activation', 'relu')
+        ), x)
+
+    if layer_type == 'maxPooling2d':
+        return apply(layers.MaxPooling2D(
+            pool_size=_pool_size(config),
+            strides=parse_tuple(config.get('strides', None)),
+            padding=config.get('padding', 'valid')
+        ), x)
+
+    if layer_type == 'avgPooling2d':
+        return apply(layers.AveragePooling2D(
+            pool_size=_pool_size(config),
+            strides=parse_tuple(config.get('strides', None)),
+            padding=config.get('padding', 'valid')
+        ), x)
+
+    if layer_type == 'flatten':
+        return apply(layers.Flatten(), x)
+
+    if layer_type == 'dense':
+        # 与前端tfjs生成的模型一致，多维输入先展平
+        if len(x.shape) > 2:
+            x = apply(layers.Flatten(), x)
+        return apply(layers.Dense(
+            units=config.get('units', 128),
+            activation=config.get('activation', 'relu')
+        ), x)
+
+    if layer_type == 'dropout':
+        return apply(layers.Dropout(rate=config.get('rate', 0.5)), x)
+
+    if layer_type == 'batchNorm':
+        return apply(layers.BatchNormalization(), x)
+
+    if layer_type == 'activation':
+        return apply(layers.Activation(activation=config.get('activation', 'relu')), x)
+
+    if layer_type in ('lstm', 'gru'):
+        # 图像输入(H, W, C)按行展开为时间序列(H, W*C)
+        if len(x.shape) == 4:
+            x = apply(layers.Reshape((x.shape[1], x.shape[2] * x.shape[3])), x)
+        rnn_layer = layers.LSTM if layer_type == 'lstm' else layers.GRU
+        return apply(rnn_layer(
+            units=config.get('units', 64),
+            activation=config.get('activation', 'tanh'),
+            recurrent_activation=config.get('recurrentActivation', 'sigmoid'),
+            return_sequences=config.get('returnSequences', False)
+        ), x)
+
+    if layer_type == 'reshape':
+        return apply(layers.Reshape(target_shape(config)), x)
+
+    if layer_type in MERGE_LAYERS:
+        # 单输入的合并节点直接透传
+        return x
+
+    raise ValueError(f"不支持的层类型: {layer_type}")
+
+def _merge(tf, layer_type, config, tensors, created):
+    """合并多个输入张量；创建的层依次加入created"""
+    apply = _applier(created)
+    if layer_type in MERGE_LAYERS:
+        merge_cls = getattr(tf.keras.layers, MERGE_LAYERS[layer_type])
+        if layer_type == 'concatenate':
+            return apply(merge_cls(axis=config.get('axis', -1)), tensors)
+        return apply(merge_cls(), tensors)
+
+    # 普通层有多个输入时，先在最后一维拼接
+    logger.info(f"{layer_type} 有 {len(tensors)} 个输入，自动添加Concatenate")
+    if any(len(t.shape) != len(tensors[0].shape) for t in tensors):
+        tensors = [apply(tf.keras.layers.Flatten(), t) if len(t.shape) > 2 else t for t in tensors]
+    return apply(tf.keras.layers.Concatenate(), tensors)
+
+def build_keras_model(graph, input_shape, tf, num_classes=10, node_layers=None):
+    """使用Keras函数式API把CompiledGraph构建为tf.keras.Model
+
+    node_layers为dict时填入每个节点创建的Keras层（节点键 -> 层列表），自动添加的
+    分支拼接和输出层记在OUTPUT_HEAD下，供增量构建按节点复用权重。
+    """
+    inputs = tf.keras.Input(shape=tuple(input_shape))
+    tensors = {}
+    if node_layers is None:
+        node_layers = {}
+
+    for key in graph.order:
+        layer = graph.nodes[key]
+        layer_type = layer.get('type')
+        config = layer.get('config', {})
+        incoming = [tensors[p] for p in graph.inputs.get(key, [])] or [inputs]
+
+        logger.info(f"添加层: {layer_type} (配置: {config})")
+        try:
+            created = node_layers.setdefault(key, [])
+            x = incoming[0] if len(incoming) == 1 else _merge(tf, layer_type, config, incoming, created)
+            tensors[key] = _make_layer(tf, layer_type, config, x, created)
+        except Exception as e:
+            # 不再静默跳过出错的层，避免构建出与画布不一致的模型
+            logger.error(f"添加层 {layer_type} 时出错: {str(e)}")
+            raise GraphError(f"添加层 {layer_type} ({key}) 失败: {str(e)}", [key]) from e
+
+    apply = _applier(node_layers.setdefault(OUTPUT_HEAD, []))
+    outputs = [tensors[key] for key in graph.outputs]
+    if not outputs:
+        # 与shape_inference的验证一致，不再用示例层代替空模型
+        raise GraphError(NO_LAYERS_MESSAGE)
+
+    if len(outputs) > 1:
+        # 多个分支末端展平后拼接
+        outputs = [apply(tf.keras.layers.Flatten(), t) if len(t.shape) > 2 else t for t in outputs]
+        x = apply(tf.keras.layers.Concatenate(), outputs)
+    else:
+        x = outputs[0]
+
+    # 确保模型以二维的Dense输出层结束
+    last_layer = x._keras_history[0] if hasattr(x, '_keras_history') else None
+    if len(x.shape) > 2 or not isinstance(last_layer, tf.keras.layers.Dense):
+        logger.info(f"添加输出层: Dense({num_classes}, activation='softmax')")
+        if len(x.shape) > 2:
+            x = apply(tf.keras.layers.Flatten(), x)
+        x = apply(tf.keras.layers.Dense(num_classes, activation='softmax'), x)
+
+    return tf.keras.Model(inputs=inputs, outputs=x)
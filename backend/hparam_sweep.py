@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+超参数搜索：在同一个画布上批量比较层配置和学习率的不同取值
+
+模型数据中的sweep描述搜索空间:
+
+    "sweep": {
+        "mode": "grid",                      # grid（默认）或random
+        "trials": 8,                         # random模式的试验数
+        "params": {
+            "dense#0.units": [64, 128],      # 节点ID或'type#序号'加配置字段
+            "dropout#0.rate": {"min": 0.1, "max": 0.5},
+            "learning_rate": {"min": 1e-4, "max": 1e-2, "scale": "log"}
+        }
+    }
+
+grid模式只接受取值列表，展开为全部组合；random模式从列表中均匀选取，或在
+{min, max}区间内采样（scale为log时按对数均匀，type为int时取整数）。每个试验
+写入输出目录下的trial-<序号>子目录，并用HParams插件记录超参数，验证集和
+训练集的最终指标来自history/标签，所有试验可以在同一个HParams页中比较。
+试验在工作进程池中并行运行，每个进程只导入一次TensorFlow，数据源只解析
+一次，各进程内存映射同一份.npy缓存。
+"""
+
+import copy
+import itertools
+import math
+import os
+import random
+import time
+import multiprocessing
+import logging
+
+from atomic_io import write_json_atomic
+from data_pipeline import DEFAULT_DATA_DIR, describe_data_source, load_dataset
+from graph_compiler import node_aliases, resolve_node_keys
+
+logger = logging.getLogger(__name__)
+
+SWEEP_MODES = ('grid', 'random')
+LEARNING_RATE = 'learning_rate'
+DEFAULT_RANDOM_TRIALS = 8
+# grid组合数超过该值时拒绝，避免一次提交成百上千个训练
+MAX_TRIALS = 64
+SWEEP_FILE = 'sweep.json'
+# HParams页比较的指标：试验事件文件中history/命名空间下每轮的训练和验证指标
+METRICS = (
+    ('history/val_accuracy', '验证准确率'),
+    ('history/val_loss', '验证损失'),
+    ('history/accuracy', '训练准确率'),
+    ('history/loss', '训练损失'),
+)
+
+class SweepError(ValueError):
+    """搜索空间描述无效"""
+
+def _node_index(model_data):
+    """节点ID和'type#序号'别名 -> modelStructure中的下标"""
+    structure = model_data.get('modelStructure', []) or []
+    keys = resolve_node_keys(structure, model_data.get('edges', []) or [])
+    aliases = node_aliases(model_data)
+    index = {}
+    for i, key in enumerate(keys):
+        index[key] = i
+        index[aliases[key]] = i
+    return index
+
+def _parse_param(name, values, mode):
+    if isinstance(values, list):
+        if not values:
+            raise SweepError(f"参数 {name} 的取值列表为空")
+        return {'values': values}
+    if isinstance(values, dict) and 'min' in values and 'max' in values:
+        if mode == 'grid':
+            raise SweepError(f"grid模式的参数 {name} 必须是取值列表")
+        low, high = values['min'], values['max']
+        scale = values.get('scale', 'linear')
+        if scale not in ('linear', 'log'):
+            raise SweepError(f"参数 {name} 的scale必须是linear或log")
+        if low > high or (scale == 'log' and low <= 0):
+            raise SweepError(f"参数 {name} 的区间无效: [{low}, {high}]")
+        kind = values.get('type') or ('int' if isinstance(low, int) and isinstance(high, int) else 'float')
+        return {'min': low, 'max': high, 'scale': scale, 'type': kind}
+    raise SweepError(f"参数 {name} 必须是取值列表或{{min, max}}区间")
+
+def parse_sweep(model_data):
+    """检查sweep描述并返回规范化的搜索空间；参数引用的节点必须存在"""
+    spec = model_data.get('sweep')
+    if not isinstance(spec, dict) or not isinstance(spec.get('params'), dict) or not spec['params']:
+        raise SweepError("sweep必须包含非空的params")
+    mode = spec.get('mode', 'grid')
+    if mode not in SWEEP_MODES:
+        raise SweepError(f"不支持的搜索模式: {mode}，可选: {', '.join(SWEEP_MODES)}")
+
+    index = _node_index(model_data)
+    structure = model_data.get('modelStructure', []) or []
+    params = {}
+    for name, values in spec['params'].items():
+        if name != LEARNING_RATE:
+            node, _, field = name.rpartition('.')
+            if node not in index or not field:
+                raise SweepError(f"参数 {name} 没有对应的节点，应为'<节点ID或type#序号>.<配置字段>'")
+            if field not in (structure[index[node]].get('config') or {}):
+                logger.warning(f"节点 {node} 的配置中没有 {field}，将按新字段写入")
+        params[name] = _parse_param(name, values, mode)
+
+    trials = len(list(itertools.product(*(p['values'] for p in params.values())))) if mode == 'grid' \
+        else int(spec.get('trials', DEFAULT_RANDOM_TRIALS))
+    if not 1 <= trials <= MAX_TRIALS:
+        raise SweepError(f"试验数 {trials} 超出范围，最多 {MAX_TRIALS} 个")
+    return {'mode': mode, 'params': params, 'trials': trials, 'seed': spec.get('seed', 0)}
+
+def _sample(param, rng):
+    if 'values' in param:
+        return rng.choice(param['values'])
+    low, high = param['min'], param['max']
+    if param['scale'] == 'log':
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    return int(round(value)) if param['type'] == 'int' else value
+
+def expand_trials(sweep):
+    """把搜索空间展开为试验列表，每个试验是{参数名: 取值}"""
+    names = list(sweep['params'])
+    if sweep['mode'] == 'grid':
+        grids = [sweep['params'][name]['values'] for name in names]
+        return [dict(zip(names, combo)) for combo in itertools.product(*grids)]
+    rng = random.Random(sweep['seed'])
+    return [{name: _sample(sweep['params'][name], rng) for name in names} for _ in range(sweep['trials'])]
+
+def apply_trial(model_data, overrides):
+    """返回应用了试验取值的模型数据（不含sweep）和学习率"""
+    trial_data = {key: value for key, value in model_data.items() if key != 'sweep'}
+    trial_data['modelStructure'] = copy.deepcopy(model_data.get('modelStructure', []) or [])
+    index = _node_index(trial_data)
+    learning_rate = None
+    for name, value in overrides.items():
+        if name == LEARNING_RATE:
+            learning_rate = float(value)
+            continue
+        node, _, field = name.rpartition('.')
+        layer = trial_data['modelStructure'][index[node]]
+        layer['config'] = dict(layer.get('config') or {}, **{field: value})
+    return trial_data, learning_rate
+
+def domains(sweep):
+    """HParams实验配置中每个参数的取值范围（可序列化，在工作进程中转换为hp域）"""
+    return {name: dict(param) for name, param in sweep['params'].items()}
+
+def plan_sweep(model_data, output_root):
+    """把带sweep的模型数据拆分为试验任务列表，返回(sweep, jobs)"""
+    sweep = parse_sweep(model_data)
+    jobs = []
+    for i, overrides in enumerate(expand_trials(sweep)):
+        trial_data, learning_rate = apply_trial(model_data, overrides)
+        name = f"trial-{i:03d}"
+        jobs.append({
+            'id': name,
+            'data': trial_data,
+            'output_dir': os.path.join(output_root, name),
+            'learning_rate': learning_rate,
+            'hparams': overrides,
+        })
+    logger.info(f"超参数搜索: {sweep['mode']}模式，{len(jobs)} 个试验，参数: {', '.join(sweep['params'])}")
+    return sweep, jobs
+
+def _hp_domain(hp, param):
+    if 'values' in param:
+        values = param['values']
+        # Discrete要求同一类型；整数和浮点数混合时统一为浮点数
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values) \
+                and not all(isinstance(v, int) for v in values):
+            values = [float(v) for v in values]
+        return hp.Discrete(values)
+    if param['type'] == 'int':
+        return hp.IntInterval(int(param['min']), int(param['max']))
+    return hp.RealInterval(float(param['min']), float(param['max']))
+
+def write_experiment_summary(log_dir, param_domains):
+    """写入HParams实验配置；在已导入TensorFlow的工作进程中调用"""
+    import tensorflow as tf
+    from tensorboard.plugins.hparams import api as hp
+    hparams = [hp.HParam(name, _hp_domain(hp, param)) for name, param in param_domains.items()]
+    metrics = [hp.Metric(tag, display_name=title) for tag, title in METRICS]
+    with tf.summary.create_file_writer(log_dir).as_default():
+        hp.hparams_config(hparams=hparams, metrics=metrics)
+        tf.summary.flush()
+    return log_dir
+
+def write_trial_summary(writer, hparams):
+    """用试验运行的RunWriter写入本次试验的超参数取值"""
+    from tensorboard.plugins.hparams import api as hp
+    with writer.scope():
+        hp.hparams(hparams, trial_id=os.path.basename(os.path.normpath(writer.log_dir)))
+
+def summarize_sweep(sweep, jobs, results, output_root, elapsed):
+    """汇总所有试验的结果，写入sweep.json并返回"""
+    by_id = {r.get('id'): r for r in results}
+    trials = []
+    for job in jobs:
+        result = by_id.get(job['id'], {})
+        trials.append({
+            'trial': job['id'],
+            'hparams': job['hparams'],
+            'status': result.get('status', 'error'),
+            'log_dir': result.get('log_dir'),
+            'elapsed': result.get('elapsed'),
+            'truncated': result.get('truncated'),
+            'error': result.get('error'),
+        })
+    succeeded = sum(1 for t in trials if t['status'] == 'ok')
+    summary = {
+        'status': 'ok' if succeeded else 'error',
+        'log_dir': os.path.abspath(output_root),
+        'mode': sweep['mode'],
+        'total': len(trials),
+        'succeeded': succeeded,
+        'failed': len(trials) - succeeded,
+        'elapsed': round(elapsed, 3),
+        'trials': trials,
+    }
+    if not succeeded:
+        summary['error'] = "所有试验都失败"
+    write_json_atomic(os.path.join(output_root, SWEEP_FILE), summary)
+    return summary
+
+def warm_data_cache(model_data, data_dir):
+    """在启动试验之前解析一次数据源，之后各工作进程直接内存映射.npy缓存；
+    返回是否加载成功"""
+    try:
+        load_dataset(describe_data_source(model_data), data_dir)
+    except Exception as e:
+        # 各试验会各自退回随机数据，这里只记录一次
+        logger.warning(f"预先加载数据源失败: {str(e)}")
+        return False
+    return True
+
+def run_sweep(model_data, output_root, workers=None, worker_options=None):
+    """用独立的工作进程池并行运行所有试验，返回汇总结果（命令行和管道模式使用）"""
+    from converter_server import init_worker, run_job
+    from cpu_tuning import available_cpus
+
+    sweep, jobs = plan_sweep(model_data, output_root)
+    workers = max(1, min(workers or available_cpus(), len(jobs)))
+    options = dict(worker_options or {}, concurrent_jobs=workers)
+    os.makedirs(output_root, exist_ok=True)
+    if options.get('log_profile') != 'graph-only':
+        warm_data_cache(model_data, options.get('data_dir', DEFAULT_DATA_DIR))
+
+    started = time.time()
+    results = []
+    # 使用spawn而不是fork，TensorFlow在fork后的子进程中不安全
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes=workers, initializer=init_worker, initargs=(options,)) as pool:
+        pool.apply(write_experiment_summary, (output_root, domains(sweep)))
+        for result in pool.imap_unordered(run_job, jobs):
+            results.append(result)
+            logger.info(f"[{len(results)}/{len(jobs)}] {result['id']}: {result['status']} "
+                        f"({result.get('elapsed')}s)")
+    return summarize_sweep(sweep, jobs, results, output_root, time.time() - started)
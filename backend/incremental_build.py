@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按会话增量构建：画布上只改了一部分时，复用上一次构建中未改动的层和权重
+
+每个节点的签名由层类型、配置（去掉index、sequenceId等布局字段）和所有前驱
+节点的签名计算，输入形状是图的根，自动添加的输出层还包含类别数。节点自身或
+它上游的任一节点改动时签名都会变化，因此签名相同的节点就是编辑位置上游、
+可以原样复用的部分：
+
+  - 所有签名都与上一次相同（只改了学习率、种子、预算等超参数）：不编译层、
+    直接加载上一次训练后的模型
+  - 部分签名相同：重新构建模型，签名相同的层从上一次训练后的权重热启动，
+    编辑位置及其下游的层重新初始化
+
+每个会话的状态（model-<标识>.keras和build.json）保存在会话目录下，训练完成后
+更新，服务的任意工作进程都能读取。会话任务的结果缓存键包含会话状态（模型文件
+和各节点签名，见state_key）：结果以训练后的状态为键写入，同一会话原样重复提交
+时直接复用这次的结果，会话状态也仍然与这次的结构一致。日志目录的incremental.json
+记录复用和重建了哪些节点，以及是否命中了缓存。
+"""
+
+import hashlib
+import json
+import os
+import re
+import uuid
+import logging
+
+from atomic_io import write_json_atomic
+from graph_compiler import OUTPUT_HEAD
+from result_cache import VOLATILE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tb_sessions')
+STATE_FILE = 'build.json'
+BUILD_FILE = 'incremental.json'
+MODEL_PREFIX = 'model-'
+# 状态格式版本，签名的计算方式变化时递增以忽略旧状态
+STATE_VERSION = 1
+# 只影响画布布局、不影响模型的配置字段
+LAYOUT_FIELDS = VOLATILE_FIELDS | {'sequenceId'}
+SESSION_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+
+def _digest(value):
+    encoded = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:24]
+
+def node_signatures(graph, input_shape, num_classes):
+    """计算CompiledGraph中每个节点的签名，输出层部分记在OUTPUT_HEAD下"""
+    root = _digest({'input_shape': list(input_shape)})
+    signatures = {}
+    for key in graph.order:
+        layer = graph.nodes[key]
+        config = {k: v for k, v in (layer.get('config') or {}).items() if k not in LAYOUT_FIELDS}
+        inputs = [signatures[p] for p in graph.inputs.get(key, [])] or [root]
+        signatures[key] = _digest({'type': layer.get('type'), 'config': config, 'inputs': inputs})
+    outputs = [signatures[key] for key in graph.outputs] or [root]
+    signatures[OUTPUT_HEAD] = _digest({'outputs': outputs, 'num_classes': num_classes})
+    return signatures
+
+def session_state_dir(session, state_dir=None):
+    """会话状态目录；session只能包含字母、数字、下划线和连字符"""
+    if not isinstance(session, str) or not SESSION_PATTERN.match(session):
+        raise ValueError(f"无效的会话标识: {session!r}")
+    return os.path.join(state_dir or DEFAULT_SESSION_DIR, session)
+
+class SessionBuild:
+    """一个会话的增量构建：读取上一次的状态，复用未改动的层，训练后保存新状态"""
+
+    def __init__(self, session, state_dir=None):
+        self.session = session
+        self.path = session_state_dir(session, state_dir)
+        self.previous = self._load_state()
+        self.signatures = None
+        # 节点键 -> 本次模型中该节点的层名
+        self.layer_names = {}
+        self.reused = []
+        self.rebuilt = []
+        self.skipped_build = False
+        self.warm_started = False
+        self.cached = False
+        # save写入的新状态
+        self.saved = None
+
+    @staticmethod
+    def state_key(state):
+        """会话状态中决定结果的部分，作为结果缓存salt的一项；没有状态时为None"""
+        if state is None:
+            return None
+        return {'model_file': state['model_file'],
+                'signatures': sorted(node['signature'] for node in state['nodes'])}
+
+    def _load_state(self):
+        try:
+            with open(os.path.join(self.path, STATE_FILE), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取会话 {self.session} 的构建状态失败，将完整构建: {str(e)}")
+            return None
+        if state.get('version') != STATE_VERSION:
+            return None
+        return state
+
+    def _load_previous_model(self, tf):
+        """加载上一次训练后的模型，文件已被并发的任务替换时返回None"""
+        path = os.path.join(self.path, self.previous['model_file'])
+        try:
+            return tf.keras.models.load_model(path, compile=False)
+        except Exception as e:
+            logger.warning(f"加载会话 {self.session} 的上一次模型失败，将完整构建: {str(e)}")
+            return None
+
+    def unchanged(self, signatures):
+        """记录本次的签名，返回是否与上一次完全相同（只改了超参数）"""
+        self.signatures = signatures
+        if self.previous is None:
+            return False
+        return sorted(node['signature'] for node in self.previous['nodes']) == sorted(signatures.values())
+
+    def load_model(self, tf):
+        """结构没有变化时直接加载上一次训练后的模型，失败时返回None"""
+        model = self._load_previous_model(tf)
+        if model is None:
+            return None
+        names = {}
+        for node in self.previous['nodes']:
+            names.setdefault(node['signature'], []).append(node['layers'])
+        self.layer_names = {key: names[signature].pop(0) for key, signature in self.signatures.items()}
+        self.reused = list(self.signatures)
+        self.skipped_build = True
+        self.warm_started = True
+        logger.info(f"会话 {self.session} 的模型结构没有变化，跳过构建，加载上一次训练后的模型")
+        return model
+
+    def warm_start(self, tf, node_layers):
+        """把签名相同的节点的权重从上一次的模型复制到新构建的层上
+
+        node_layers为build_keras_model填入的节点键 -> 层列表。
+        """
+        self.layer_names = {key: [layer.name for layer in layers] for key, layers in node_layers.items()}
+        previous_layers = {}
+        if self.previous is not None:
+            for node in self.previous['nodes']:
+                previous_layers.setdefault(node['signature'], []).append(node['layers'])
+        self.reused, self.rebuilt = [], []
+        previous_model = None
+        for key, layers in node_layers.items():
+            candidates = previous_layers.get(self.signatures.get(key))
+            if not candidates:
+                self.rebuilt.append(key)
+                continue
+            names = candidates.pop(0)
+            if any(layer.weights for layer in layers):
+                if previous_model is None:
+                    previous_model = self._load_previous_model(tf)
+                    if previous_model is None:
+                        self.reused, self.rebuilt = [], list(node_layers)
+                        return
+                if not self._copy_weights(previous_model, names, layers):
+                    self.rebuilt.append(key)
+                    continue
+                self.warm_started = True
+            self.reused.append(key)
+        if self.previous is not None:
+            logger.info(f"会话 {self.session} 增量构建：复用 {len(self.reused)} 个节点，"
+                        f"重建 {len(self.rebuilt)} 个节点: {self.rebuilt}")
+
+    @staticmethod
+    def _copy_weights(previous_model, names, layers):
+        """按顺序把上一次模型中names对应层的权重复制到layers，形状不一致时返回False"""
+        if len(names) != len(layers):
+            return False
+        pairs = []
+        for name, layer in zip(names, layers):
+            try:
+                weights = previous_model.get_layer(name).get_weights()
+            except ValueError:
+                return False
+            if [w.shape for w in weights] != [tuple(v.shape) for v in layer.weights]:
+                return False
+            pairs.append((layer, weights))
+        for layer, weights in pairs:
+            layer.set_weights(weights)
+        return True
+
+    def save(self, model):
+        """保存训练后的模型和每个节点的签名，作为下一次构建的基础"""
+        os.makedirs(self.path, exist_ok=True)
+        model_file = f"{MODEL_PREFIX}{uuid.uuid4().hex[:12]}.keras"
+        model.save(os.path.join(self.path, model_file))
+        nodes = [{'key': key, 'signature': signature, 'layers': self.layer_names.get(key, [])}
+                 for key, signature in self.signatures.items()]
+        state = {'version': STATE_VERSION, 'model_file': model_file, 'nodes': nodes}
+        write_json_atomic(os.path.join(self.path, STATE_FILE), state)
+        self.saved = state
+        # 状态文件替换后，本次读取的旧模型文件不再被引用
+        if self.previous is not None and self.previous['model_file'] != model_file:
+            try:
+                os.remove(os.path.join(self.path, self.previous['model_file']))
+            except OSError:
+                pass
+
+    def report(self):
+        return {
+            'session': self.session,
+            'cached': self.cached,
+            'skipped_build': self.skipped_build,
+            'warm_started': self.warm_started,
+            'reused': self.reused,
+            'rebuilt': self.rebuilt,
+        }
+
+    def write_report(self, log_dir):
+        """在日志目录写入incremental.json"""
+        return write_json_atomic(os.path.join(log_dir, BUILD_FILE), self.report())
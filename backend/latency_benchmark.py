@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+构建出的模型的CPU推理延迟测量
+
+对每个批大小先预热，再重复推理并统计p50/p99延迟和吞吐量；在第一个批大小上
+逐层单独运行，给出每层的耗时占比。模型还会转换为TFLite的float和动态范围
+量化（权重int8）两个版本，用TFLite解释器测量同样的批大小，结果可用于判断
+画布上的模型是否适合部署。TensorFlow由调用方传入，与graph_compiler一致。
+"""
+
+import math
+import time
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZES = (1, 8, 32)
+DEFAULT_ITERATIONS = 50
+DEFAULT_WARMUP = 5
+LATENCY_FILE = 'latency.json'
+# TFLite变体：名称 -> 是否做动态范围量化
+TFLITE_VARIANTS = (('tflite_float', False), ('tflite_dynamic', True))
+
+def latency_options(value):
+    """把任务中的latency设置（True或字典）规范化为完整的选项，未开启时返回None"""
+    if not value:
+        return None
+    options = dict(value) if isinstance(value, dict) else {}
+    batch_sizes = sorted({int(b) for b in options.get('batch_sizes') or DEFAULT_BATCH_SIZES})
+    if not batch_sizes or batch_sizes[0] < 1:
+        raise ValueError(f"无效的批大小: {options.get('batch_sizes')}")
+    return {
+        'batch_sizes': batch_sizes,
+        'iterations': max(1, int(options.get('iterations', DEFAULT_ITERATIONS))),
+        'warmup': max(0, int(options.get('warmup', DEFAULT_WARMUP))),
+        'tflite': bool(options.get('tflite', True)),
+    }
+
+def summarize(samples, batch_size):
+    """把单次推理耗时（秒）汇总为毫秒级的分位数和吞吐量"""
+    ordered = sorted(samples)
+    
+    def percentile(q):
+        # 最近秩法，样本少时p99即最大值
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))] * 1000
+    
+    mean = sum(ordered) / len(ordered)
+    return {
+        'batch_size': batch_size,
+        'p50_ms': round(percentile(0.5), 4),
+        'p99_ms': round(percentile(0.99), 4),
+        'mean_ms': round(mean * 1000, 4),
+        'throughput': round(batch_size / mean, 2) if mean > 0 else None,
+    }
+
+def _time_calls(func, warmup, iterations):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def _sample_input(model, batch_size, seed=0):
+    shape = [d if d is not None else 1 for d in model.input_shape[1:]]
+    return np.random.default_rng(seed).random((batch_size, *shape), dtype=np.float32)
+
+def measure_keras(tf, model, options):
+    """用tf.function测量Keras模型在各批大小下的推理延迟"""
+    forward = tf.function(lambda x: model(x, training=False), reduce_retracing=True)
+    results = []
+    for batch_size in options['batch_sizes']:
+        x = tf.constant(_sample_input(model, batch_size))
+        # .numpy()等待计算完成，计时包含完整的推理
+        samples = _time_calls(lambda: forward(x).numpy(), options['warmup'], options['iterations'])
+        results.append(summarize(samples, batch_size))
+    return results
+
+def measure_layers(tf, model, batch_size, options):
+    """逐层单独运行，返回每层的延迟；输入由一次前向计算得到的中间结果提供"""
+    layers = [layer for layer in model.layers if not isinstance(layer, tf.keras.layers.InputLayer)]
+    flat_inputs = []
+    slices = []
+    for layer in layers:
+        tensors = layer.input if isinstance(layer.input, (list, tuple)) else [layer.input]
+        slices.append((len(flat_inputs), len(tensors), isinstance(layer.input, (list, tuple))))
+        flat_inputs.extend(tensors)
+    extractor = tf.keras.Model(model.input, flat_inputs)
+    values = extractor(_sample_input(model, batch_size), training=False)
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    
+    results = []
+    for layer, (start, count, multiple) in zip(layers, slices):
+        args = list(values[start:start + count])
+        inputs = args if multiple else args[0]
+        forward = tf.function(lambda x, layer=layer: layer(x, training=False))
+        samples = _time_calls(lambda: tf.nest.map_structure(lambda t: t.numpy(), forward(inputs)),
+                              options['warmup'], options['iterations'])
+        stats = summarize(samples, batch_size)
+        results.append({
+            'name': layer.name,
+            'class': layer.__class__.__name__,
+            'p50_ms': stats['p50_ms'],
+            'mean_ms': stats['mean_ms'],
+        })
+    total = sum(layer['p50_ms'] for layer in results)
+    for layer in results:
+        layer['share'] = round(layer['p50_ms'] / total, 4) if total > 0 else None
+    return results
+
+def _interpreter_class(tf):
+    """优先使用ai_edge_litert的LiteRT解释器，未安装时退回tf.lite.Interpreter"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        return tf.lite.Interpreter
+
+def convert_tflite(tf, model, quantize=False):
+    """把Keras模型转换为TFLite；内置算子不支持时（如部分RNN）允许回退到TF算子"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize:
+        # 没有代表性数据集时为动态范围量化：权重int8，激活在运行时量化
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    try:
+        return converter.convert()
+    except Exception as e:
+        logger.warning(f"TFLite内置算子转换失败，尝试允许TF算子: {str(e)}")
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+        return converter.convert()
+
+def measure_tflite(tf, model, content, options, num_threads=None):
+    """用TFLite解释器测量各批大小下的推理延迟"""
+    interpreter = _interpreter_class(tf)(model_content=content, num_threads=num_threads)
+    input_detail = interpreter.get_input_details()[0]
+    results = []
+    for batch_size in options['batch_sizes']:
+        x = _sample_input(model, batch_size)
+        interpreter.resize_tensor_input(input_detail['index'], list(x.shape))
+        interpreter.allocate_tensors()
+        interpreter.set_tensor(input_detail['index'], x)
+        samples = _time_calls(interpreter.invoke, options['warmup'], options['iterations'])
+        results.append(summarize(samples, batch_size))
+    return results
+
+def benchmark_model(tf, model, options, num_threads=None):
+    """测量Keras模型、逐层和TFLite变体的推理延迟，返回JSON可序列化的报告"""
+    report = {
+        'options': options,
+        'keras': measure_keras(tf, model, options),
+        'layer_batch_size': options['batch_sizes'][0],
+        'layers': [],
+        'tflite': {},
+    }
+    try:
+        report['layers'] = measure_layers(tf, model, options['batch_sizes'][0], options)
+    except Exception as e:
+        # 逐层测量依赖函数式模型的中间张量，失败时不影响整体结果
+        logger.warning(f"逐层延迟测量失败: {str(e)}")
+        report['layers_error'] = str(e)
+    
+    if options['tflite']:
+        for name, quantize in TFLITE_VARIANTS:
+            try:
+                content = convert_tflite(tf, model, quantize)
+                report['tflite'][name] = {
+                    'model_bytes': len(content),
+                    'latency': measure_tflite(tf, model, content, options, num_threads),
+                }
+            except Exception as e:
+                logger.warning(f"TFLite变体 {name} 测量失败: {str(e)}")
+                report['tflite'][name] = {'error': str(e)}
+    return report
+
+def format_latency_markdown(report):
+    """把延迟报告格式化为Markdown表格，用于TensorBoard文本摘要"""
+    lines = ["| 变体 | 批大小 | p50(ms) | p99(ms) | 吞吐量(样本/秒) |", "|---|---|---|---|---|"]
+    variants = [('keras', report['keras'])]
+    variants += [(name, v['latency']) for name, v in report['tflite'].items() if 'latency' in v]
+    for name, results in variants:
+        for r in results:
+            lines.append(f"| {name} | {r['batch_size']} | {r['p50_ms']} | {r['p99_ms']} | {r['throughput']} |")
+    if report['layers']:
+        lines += [
+            "",
+            f"逐层延迟（批大小 {report['layer_batch_size']}）:",
+            "",
+            "| 层 | 类型 | p50(ms) | 占比 |",
+            "|---|---|---|---|",
+        ]
+        for layer in report['layers']:
+            share = f"{layer['share']:.1%}" if layer['share'] is not None else '-'
+            lines.append(f"| {layer['name']} | {layer['class']} | {layer['p50_ms']} | {share} |")
+    for name, variant in report['tflite'].items():
+        if 'error' in variant:
+            lines.append(f"\n{name} 转换失败: {variant['error']}")
+    return "\n".join(lines)
+
+def write_latency_summaries(tf, report):
+    """把延迟报告写入当前默认的摘要写入器：按批大小作为step的标量、逐层标量和文本表格"""
+    variants = [('keras', report['keras'])]
+    variants += [(name, v['latency']) for name, v in report['tflite'].items() if 'latency' in v]
+    for name, results in variants:
+        for r in results:
+            tf.summary.scalar(f"latency/{name}/p50_ms", r['p50_ms'], step=r['batch_size'])
+            tf.summary.scalar(f"latency/{name}/p99_ms", r['p99_ms'], step=r['batch_size'])
+            if r['throughput'] is not None:
+                tf.summary.scalar(f"latency/{name}/throughput", r['throughput'], step=r['batch_size'])
+    for name, variant in report['tflite'].items():
+        if 'model_bytes' in variant:
+            tf.summary.scalar(f"latency/{name}/model_kb", variant['model_bytes'] / 1024, step=0)
+    for i, layer in enumerate(report['layers']):
+        tf.summary.scalar("latency/layer_p50_ms", layer['p50_ms'], step=i)
+    tf.summary.text("latency_report", format_latency_markdown(report), step=0)
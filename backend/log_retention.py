@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+日志目录的保留、压缩和垃圾回收
+
+tb_logs下每次转换生成一个运行目录（以tb_ready.txt为标记；批量转换的根目录
+下有多个运行目录）。回收按存活时间、运行数和总大小淘汰最旧的运行；没有
+成功标记且超过宽限期的目录视为失败的运行，同样参与淘汰。
+
+压缩把一个运行中分散在train/train、train/validation、history、metrics等子目录
+的事件文件合并为运行目录下的单个事件文件，标签以原来的子目录为前缀（例如
+train/validation/epoch_loss）。标量、文本和运行元数据全部保留，直方图和图像
+按步数均匀降采样（0表示丢弃）。计算图（graph_def/meta_graph_def）没有标签，
+合并后TensorBoard无法区分来源，只保留第一个带计算图的目录（优先运行根目录）
+中的计算图。事件文件的读写只依赖tensorboard包，不导入TensorFlow。
+
+后端的会话在日志目录中写入.session.lock（内容为后端进程的pid），会话销毁时
+删除；带有效锁的运行以及宽限期内仍有文件更新的运行不会被删除或压缩。
+
+    python log_retention.py --max-age-days 7 --max-runs 200 --max-mb 4096
+    python convert_tensorboard.py gc --compact-after-hours 24 --dry-run
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import time
+import logging
+
+from atomic_io import write_json_atomic
+from event_reader import read_records
+from hparam_sweep import SWEEP_FILE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tb_logs')
+READY_MARKER = 'tb_ready.txt'
+COMPACTION_MARKER = 'compaction.json'
+COMPACTED_SUFFIX = '.compacted.v2'
+# 后端会话持有的日志目录锁，进程已退出的锁视为失效
+SESSION_LOCK = '.session.lock'
+# 没有标签、合并后会互相覆盖的事件类型
+GRAPH_KINDS = {'graph_def', 'meta_graph_def'}
+# 没有成功标记的目录在宽限期内视为仍在转换，不会被回收
+DEFAULT_GRACE_SECONDS = 3600
+# 压缩后每个直方图/图像标签保留的步数
+DEFAULT_KEEP_HISTOGRAMS = 5
+DEFAULT_KEEP_IMAGES = 1
+# 按降采样处理的插件，以及TF1风格摘要中对应的值类型
+SAMPLED_PLUGINS = {'histograms': 'histo', 'images': 'image'}
+
+def is_event_file(name):
+    return 'tfevents' in name and not name.startswith('.')
+
+class RunInfo:
+    """一个运行目录的统计信息"""
+
+    def __init__(self, path, complete, size, mtime, modified=None):
+        self.path = path
+        self.complete = complete
+        self.size = size
+        self.mtime = mtime
+        # 目录下文件最新的修改时间，用来判断运行是否仍在写入
+        self.modified = modified if modified is not None else mtime
+
+    def to_dict(self):
+        return {'path': self.path, 'complete': self.complete, 'bytes': self.size,
+                'age_hours': round((time.time() - self.mtime) / 3600, 2)}
+
+def _dir_stats(path):
+    """返回目录下文件的总大小和最新的修改时间"""
+    size = 0
+    newest = os.stat(path).st_mtime
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            size += stat.st_size
+            newest = max(newest, stat.st_mtime)
+    return size, newest
+
+def _marked_runs(path):
+    """返回path下所有带成功标记的运行目录（不再进入运行目录内部）"""
+    if os.path.isfile(os.path.join(path, READY_MARKER)):
+        return [path]
+    runs = []
+    for name in sorted(os.listdir(path)):
+        child = os.path.join(path, name)
+        if not name.startswith('.') and os.path.isdir(child) and not os.path.islink(child):
+            runs.extend(_marked_runs(child))
+    return runs
+
+def collect_runs(root):
+    """扫描日志根目录，返回RunInfo列表"""
+    runs = []
+    if not os.path.isdir(root):
+        return runs
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if name.startswith('.') or not os.path.isdir(path) or os.path.islink(path):
+            continue
+        marked = _marked_runs(path)
+        for run_dir in marked or [path]:
+            size, newest = _dir_stats(run_dir)
+            if marked:
+                # 完成的运行以成功标记的时间为准，之后的读取和压缩不算作更新
+                mtime = os.stat(os.path.join(run_dir, READY_MARKER)).st_mtime
+            else:
+                mtime = newest
+            runs.append(RunInfo(run_dir, bool(marked), size, mtime, newest))
+    return runs
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def is_locked(run_dir, root):
+    """运行目录或它在root下的上级目录是否被仍在运行的后端会话锁定"""
+    root = os.path.abspath(root)
+    path = os.path.abspath(run_dir)
+    while path.startswith(root):
+        lock = os.path.join(path, SESSION_LOCK)
+        if os.path.exists(lock):
+            try:
+                with open(lock, 'r', encoding='utf-8') as f:
+                    pid = int(json.load(f)['pid'])
+            except (OSError, ValueError, KeyError, TypeError):
+                # 无法解析的锁按有效处理，宁可少回收
+                return True
+            if _pid_alive(pid):
+                return True
+        if path == root:
+            break
+        path = os.path.dirname(path)
+    return False
+
+def remove_run(run_dir, root):
+    """先改名再删除运行目录，然后清理变空的上级目录（不超出root）"""
+    trash = os.path.join(os.path.dirname(run_dir), f".trash-{os.path.basename(run_dir)}-{os.getpid()}")
+    try:
+        os.rename(run_dir, trash)
+    except OSError as e:
+        logger.warning(f"删除运行目录失败: {run_dir}: {str(e)}")
+        return False
+    shutil.rmtree(trash, ignore_errors=True)
+
+    parent = os.path.dirname(run_dir)
+    root = os.path.abspath(root)
+    while os.path.abspath(parent) != root and parent.startswith(root):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
+    return True
+
+def enforce_retention(root, max_age=None, max_runs=None, max_bytes=None,
+                      grace=DEFAULT_GRACE_SECONDS, dry_run=False):
+    """按存活时间、运行数和总大小淘汰最旧的运行，返回被删除的RunInfo列表"""
+    now = time.time()
+    runs = [run for run in collect_runs(root)
+            if (run.complete or now - run.mtime > grace) and not is_locked(run.path, root)]
+    expired = [run for run in runs if max_age is not None and now - run.mtime > max_age]
+    kept = sorted((run for run in runs if run not in expired), key=lambda run: run.mtime, reverse=True)
+
+    removed = list(expired)
+    total = sum(run.size for run in kept)
+    while kept and ((max_runs is not None and len(kept) > max_runs)
+                    or (max_bytes is not None and total > max_bytes)):
+        run = kept.pop()
+        total -= run.size
+        removed.append(run)
+
+    for run in removed:
+        logger.info(f"{'将删除' if dry_run else '删除'}运行: {run.path} "
+                    f"({run.size / 1024 / 1024:.1f}MB, {(now - run.mtime) / 3600:.1f}小时前)")
+        if not dry_run:
+            remove_run(run.path, root)
+    return removed
+
+def read_events(path):
+    """逐条读取事件文件中的Event，遇到截断或损坏的记录时停止"""
+    for event, _ in read_records(path):
+        yield event
+
+def _evenly_spaced(count, keep):
+    """在count个点中均匀选出keep个，总是包含最后一个"""
+    if keep >= count:
+        return set(range(count))
+    if keep == 1:
+        return {count - 1}
+    return {round(i * (count - 1) / (keep - 1)) for i in range(keep)}
+
+def _plugin_of(value, plugins, key):
+    """值所属的插件；TF2摘要只在标签第一次出现时携带元数据"""
+    name = value.metadata.plugin_data.plugin_name
+    if name:
+        plugins[key] = name
+        return name
+    if key in plugins:
+        return plugins[key]
+    kind = value.WhichOneof('value')
+    for plugin, value_kind in SAMPLED_PLUGINS.items():
+        if kind == value_kind:
+            plugins[key] = plugin
+            return plugin
+    return None
+
+def compact_run(run_dir, keep_histograms=DEFAULT_KEEP_HISTOGRAMS, keep_images=DEFAULT_KEEP_IMAGES):
+    """把运行目录中的事件文件合并为一个，返回压缩统计"""
+    from tensorboard.compat.proto import event_pb2
+    from tensorboard.summary.writer.record_writer import RecordWriter
+
+    sources = []
+    stale = []
+    for root, _, files in os.walk(run_dir):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if name.endswith(COMPACTED_SUFFIX):
+                stale.append(path)
+            elif is_event_file(name):
+                sources.append(path)
+    if not sources:
+        return None
+    # 标记写入之前中断的压缩留下的合并文件，源文件都还在，删除后重新压缩
+    for path in stale:
+        os.unlink(path)
+
+    keep = {'histograms': keep_histograms, 'images': keep_images}
+    plugins = {}
+    metadata = {}
+    # (wall_time, step, 源序号, 标签键, Event)，摘要事件拆成每个值一条
+    records = []
+    before = 0
+    graph_dir = None
+    graphs_dropped = 0
+    for index, path in enumerate(sources):
+        before += os.path.getsize(path)
+        prefix = os.path.relpath(os.path.dirname(path), run_dir).replace(os.sep, '/')
+        prefix = '' if prefix == '.' else prefix + '/'
+        for event in read_events(path):
+            kind = event.WhichOneof('what')
+            if kind == 'file_version':
+                continue
+            if kind in GRAPH_KINDS:
+                # os.walk先返回运行根目录，计算图优先取根目录中的
+                if graph_dir is None:
+                    graph_dir = prefix
+                if graph_dir != prefix:
+                    graphs_dropped += 1
+                    continue
+            elif kind == 'tagged_run_metadata':
+                event.tagged_run_metadata.tag = prefix + event.tagged_run_metadata.tag
+            if kind != 'summary':
+                records.append((event.wall_time, event.step, index, None, event))
+                continue
+            for value in event.summary.value:
+                key = prefix + value.tag
+                plugin = _plugin_of(value, plugins, key)
+                if value.HasField('metadata') and key not in metadata:
+                    metadata[key] = value.metadata
+                single = event_pb2.Event(wall_time=event.wall_time, step=event.step)
+                new_value = single.summary.value.add()
+                new_value.CopyFrom(value)
+                new_value.tag = key
+                records.append((event.wall_time, event.step, index, (key, plugin), single))
+
+    # 直方图和图像按标签均匀降采样
+    occurrences = {}
+    for position, record in enumerate(records):
+        if record[3] and record[3][1] in keep:
+            occurrences.setdefault(record[3][0], []).append(position)
+    dropped = set()
+    for key, positions in occurrences.items():
+        kept = _evenly_spaced(len(positions), keep[plugins[key]])
+        dropped.update(p for i, p in enumerate(positions) if i not in kept)
+
+    merged = [record for position, record in enumerate(records) if position not in dropped]
+    merged.sort(key=lambda record: (record[0], record[2]))
+
+    wall_time = time.time()
+    target = os.path.join(run_dir, f"events.out.tfevents.{int(wall_time)}.{socket.gethostname()}{COMPACTED_SUFFIX}")
+    tmp_path = os.path.join(run_dir, f".compacting-{os.getpid()}")
+    seen = set()
+    writer = RecordWriter(open(tmp_path, 'wb'))
+    try:
+        writer.write(event_pb2.Event(wall_time=wall_time, file_version='brain.Event:2').SerializeToString())
+        for _, _, _, tag, event in merged:
+            if tag is not None and tag[0] not in seen:
+                # 降采样可能丢掉带元数据的第一个值，补到保留下来的第一个值上
+                seen.add(tag[0])
+                value = event.summary.value[0]
+                if not value.HasField('metadata') and tag[0] in metadata:
+                    value.metadata.CopyFrom(metadata[tag[0]])
+            writer.write(event.SerializeToString())
+    finally:
+        writer.close()
+    os.replace(tmp_path, target)
+
+    # 先写标记再删除源文件：中断时最多留下重复的数据，不会丢失
+    stats = {
+        'compacted_at': round(wall_time, 3),
+        'source_files': len(sources),
+        'events_before': len(records),
+        'events_after': len(merged),
+        'graphs_dropped': graphs_dropped,
+        'bytes_before': before,
+        'bytes_after': os.path.getsize(target),
+    }
+    write_json_atomic(os.path.join(run_dir, COMPACTION_MARKER), stats)
+
+    for path in sources:
+        os.unlink(path)
+    for root, dirs, files in os.walk(run_dir, topdown=False):
+        if root != run_dir and not os.listdir(root):
+            os.rmdir(root)
+    return stats
+
+def compact_runs(root, older_than, keep_histograms=DEFAULT_KEEP_HISTOGRAMS,
+                 keep_images=DEFAULT_KEEP_IMAGES, dry_run=False, grace=DEFAULT_GRACE_SECONDS):
+    """压缩完成时间早于older_than秒之前、尚未压缩的运行，返回{运行目录: 统计}
+
+    被会话锁定或grace秒内仍有文件更新的运行可能正在写入，跳过。
+    """
+    now = time.time()
+    results = {}
+    for run in collect_runs(root):
+        if not run.complete or now - run.mtime < older_than:
+            continue
+        if now - run.modified < grace or is_locked(run.path, root):
+            logger.info(f"运行仍在使用，跳过压缩: {run.path}")
+            continue
+        if os.path.exists(os.path.join(run.path, COMPACTION_MARKER)):
+            continue
+        if os.path.exists(os.path.join(run.path, SWEEP_FILE)):
+            # HParams页按试验子目录区分会话，超参数搜索保持原有的目录结构
+            continue
+        if dry_run:
+            logger.info(f"将压缩运行: {run.path}")
+            results[run.path] = None
+            continue
+        try:
+            stats = compact_run(run.path, keep_histograms, keep_images)
+        except Exception as e:
+            logger.error(f"压缩运行失败: {run.path}: {str(e)}")
+            continue
+        if stats:
+            logger.info(f"已压缩运行: {run.path} ({stats['source_files']}个事件文件, "
+                        f"{stats['bytes_before'] / 1024:.0f}KB -> {stats['bytes_after'] / 1024:.0f}KB)")
+        results[run.path] = stats
+    return results
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='日志目录的保留、压缩和垃圾回收')
+    parser.add_argument('--root', default=DEFAULT_LOG_ROOT, help='日志根目录（默认backend/tb_logs）')
+    parser.add_argument('--max-age-days', type=float, default=7, help='运行的最长保留时间(天)，0表示不限制')
+    parser.add_argument('--max-runs', type=int, default=500, help='最多保留的运行数，0表示不限制')
+    parser.add_argument('--max-mb', type=float, default=4096, help='日志总大小上限(MB)，0表示不限制')
+    parser.add_argument('--grace-minutes', type=float, default=DEFAULT_GRACE_SECONDS / 60,
+                        help='没有成功标记的目录在多长时间内视为仍在转换(分钟)')
+    parser.add_argument('--compact-after-hours', type=float, default=24,
+                        help='压缩完成超过该时间的运行(小时)，负数表示不压缩')
+    parser.add_argument('--keep-histograms', type=int, default=DEFAULT_KEEP_HISTOGRAMS,
+                        help='压缩时每个直方图标签保留的步数，0表示丢弃')
+    parser.add_argument('--keep-images', type=int, default=DEFAULT_KEEP_IMAGES,
+                        help='压缩时每个图像标签保留的步数，0表示丢弃')
+    parser.add_argument('--dry-run', action='store_true', help='只输出将要删除和压缩的运行')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """回收入口：先淘汰再压缩，最后把汇总以JSON输出到stdout"""
+    args = parse_arguments(argv)
+    removed = enforce_retention(
+        args.root,
+        max_age=args.max_age_days * 86400 if args.max_age_days > 0 else None,
+        max_runs=args.max_runs if args.max_runs > 0 else None,
+        max_bytes=args.max_mb * 1024 * 1024 if args.max_mb > 0 else None,
+        grace=args.grace_minutes * 60,
+        dry_run=args.dry_run
+    )
+    compacted = {}
+    if args.compact_after_hours >= 0:
+        compacted = compact_runs(args.root, args.compact_after_hours * 3600,
+                                 keep_histograms=max(0, args.keep_histograms),
+                                 keep_images=max(0, args.keep_images), dry_run=args.dry_run,
+                                 grace=args.grace_minutes * 60)
+    remaining = collect_runs(args.root)
+    print(json.dumps({
+        'dry_run': args.dry_run,
+        'removed': [run.to_dict() for run in removed],
+        'compacted': compacted,
+        'runs': len(remaining),
+        'bytes': sum(run.size for run in remaining),
+    }, ensure_ascii=False))
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    main()
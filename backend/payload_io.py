@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+管道模式的输入输出：从stdin读取模型数据，把结果文档写到stdout
+
+模型数据可以是紧凑JSON或msgpack（msgpack已列入requirements.txt），auto时按首个非空白
+字节判断：'{'或'['为JSON，其余为msgpack。数据只在内存中解析一次，请求路径上
+没有临时文件的写入和回读。
+"""
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+AUTO = 'auto'
+INPUT_FORMATS = (AUTO, 'json', 'msgpack')
+OUTPUT_FORMATS = ('json', 'msgpack')
+STDIN_PATH = '-'
+
+def _load_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        logger.error("未安装msgpack,请运行: pip install msgpack")
+        raise
+    return msgpack
+
+def detect_format(raw):
+    """根据首个非空白字节判断数据格式"""
+    head = raw.lstrip()[:1]
+    return 'json' if head in (b'{', b'[') else 'msgpack'
+
+def decode_payload(raw, data_format=AUTO):
+    """把字节串解析为模型数据（dict）"""
+    if data_format not in INPUT_FORMATS:
+        raise ValueError(f"不支持的输入格式: {data_format}，可选: {', '.join(INPUT_FORMATS)}")
+    if data_format == AUTO:
+        data_format = detect_format(raw)
+    if data_format == 'json':
+        data = json.loads(raw)
+    else:
+        data = _load_msgpack().unpackb(raw, raw=False)
+    if not isinstance(data, dict):
+        raise ValueError(f"模型数据必须是对象，收到: {type(data).__name__}")
+    return data
+
+def encode_result(result, data_format='json'):
+    """把结果文档编码为字节串：紧凑的单行JSON（以换行结尾）或msgpack"""
+    if data_format == 'msgpack':
+        return _load_msgpack().packb(result, use_bin_type=True)
+    return (json.dumps(result, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+def write_result(stream, result, data_format='json'):
+    """把结果文档写入二进制流并刷新"""
+    stream.write(encode_result(result, data_format))
+    stream.flush()
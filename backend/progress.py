@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+转换进度的结构化事件流
+
+转换过程中按阶段、批次和轮次产生事件，每个事件是一个JSON对象:
+
+    {"event": "phase", "phase": "build", "elapsed": 0.12}
+    {"event": "train_begin", "epochs": 2, "steps": 3, "elapsed": 0.8}
+    {"event": "batch", "epoch": 0, "batch": 1, "steps": 3, "metrics": {"loss": 2.3}, "elapsed": 1.1}
+    {"event": "epoch", "epoch": 0, "metrics": {"loss": 2.3, "val_loss": 2.2}, "elapsed": 1.4}
+    {"event": "result", "status": "ok", "log_dir": "/path/logs", "elapsed": 3.2}
+
+事件通过sink函数输出：命令行模式直接写stdout的一行，服务模式由工作进程
+经队列交给分发进程，再附上任务id写回对应的连接。
+"""
+
+import json
+import math
+import sys
+import threading
+import time
+
+# 批次事件的最小间隔（秒），避免小批次训练时刷屏
+DEFAULT_BATCH_INTERVAL = 0.25
+
+class ProgressReporter:
+    """把进度事件交给sink，自动附加从创建起经过的时间"""
+
+    def __init__(self, sink, batch_interval=DEFAULT_BATCH_INTERVAL):
+        self.sink = sink
+        self.batch_interval = batch_interval
+        self.started = time.time()
+
+    def emit(self, event, **fields):
+        message = {'event': event}
+        message.update(fields)
+        message['elapsed'] = round(time.time() - self.started, 3)
+        try:
+            self.sink(message)
+        except Exception:
+            # 进度只是辅助信息，输出失败不能影响转换本身
+            pass
+
+    def phase(self, name, **fields):
+        self.emit('phase', phase=name, **fields)
+
+def stdout_sink(stream=None):
+    """返回把事件按JSON-lines写到stdout的sink"""
+    stream = stream or sys.stdout
+    lock = threading.Lock()
+
+    def write(message):
+        with lock:
+            stream.write(json.dumps(message, ensure_ascii=False) + '\n')
+            stream.flush()
+    return write
+
+def _clean_metrics(logs):
+    """把Keras的logs转为JSON可序列化的数值字典"""
+    metrics = {}
+    for key, value in (logs or {}).items():
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        # NaN/inf不是合法的JSON
+        metrics[key] = round(value, 6) if math.isfinite(value) else None
+    return metrics
+
+def keras_callback(tf, reporter):
+    """创建把训练进度转为事件的Keras回调（TensorFlow延迟导入，因此在函数内定义）"""
+
+    class ProgressCallback(tf.keras.callbacks.Callback):
+        def on_train_begin(self, logs=None):
+            self.epoch = 0
+            self.last_batch_time = 0
+            reporter.emit('train_begin', epochs=self.params.get('epochs'),
+                          steps=self.params.get('steps'))
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.epoch = epoch
+
+        def on_train_batch_end(self, batch, logs=None):
+            steps = self.params.get('steps')
+            now = time.time()
+            last = steps is not None and batch + 1 >= steps
+            if not last and now - self.last_batch_time < reporter.batch_interval:
+                return
+            self.last_batch_time = now
+            reporter.emit('batch', epoch=self.epoch, batch=batch, steps=steps,
+                          metrics=_clean_metrics(logs))
+
+        def on_epoch_end(self, epoch, logs=None):
+            reporter.emit('epoch', epoch=epoch, epochs=self.params.get('epochs'),
+                          metrics=_clean_metrics(logs))
+
+    return ProgressCallback()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按内容寻址的转换结果缓存
+
+对模型数据做规范化（去掉index、sessionId等易变字段，并把带时间戳的节点ID
+替换为稳定的序号）后计算哈希。相同哈希的日志目录已生成过时，直接把缓存中的
+事件文件硬链接到新的日志目录，跳过建模和训练。缓存按条目数、总大小和存活
+时间淘汰，最近使用时间取条目目录的mtime。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import logging
+
+from graph_compiler import node_aliases
+
+logger = logging.getLogger(__name__)
+
+# 缓存格式版本，转换逻辑发生不兼容变化时递增以使旧缓存失效
+CACHE_VERSION = 2
+
+# 不影响生成结果的易变字段
+VOLATILE_FIELDS = {'index', 'sessionId'}
+
+META_FILE = 'cache_meta.json'
+
+def _strip_volatile(value):
+    """递归去掉易变字段"""
+    if isinstance(value, dict):
+        return {k: _strip_volatile(v) for k, v in value.items() if k not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_strip_volatile(v) for v in value]
+    return value
+
+def canonicalize_model_data(model_data):
+    """返回用于计算哈希的规范化模型数据"""
+    aliases = node_aliases(model_data)
+    structure = [
+        dict(layer, id=aliases.get(layer['id'], layer['id'])) if 'id' in layer else layer
+        for layer in _strip_volatile(model_data.get('modelStructure', []) or [])
+    ]
+    edges = model_data.get('edges', []) or []
+    canonical_edges = sorted(
+        (aliases.get(e.get('source'), e.get('source')), aliases.get(e.get('target'), e.get('target')))
+        for e in edges
+    )
+    return {
+        'modelStructure': structure,
+        'edges': [list(e) for e in canonical_edges]
+    }
+
+def model_data_hash(model_data, salt=None):
+    """计算模型数据的内容哈希，salt用于区分影响结果的运行参数（如随机种子）"""
+    payload = {
+        'version': CACHE_VERSION,
+        'model': canonicalize_model_data(model_data),
+        'salt': salt
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+def _link_tree(src, dst, since=None):
+    """把src下的文件硬链接到dst，跨设备时退化为复制，返回链接的字节数
+
+    since不为None时只处理修改时间不早于since的文件。
+    """
+    total = 0
+    for root, dirs, files in os.walk(src):
+        rel = os.path.relpath(root, src)
+        target_root = dst if rel == '.' else os.path.join(dst, rel)
+        for name in files:
+            source = os.path.join(root, name)
+            stat = os.stat(source)
+            if since is not None and stat.st_mtime < since:
+                continue
+            os.makedirs(target_root, exist_ok=True)
+            target = os.path.join(target_root, name)
+            if os.path.lexists(target):
+                os.unlink(target)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+            total += stat.st_size
+    return total
+
+class ResultCache:
+    """以内容哈希为键的日志目录缓存"""
+
+    def __init__(self, cache_dir, max_entries=200, max_bytes=2 * 1024 ** 3, max_age=7 * 24 * 3600):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def restore(self, key, log_dir):
+        """命中时把缓存内容链接到log_dir并返回True"""
+        entry = self._entry_dir(key)
+        if not os.path.isfile(os.path.join(entry, META_FILE)):
+            return False
+
+        try:
+            with open(os.path.join(entry, META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if time.time() - meta.get('created', 0) > self.max_age:
+                logger.info(f"缓存条目已过期: {key}")
+                self._remove(entry)
+                return False
+
+            os.makedirs(log_dir, exist_ok=True)
+            data_dir = os.path.join(entry, 'data')
+            _link_tree(data_dir, log_dir)
+            # 更新mtime作为最近使用时间
+            os.utime(entry, None)
+            logger.info(f"命中结果缓存: {key} -> {log_dir}")
+            return True
+        except Exception as e:
+            logger.warning(f"读取结果缓存失败，将重新生成: {str(e)}")
+            return False
+
+    def store(self, key, log_dir, since=None):
+        """把本次生成的日志文件存入缓存"""
+        entry = self._entry_dir(key)
+        if os.path.exists(entry):
+            return
+
+        tmp_dir = os.path.join(self.cache_dir, f".tmp-{key}-{os.getpid()}")
+        try:
+            size = _link_tree(log_dir, os.path.join(tmp_dir, 'data'), since=since)
+            with open(os.path.join(tmp_dir, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'created': time.time(), 'size': size}, f)
+            try:
+                # 重命名是原子的，并发写入同一个键时只有一个能成功
+                os.rename(tmp_dir, entry)
+                logger.info(f"已写入结果缓存: {key} ({size} 字节)")
+            except OSError:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except Exception as e:
+            logger.warning(f"写入结果缓存失败: {str(e)}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def _remove(self, entry):
+        """先改名再删除，避免其他进程读到删除一半的条目"""
+        trash = f"{entry}.trash-{os.getpid()}"
+        try:
+            os.rename(entry, trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def evict(self):
+        """按存活时间、条目数和总大小淘汰缓存"""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(entry, META_FILE)
+            if name.startswith('.') or not os.path.isfile(meta_path):
+                continue
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                last_used = os.stat(entry).st_mtime
+            except (OSError, ValueError):
+                continue
+            if now - meta.get('created', 0) > self.max_age:
+                self._remove(entry)
+                continue
+            entries.append((last_used, meta.get('size', 0), entry))
+
+        # 最近最少使用的条目先淘汰
+        entries.sort(reverse=True)
+        total = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+            _, size, entry = entries.pop()
+            total -= size
+            self._remove(entry)
+            logger.info(f"淘汰缓存条目: {os.path.basename(entry)}")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+每个运行只用一个摘要写入器
+
+转换过程中的模型摘要、训练历史、额外指标、延迟、耗时和HParams都写入运行
+根目录下的同一个事件文件，按命名空间区分标签（如history/loss、
+metrics/custom_metric、graph/layers）。事件先在内存中排队，队列满或到达刷新
+间隔时才写盘；关闭时做一次最终的flush并fsync事件文件。Keras的TensorBoard
+回调仍然在train/train和train/validation中使用自己的写入器。
+
+    writer = RunWriter(tf, log_dir)
+    with writer.scope('history'):
+        tf.summary.scalar('loss', 0.5, step=0)    # 标签为history/loss
+    writer.close()
+"""
+
+import os
+from contextlib import contextmanager
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 内存中最多排队的事件数和自动刷新的间隔；一次转换通常在关闭时才写盘
+DEFAULT_MAX_QUEUE = 1000
+DEFAULT_FLUSH_SECS = 120.0
+EVENT_FILE_MARKER = 'tfevents'
+
+def _event_files(log_dir):
+    return {name for name in os.listdir(log_dir) if EVENT_FILE_MARKER in name}
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def writer_options(max_queue=None, flush_secs=None):
+    """整理写入器选项，未设置的项使用默认值"""
+    return {
+        'max_queue': DEFAULT_MAX_QUEUE if max_queue is None else max_queue,
+        'flush_secs': DEFAULT_FLUSH_SECS if flush_secs is None else flush_secs,
+    }
+
+class RunWriter:
+    """运行根目录下唯一的摘要写入器，按命名空间写入标签"""
+
+    def __init__(self, tf, log_dir, max_queue=DEFAULT_MAX_QUEUE, flush_secs=DEFAULT_FLUSH_SECS):
+        if max_queue < 1:
+            raise ValueError(f"max_queue必须为正整数: {max_queue}")
+        if flush_secs <= 0:
+            raise ValueError(f"flush_secs必须为正数: {flush_secs}")
+        self.tf = tf
+        self.log_dir = log_dir
+        os.makedirs(log_dir, exist_ok=True)
+        existing = _event_files(log_dir)
+        self.writer = tf.summary.create_file_writer(
+            log_dir, max_queue=max_queue, flush_millis=int(flush_secs * 1000))
+        # 写入器创建时即生成事件文件，记下它以便关闭时fsync
+        created = sorted(_event_files(log_dir) - existing)
+        self.path = os.path.join(log_dir, created[-1]) if created else None
+        self.namespaces = set()
+        self.closed = False
+
+    @contextmanager
+    def scope(self, namespace=None):
+        """把写入器设为默认写入器；namespace不为空时标签加上'<namespace>/'前缀"""
+        with self.writer.as_default():
+            if not namespace:
+                yield self
+                return
+            self.namespaces.add(namespace)
+            with self.tf.name_scope(namespace):
+                yield self
+
+    def flush(self):
+        """把排队的事件写入文件（结果缓存复制事件文件之前调用）"""
+        if not self.closed:
+            self.writer.flush()
+
+    def close(self):
+        """最终flush并fsync事件文件，之后不能再写入"""
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.flush()
+        self.writer.close()
+        if self.path and os.path.exists(self.path):
+            try:
+                _fsync(self.path)
+            except OSError as e:
+                logger.warning(f"事件文件fsync失败: {str(e)}")
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+不依赖TensorFlow的形状与参数推断
+
+按照graph_compiler构建Keras模型时的规则（channels_last、Dense前自动展平、
+LSTM/GRU前把图像按行展开为序列等）逐节点推断输出形状和参数量。所有
+形状都不含batch维。推断只用纯Python完成，格式错误的模型可以在导入
+TensorFlow之前就被拒绝，并给出每个节点的错误信息。
+"""
+
+import math
+import logging
+
+from graph_compiler import MERGE_LAYERS, NO_LAYERS_MESSAGE, GraphError, compile_graph, parse_tuple, target_shape
+
+logger = logging.getLogger(__name__)
+
+# 默认输入形状（MNIST）
+DEFAULT_INPUT_SHAPE = (28, 28, 1)
+# 默认类别数，与自动添加的Dense输出层一致
+NUM_CLASSES = 10
+
+# Keras可以按名称识别的激活函数
+KNOWN_ACTIVATIONS = {
+    'relu', 'relu6', 'leaky_relu', 'elu', 'selu', 'gelu', 'silu', 'swish', 'mish',
+    'sigmoid', 'hard_sigmoid', 'hard_silu', 'hard_swish', 'tanh', 'softmax', 'log_softmax',
+    'softplus', 'softsign', 'exponential', 'linear',
+}
+
+class ShapeError(ValueError):
+    """单个节点的形状或参数错误"""
+
+class ValidationError(ValueError):
+    """模型验证失败，errors为每个节点的错误列表"""
+
+    def __init__(self, errors):
+        summary = '; '.join(f"{e['type']}({e['id']}): {e['message']}" for e in errors)
+        super().__init__(f"模型验证失败: {summary}")
+        self.errors = errors
+
+def _pair(value, name):
+    """把int、长度为2的列表或"(h, w)"字符串规范为(h, w)"""
+    value = parse_tuple(value)
+    if isinstance(value, (list, tuple)):
+        if len(value) != 2:
+            raise ShapeError(f"{name}必须是整数或长度为2的数组，收到 {value}")
+        pair = tuple(value)
+    else:
+        pair = (value, value)
+    if not all(isinstance(v, int) and not isinstance(v, bool) and v > 0 for v in pair):
+        raise ShapeError(f"{name}必须是正整数，收到 {value}")
+    return pair
+
+def _positive_int(config, key, default):
+    value = config.get(key, default)
+    if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+        raise ShapeError(f"{key}必须是正整数，收到 {value}")
+    return value
+
+def _check_activation(config, key, default):
+    activation = config.get(key, default)
+    if activation is not None and activation not in KNOWN_ACTIVATIONS:
+        raise ShapeError(f"未知的激活函数: {activation}")
+
+def _require_rank(shape, rank, layer_name):
+    if len(shape) != rank:
+        raise ShapeError(f"{layer_name}需要{rank}维输入（不含batch），收到 {list(shape)}")
+
+def _spatial_output(size, window, stride, padding):
+    if padding == 'same':
+        return math.ceil(size / stride)
+    out = (size - window) // stride + 1
+    return out
+
+def _padding(config):
+    padding = config.get('padding', 'valid')
+    if padding not in ('valid', 'same'):
+        raise ShapeError(f"padding必须是valid或same，收到 {padding}")
+    return padding
+
+def _conv2d(shape, config):
+    _require_rank(shape, 3, 'Conv2D')
+    filters = _positive_int(config, 'filters', 32)
+    kh, kw = _pair(config.get('kernelSize', 3), 'kernelSize')
+    sh, sw = _pair(config.get('strides', 1), 'strides')
+    padding = _padding(config)
+    _check_activation(config, 'activation', 'relu')
+    h, w, c = shape
+    oh, ow = _spatial_output(h, kh, sh, padding), _spatial_output(w, kw, sw, padding)
+    if oh <= 0 or ow <= 0:
+        raise ShapeError(f"卷积核 {kh}x{kw} 大于输入 {h}x{w}")
+    return (oh, ow, filters), kh * kw * c * filters + filters, 0
+
+def _pooling(shape, config, layer_name):
+    _require_rank(shape, 3, layer_name)
+    ph, pw = _pair(config.get('poolSize', 2), 'poolSize')
+    strides = config.get('strides')
+    sh, sw = (ph, pw) if strides is None else _pair(strides, 'strides')
+    padding = _padding(config)
+    h, w, c = shape
+    oh, ow = _spatial_output(h, ph, sh, padding), _spatial_output(w, pw, sw, padding)
+    if oh <= 0 or ow <= 0:
+        raise ShapeError(f"池化窗口 {ph}x{pw} 大于输入 {h}x{w}")
+    return (oh, ow, c), 0, 0
+
+def _flatten(shape, config):
+    return (math.prod(shape),), 0, 0
+
+def _dense(shape, config):
+    units = _positive_int(config, 'units', 128)
+    _check_activation(config, 'activation', 'relu')
+    features = math.prod(shape)
+    return (units,), features * units + units, 0
+
+def _dropout(shape, config):
+    rate = config.get('rate', 0.5)
+    if not isinstance(rate, (int, float)) or not 0 <= rate < 1:
+        raise ShapeError(f"rate必须在[0, 1)范围内，收到 {rate}")
+    return tuple(shape), 0, 0
+
+def _batch_norm(shape, config):
+    channels = shape[-1]
+    # gamma/beta可训练，moving_mean/moving_variance不可训练
+    return tuple(shape), 2 * channels, 2 * channels
+
+def _activation(shape, config):
+    _check_activation(config, 'activation', 'relu')
+    return tuple(shape), 0, 0
+
+def _recurrent(shape, config, layer_name):
+    # 图像输入(H, W, C)按行展开为(H, W*C)
+    if len(shape) == 3:
+        shape = (shape[0], shape[1] * shape[2])
+    if len(shape) != 2:
+        raise ShapeError(f"{layer_name}需要序列输入(时间步, 特征)，收到 {list(shape)}")
+    units = _positive_int(config, 'units', 64)
+    _check_activation(config, 'activation', 'tanh')
+    _check_activation(config, 'recurrentActivation', 'sigmoid')
+    steps, features = shape
+    if layer_name == 'LSTM':
+        params = 4 * (features * units + units * units + units)
+    else:
+        # Keras默认reset_after=True，每个门有两组偏置
+        params = 3 * (features * units + units * units + 2 * units)
+    output = (steps, units) if config.get('returnSequences', False) else (units,)
+    return output, params, 0
+
+def _reshape(shape, config):
+    target = target_shape(config)
+    if not isinstance(target, (list, tuple)) or not target:
+        raise ShapeError(f"targetShape必须是非空数组，收到 {target}")
+    if any(not isinstance(d, int) or isinstance(d, bool) or (d <= 0 and d != -1) for d in target):
+        raise ShapeError(f"targetShape只能包含正整数或一个-1，收到 {target}")
+    total = math.prod(shape)
+    unknown = [i for i, d in enumerate(target) if d == -1]
+    if len(unknown) > 1:
+        raise ShapeError(f"targetShape最多只能有一个-1，收到 {target}")
+    known = math.prod(d for d in target if d != -1)
+    if unknown:
+        if total % known:
+            raise ShapeError(f"无法把 {total} 个元素变形为 {target}")
+        target = [total // known if d == -1 else d for d in target]
+    elif known != total:
+        raise ShapeError(f"targetShape {list(target)} 的元素数 {known} 与输入 {list(shape)} 的元素数 {total} 不一致")
+    return tuple(target), 0, 0
+
+LAYER_RULES = {
+    'conv2d': _conv2d,
+    'maxPooling2d': lambda shape, config: _pooling(shape, config, 'MaxPooling2D'),
+    'avgPooling2d': lambda shape, config: _pooling(shape, config, 'AveragePooling2D'),
+    'flatten': _flatten,
+    'dense': _dense,
+    'dropout': _dropout,
+    'batchNorm': _batch_norm,
+    'activation': _activation,
+    'lstm': lambda shape, config: _recurrent(shape, config, 'LSTM'),
+    'gru': lambda shape, config: _recurrent(shape, config, 'GRU'),
+    'reshape': _reshape,
+}
+
+def _concatenate(shapes, axis=-1):
+    rank = len(shapes[0])
+    if any(len(s) != rank for s in shapes):
+        raise ShapeError(f"Concatenate的输入维数不一致: {[list(s) for s in shapes]}")
+    axis = axis % rank
+    for s in shapes[1:]:
+        if any(a != b for i, (a, b) in enumerate(zip(shapes[0], s)) if i != axis):
+            raise ShapeError(f"Concatenate的输入形状不兼容: {[list(s) for s in shapes]}")
+    merged = list(shapes[0])
+    merged[axis] = sum(s[axis] for s in shapes)
+    return tuple(merged)
+
+def merge_shapes(layer_type, config, shapes):
+    """推断多个输入合并后的形状，规则与graph_compiler._merge一致"""
+    if layer_type in MERGE_LAYERS:
+        if layer_type == 'concatenate':
+            # Keras的axis包含batch维，正数需要减一
+            axis = config.get('axis', -1)
+            return _concatenate(shapes, axis - 1 if axis > 0 else axis)
+        if any(tuple(s) != tuple(shapes[0]) for s in shapes):
+            raise ShapeError(f"{MERGE_LAYERS[layer_type]}要求所有输入形状相同: {[list(s) for s in shapes]}")
+        return tuple(shapes[0])
+
+    # 普通层有多个输入时自动在最后一维拼接，维数不同时先展平
+    if any(len(s) != len(shapes[0]) for s in shapes):
+        shapes = [(math.prod(s),) if len(s) > 1 else s for s in shapes]
+    return _concatenate(shapes)
+
+def infer_layer(layer_type, config, shape):
+    """推断单层的(输出形状, 可训练参数量, 不可训练参数量)"""
+    if layer_type in MERGE_LAYERS:
+        return tuple(shape), 0, 0
+    rule = LAYER_RULES.get(layer_type)
+    if rule is None:
+        raise ShapeError(f"不支持的层类型: {layer_type}")
+    return rule(tuple(shape), config)
+
+def infer_graph(graph, input_shape=DEFAULT_INPUT_SHAPE, num_classes=NUM_CLASSES):
+    """对CompiledGraph逐节点推断形状，返回验证报告"""
+    input_shape = tuple(input_shape)
+    if not graph.outputs:
+        # build_keras_model同样拒绝没有层节点的模型
+        return {'valid': False, 'input_shape': list(input_shape), 'nodes': [],
+                'errors': [{'id': None, 'type': None, 'message': NO_LAYERS_MESSAGE}]}
+    shapes = {}
+    nodes = []
+    errors = []
+
+    for key in graph.order:
+        layer = graph.nodes[key]
+        layer_type = layer.get('type')
+        config = layer.get('config', {}) or {}
+        entry = {'id': key, 'type': layer_type, 'input_shape': None, 'output_shape': None,
+                 'params': 0, 'non_trainable_params': 0}
+        nodes.append(entry)
+
+        predecessors = graph.inputs.get(key, [])
+        if any(shapes.get(p) is None for p in predecessors):
+            # 上游节点已经出错，不再重复报告
+            shapes[key] = None
+            entry['skipped'] = True
+            continue
+
+        incoming = [shapes[p] for p in predecessors] or [input_shape]
+        try:
+            shape = incoming[0] if len(incoming) == 1 else merge_shapes(layer_type, config, incoming)
+            entry['input_shape'] = list(shape)
+            output, params, non_trainable = infer_layer(layer_type, config, shape)
+            entry.update(output_shape=list(output), params=params, non_trainable_params=non_trainable)
+            shapes[key] = output
+        except ShapeError as e:
+            shapes[key] = None
+            entry['error'] = str(e)
+            errors.append({'id': key, 'type': layer_type, 'message': str(e)})
+
+    report = {
+        'valid': not errors,
+        'input_shape': list(input_shape),
+        'nodes': nodes,
+        'errors': errors,
+    }
+    if errors:
+        return report
+
+    # 与build_keras_model一致：多个末端拼接，必要时添加Flatten + Dense(num_classes)输出层
+    outputs = [shapes[key] for key in graph.outputs] or [input_shape]
+    head = []
+    if len(outputs) > 1:
+        outputs = [(math.prod(s),) if len(s) > 1 else s for s in outputs]
+        final = _concatenate(outputs)
+    else:
+        final = outputs[0]
+    last_type = graph.nodes[graph.outputs[0]].get('type') if len(graph.outputs) == 1 else None
+    if len(final) > 1 or last_type != 'dense':
+        features = math.prod(final)
+        head.append({'id': '__output__', 'type': 'dense', 'input_shape': [features],
+                     'output_shape': [num_classes], 'params': features * num_classes + num_classes,
+                     'non_trainable_params': 0})
+        final = (num_classes,)
+
+    report['nodes'].extend(head)
+    report['output_shape'] = list(final)
+    report['total_params'] = sum(n['params'] + n['non_trainable_params'] for n in report['nodes'])
+    return report
+
+def _data_source_shape(model_data):
+    # data_pipeline依赖本模块，在函数内导入
+    from data_pipeline import describe_data_source
+    return describe_data_source(model_data).input_shape
+
+def analyze_model_data(model_data, input_shape=None, num_classes=NUM_CLASSES):
+    """编译模型图并推断形状，返回(CompiledGraph或None, 验证报告)
+
+    input_shape为None时按数据源节点确定，数据源无效（如CSV不存在）时作为验证错误报告。
+    """
+    if input_shape is None:
+        try:
+            input_shape = _data_source_shape(model_data)
+        except ValidationError as e:
+            return None, {'valid': False, 'nodes': [], 'input_shape': None, 'errors': e.errors}
+    structure = model_data.get('modelStructure', []) or []
+    if not structure:
+        return None, {'valid': False, 'nodes': [], 'input_shape': list(input_shape),
+                      'errors': [{'id': None, 'type': None, 'message': '模型结构为空'}]}
+    try:
+        graph = compile_graph(model_data)
+    except GraphError as e:
+        return None, {'valid': False, 'nodes': [], 'input_shape': list(input_shape),
+                      'errors': [{'id': key, 'type': None, 'message': str(e)} for key in (e.nodes or [None])]}
+    report = infer_graph(graph, input_shape, num_classes)
+    report['data_sources'] = sorted(graph.data_sources)
+    return graph, report
+
+def validate_model_data(model_data, input_shape=None, num_classes=NUM_CLASSES):
+    """编译模型图并推断形状，返回验证报告（不导入TensorFlow）"""
+    return analyze_model_data(model_data, input_shape, num_classes)[1]
@@ -10,8 +10,7 @@ else
   echo "端口5001没有运行中的进程"
 fi
 
-# 确保temp和logs目录存在
-mkdir -p temp
+# 确保日志目录存在
 mkdir -p logs
 mkdir -p tb_logs
 
@@ -6,6 +6,9 @@ const crypto = require('crypto');
 
 const router = express.Router();
 
+// 会话日志目录锁的文件名，与log_retention.py的SESSION_LOCK一致
+const SESSION_LOCK = '.session.lock';
+
 // 会话管理器 - 将用户请求与资源关联
 const SessionManager = {
   sessions: {},
@@ -19,21 +22,18 @@ const SessionManager = {
     if (!fs.existsSync(sessionDir)) {
       fs.mkdirSync(sessionDir, { recursive: true });
     }
-    
-    // 确保临时文件目录存在
-    const tempDir = path.join(__dirname, 'temp');
-    if (!fs.existsSync(tempDir)) {
-      fs.mkdirSync(tempDir, { recursive: true });
-    }
+    // 会话存活期间锁定日志目录，日志回收不会删除或压缩仍在使用的目录
+    fs.writeFileSync(path.join(sessionDir, SESSION_LOCK), JSON.stringify({ pid: process.pid, created: Date.now() }));
     
     this.sessions[sessionId] = {
       id: sessionId,
       created: Date.now(),
       logDir: sessionDir,
-      dataFile: path.join(__dirname, 'temp', `model_${sessionId}.json`),
       tensorboardProcess: null,
       port: 6006, // 默认端口，后续可动态分配
-      lastAccessed: Date.now()
+      lastAccessed: Date.now(),
+      progressEvents: [], // 最近一次转换的进度事件，供后连接的订阅者补发
+      progressClients: new Set() // SSE订阅连接
     };
     
     console.log(`创建新会话: ${sessionId}`);
@@ -77,24 +77,22 @@ const SessionManager = {
       }
     }
     
-    // 清理临时文件
+    // 日志目录保留给历史记录，由日志回收（runLogRetention）统一清理
     try {
-      if (fs.existsSync(session.dataFile)) {
-        fs.unlinkSync(session.dataFile);
-        console.log(`已删除会话 ${sessionId} 的数据文件`);
-      }
-      
-      // 递归删除日志目录（可选，取决于是否需要保留历史记录）
-      // 如果希望保留历史记录，可以注释掉这段代码
-      /*
-      if (fs.existsSync(session.logDir)) {
-        fs.rmdirSync(session.logDir, { recursive: true });
-        console.log(`已删除会话 ${sessionId} 的日志目录`);
-      }
-      */
+      fs.rmSync(path.join(session.logDir, SESSION_LOCK), { force: true });
     } catch (err) {
-      console.error(`清理会话文件失败: ${err.message}`);
+      console.error(`释放会话 ${sessionId} 的日志目录锁失败: ${err.message}`);
     }
+    // 增量构建的状态（上一次训练后的模型）只对当前会话有意义，随会话删除
+    try {
+      fs.rmSync(path.join(__dirname, 'tb_sessions', sessionId), { recursive: true, force: true });
+    } catch (err) {
+      console.error(`删除会话 ${sessionId} 的构建状态失败: ${err.message}`);
+    }
+    
+    // 关闭进度订阅连接
+    session.progressClients.forEach(client => client.end());
+    session.progressClients.clear();
     
     // 从会话列表中移除
     delete this.sessions[sessionId];
@@ -102,6 +100,175 @@ const SessionManager = {
   }
 };
 
+// 进度广播 - 把转换服务的进度事件保存到会话并推送给SSE订阅者
+const MAX_PROGRESS_EVENTS = 200;
+const ProgressHub = {
+  // 开始新的转换，清空上一次的事件
+  reset(session) {
+    session.progressEvents = [];
+  },
+  
+  publish(session, event) {
+    session.progressEvents.push(event);
+    if (session.progressEvents.length > MAX_PROGRESS_EVENTS) {
+      // 只保留阶段事件和最近的批次/轮次事件，避免内存无限增长
+      session.progressEvents = session.progressEvents.filter(
+        (e, i, all) => e.event === 'phase' || i >= all.length - MAX_PROGRESS_EVENTS / 2
+      );
+    }
+    const payload = `data: ${JSON.stringify(event)}\n\n`;
+    session.progressClients.forEach(client => client.write(payload));
+  },
+  
+  subscribe(session, res) {
+    res.writeHead(200, {
+      'Content-Type': 'text/event-stream',
+      'Cache-Control': 'no-cache',
+      Connection: 'keep-alive'
+    });
+    session.progressEvents.forEach(event => res.write(`data: ${JSON.stringify(event)}\n\n`));
+    session.progressClients.add(res);
+    res.on('close', () => session.progressClients.delete(res));
+  }
+};
+
+// 转换服务 - 维护常驻的Python转换进程（内部为预热的工作进程池）
+// 任务和结果通过stdin/stdout以JSON-lines传递
+const ConverterService = {
+  process: null,
+  pending: new Map(),
+  buffer: '',
+  nextJobId: 1,
+  workers: parseInt(process.env.CONVERTER_WORKERS, 10) || 2,
+  
+  // 启动常驻转换进程（如果尚未运行）
+  start(pythonCmd, scriptPath) {
+    if (this.process && !this.process.killed && this.process.exitCode === null) {
+      return this.process;
+    }
+    
+    console.log(`启动常驻转换服务，工作进程数: ${this.workers}`);
+    this.buffer = '';
+    
+    const serviceArgs = [scriptPath, '--serve', '--workers', String(this.workers)];
+    // 服务选项。开销预算：超出预算的模型在训练前被拒绝或降级
+    const serviceOptions = {
+      '--max-params': process.env.CONVERTER_MAX_PARAMS,
+      '--max-flops': process.env.CONVERTER_MAX_FLOPS,
+      '--max-memory-mb': process.env.CONVERTER_MAX_MEMORY_MB,
+      '--budget-policy': process.env.CONVERTER_BUDGET_POLICY,
+      // CPU调优：线程数默认auto（按cgroup配额和工作进程数平分CPU），oneDNN和XLA默认跟随TensorFlow
+      '--intra-op-threads': process.env.CONVERTER_INTRA_OP_THREADS,
+      '--inter-op-threads': process.env.CONVERTER_INTER_OP_THREADS,
+      '--onednn': process.env.CONVERTER_ONEDNN,
+      '--jit-compile': process.env.CONVERTER_JIT_COMPILE
+    };
+    Object.entries(serviceOptions).forEach(([flag, value]) => {
+      if (value) {
+        serviceArgs.push(flag, value);
+      }
+    });
+    
+    this.process = spawn(pythonCmd, serviceArgs, {
+      env: {
+        ...process.env,
+        PYTHONUNBUFFERED: '1' // 确保Python输出不被缓冲
+      }
+    });
+    
+    this.process.stdout.on('data', (data) => {
+      this.buffer += data.toString();
+      let newlineIndex;
+      while ((newlineIndex = this.buffer.indexOf('\n')) >= 0) {
+        const line = this.buffer.slice(0, newlineIndex).trim();
+        this.buffer = this.buffer.slice(newlineIndex + 1);
+        if (line) {
+          this.handleMessage(line);
+        }
+      }
+    });
+    
+    // Python日志输出到stderr
+    this.process.stderr.on('data', (data) => {
+      console.log(`[converter] ${data.toString().trimEnd()}`);
+    });
+    
+    const proc = this.process;
+    proc.on('exit', (code) => {
+      console.error(`常驻转换服务已退出，代码: ${code}`);
+      if (this.process === proc) {
+        this.process = null;
+      }
+      // 未完成的任务全部失败，下一个请求会重新启动服务
+      this.pending.forEach(({ reject }) => {
+        reject(new Error(`转换服务异常退出，代码: ${code}`));
+      });
+      this.pending.clear();
+    });
+    
+    proc.on('error', (err) => {
+      console.error(`转换服务进程错误: ${err.message}`);
+      if (this.process === proc) {
+        this.process = null;
+      }
+      this.pending.forEach(({ reject }) => reject(err));
+      this.pending.clear();
+    });
+    
+    return this.process;
+  },
+  
+  // 处理一行服务输出
+  handleMessage(line) {
+    let message;
+    try {
+      message = JSON.parse(line);
+    } catch (err) {
+      console.log(`[converter] ${line}`);
+      return;
+    }
+    
+    const job = message.id !== undefined ? this.pending.get(message.id) : null;
+    
+    // 带任务id的事件是该任务的进度，其他事件是服务本身的状态
+    if (message.event) {
+      if (job && job.onProgress) {
+        job.onProgress(message);
+      } else {
+        console.log(`转换服务事件: ${line}`);
+      }
+      return;
+    }
+    
+    if (!job) {
+      console.warn(`收到未知任务的结果: ${line}`);
+      return;
+    }
+    this.pending.delete(message.id);
+    job.resolve(message);
+  },
+  
+  // 提交转换任务，返回任务结果；提供onProgress时实时接收该任务的进度事件
+  submit(pythonCmd, scriptPath, job, onProgress) {
+    const proc = this.start(pythonCmd, scriptPath);
+    const id = String(this.nextJobId++);
+    
+    return new Promise((resolve, reject) => {
+      this.pending.set(id, { resolve, reject, onProgress });
+      proc.stdin.write(JSON.stringify({ id, ...job, progress: Boolean(onProgress) }) + '\n');
+    });
+  },
+  
+  // 停止转换服务
+  stop() {
+    if (this.process) {
+      // 关闭stdin后服务会处理完剩余任务并退出
+      this.process.stdin.end();
+      this.process = null;
+    }
+  }
+};
+
 // 进程管理器 - 处理Python和TensorBoard进程
 const ProcessManager = {
   // 运行Python转换脚本
@@ -109,90 +276,103 @@ const ProcessManager = {
     // 准备虚拟环境
     await ensurePythonEnvironment();
     
-    // 将数据写入会话特定的临时文件
-    fs.writeFileSync(session.dataFile, JSON.stringify(modelData, null, 2), 'utf8');
-    
     // 构建Python解释器路径
     const pythonCmd = process.platform === 'win32' 
       ? path.join(venvBin, 'python.exe') 
       : path.join(venvBin, 'python');
     
-    // 确保标准的logs目录存在
-    const standardLogsDir = path.join(__dirname, 'logs');
-    if (!fs.existsSync(standardLogsDir)) {
-      fs.mkdirSync(standardLogsDir, { recursive: true });
-    }
-    
     // 确保会话日志目录存在并具有正确的权限
     fs.chmodSync(session.logDir, 0o755);
     
     // 运行Python脚本
     const scriptPath = path.join(__dirname, 'convert_tensorboard.py');
     
-    console.log(`为会话 ${session.id} 运行Python脚本...`);
-    console.log(`命令: ${pythonCmd} ${scriptPath} ${session.dataFile} --output-dir ${session.logDir}`);
+    console.log(`为会话 ${session.id} 提交转换任务: ${session.logDir}`);
+    
+    // 将任务提交给常驻转换服务，避免每个请求都重新启动Python并导入TensorFlow
+    // 进度事件随到随推给订阅者，不在内存中累积训练输出
+    ProgressHub.reset(session);
+    // 日志配置档：graph-only（只看模型结构）、fast（只记录标量）或full（默认）
+    const logProfile = modelData.logProfile || process.env.CONVERTER_LOG_PROFILE;
+    const result = await ConverterService.submit(pythonCmd, scriptPath, {
+      // 模型数据随任务行以紧凑JSON直接写入服务的stdin，不经过临时文件
+      data: modelData,
+      output_dir: session.logDir,
+      log_profile: logProfile,
+      // 按请求开启/关闭XLA编译（true/false），未指定时使用服务的默认设置
+      jit_compile: modelData.jitCompile,
+      // 按请求在训练前测量推理延迟（true或{batch_sizes, iterations, warmup}）
+      latency: modelData.latencyBenchmark,
+      // 时间预算（秒）和最大训练步数：到达后停止训练并写出已有日志，结果带truncated
+      time_budget: modelData.timeBudget || Number(process.env.CONVERTER_TIME_BUDGET) || undefined,
+      max_steps: modelData.maxSteps,
+      // 数据并行训练：true、工作进程数或{workers, threads_per_worker}，在本机启动新的工作进程
+      distribute: modelData.distribute,
+      // 增量构建：同一会话只改了画布的一部分时，复用未改动的层和上一次训练后的权重
+      session: session.id,
+      // 调试时保存收到的模型数据到会话日志目录的debug_data.json
+      debug_dump: Boolean(process.env.CONVERTER_DEBUG_DUMP)
+    }, (event) => ProgressHub.publish(session, event));
+    
+    ProgressHub.publish(session, { event: 'result', ...result });
+    
+    if (result.status !== 'ok') {
+      const error = new Error(`Python转换失败: ${result.error || '未知错误'}`);
+      // 模型验证失败时带上每个节点的错误，超出开销预算时带上超出项
+      error.details = result.errors || result.budget_violations;
+      throw error;
+    }
     
-    return new Promise((resolve, reject) => {
-      const pythonProcess = spawn(pythonCmd, [
-        scriptPath, 
-        session.dataFile,
-        '--output-dir', session.logDir
-      ], {
-        env: {
-          ...process.env,
-          PYTHONUNBUFFERED: '1' // 确保Python输出不被缓冲
-        }
-      });
-      
-      let pythonOutput = '';
-      let pythonError = '';
+    console.log(`[${session.id}] Python转换成功，耗时 ${result.elapsed}s`);
+    if (result.truncated) {
+      console.warn(`[${session.id}] 训练在预算处被截断，完成 ${result.steps} 步`);
+    }
+    
+    // 验证日志目录中是否有文件
+    try {
+      const files = fs.readdirSync(session.logDir);
+      console.log(`[${session.id}] 日志目录文件数量: ${files.length}`);
       
-      pythonProcess.stdout.on('data', (data) => {
-        const output = data.toString();
-        pythonOutput += output;
-        console.log(`[${session.id}] Python输出: ${output}`);
-      });
+      if (files.length === 0) {
+        console.warn(`[${session.id}] 警告: 日志目录为空`);
+      } else {
+        console.log(`[${session.id}] 日志目录文件: ${files.join(', ')}`);
+      }
       
-      pythonProcess.stderr.on('data', (data) => {
-        const errorOutput = data.toString();
-        pythonError += errorOutput;
-        console.error(`[${session.id}] Python错误: ${errorOutput}`);
-      });
+      // 检查ready标记文件（每个会话的标记写在自己的日志目录中）
+      const tbReadyPath = path.join(session.logDir, 'tb_ready.txt');
+      if (fs.existsSync(tbReadyPath)) {
+        const readyContent = fs.readFileSync(tbReadyPath, 'utf8');
+        console.log(`[${session.id}] TensorBoard就绪标记内容: ${readyContent}`);
+      } else {
+        console.warn(`[${session.id}] 警告: 未找到TensorBoard就绪标记文件`);
+      }
       
-      pythonProcess.on('close', (code) => {
-        if (code === 0) {
-          console.log(`[${session.id}] Python脚本执行成功`);
-          
-          // 验证日志目录中是否有文件
-          try {
-            const files = fs.readdirSync(session.logDir);
-            console.log(`[${session.id}] 日志目录文件数量: ${files.length}`);
-            
-            if (files.length === 0) {
-              console.warn(`[${session.id}] 警告: 日志目录为空`);
-            } else {
-              console.log(`[${session.id}] 日志目录文件: ${files.join(', ')}`);
-            }
-            
-            // 检查ready标记文件
-            const tbReadyPath = path.join(path.dirname(session.logDir), 'tb_ready.txt');
-            if (fs.existsSync(tbReadyPath)) {
-              const readyContent = fs.readFileSync(tbReadyPath, 'utf8');
-              console.log(`[${session.id}] TensorBoard就绪标记内容: ${readyContent}`);
-            } else {
-              console.warn(`[${session.id}] 警告: 未找到TensorBoard就绪标记文件`);
-            }
-            
-          } catch (err) {
-            console.error(`[${session.id}] 验证日志目录失败: ${err.message}`);
-          }
-          
-          resolve({ success: true, output: pythonOutput });
-        } else {
-          reject(new Error(`Python脚本异常退出，代码: ${code}, 输出: ${pythonOutput || '无'}, 错误: ${pythonError || '无'}`));
-        }
-      });
+    } catch (err) {
+      console.error(`[${session.id}] 验证日志目录失败: ${err.message}`);
+    }
+    
+    return { success: true, logDir: result.log_dir, truncated: Boolean(result.truncated) };
+  },
+  
+  // 直接读取会话日志目录中的事件文件，返回指标JSON（不需要TensorBoard进程）
+  // cursor为上一次返回的cursor，传回后只返回之后写入的事件
+  async exportMetrics(session, cursor, kinds) {
+    await ensurePythonEnvironment();
+    
+    const pythonCmd = process.platform === 'win32' 
+      ? path.join(venvBin, 'python.exe') 
+      : path.join(venvBin, 'python');
+    const scriptPath = path.join(__dirname, 'convert_tensorboard.py');
+    
+    const result = await ConverterService.submit(pythonCmd, scriptPath, {
+      export: { log_dir: session.logDir, cursor: cursor || null, kinds: kinds || null }
     });
+    
+    if (result.status !== 'ok') {
+      throw new Error(`导出指标失败: ${result.error || '未知错误'}`);
+    }
+    return result;
   },
   
   // 启动TensorBoard
@@ -213,21 +393,10 @@ const ProcessManager = {
       logDirFiles = fs.readdirSync(session.logDir);
     }
     
-    // 检查标准日志目录
-    const standardLogsDir = path.join(__dirname, 'logs');
-    const standardLogsExist = fs.existsSync(standardLogsDir);
-    let standardLogsFiles = [];
-    if (standardLogsExist) {
-      standardLogsFiles = fs.readdirSync(standardLogsDir);
-    }
-    
     console.log(`为会话 ${session.id} 启动TensorBoard...`);
     console.log(`会话日志目录: ${session.logDir}`);
     console.log(`会话日志目录存在: ${logDirExists}`);
     console.log(`会话日志目录文件: ${logDirFiles.join(', ')}`);
-    console.log(`标准日志目录: ${standardLogsDir}`);
-    console.log(`标准日志目录存在: ${standardLogsExist}`);
-    console.log(`标准日志目录文件: ${standardLogsFiles.join(', ')}`);
     
     // 获取日志目录的绝对路径
     const absoluteLogDir = path.resolve(session.logDir);
@@ -245,32 +414,6 @@ const ProcessManager = {
       fs.mkdirSync(path.join(absoluteLogDir, 'train'), { recursive: true });
     }
     
-    // 确保在logs目录中创建一个符号链接或复制文件
-    try {
-      const logsDirLink = path.join(__dirname, 'logs', session.id);
-      if (!fs.existsSync(logsDirLink)) {
-        if (process.platform === 'win32') {
-          // Windows上创建目录连接
-          const mkdirpSync = (p) => {
-            if (!fs.existsSync(p)) {
-              mkdirpSync(path.dirname(p));
-              fs.mkdirSync(p);
-            }
-          };
-          
-          mkdirpSync(path.dirname(logsDirLink));
-          // 在Windows上复制目录内容
-          fs.symlinkSync(absoluteLogDir, logsDirLink, 'junction');
-        } else {
-          // Unix/Linux/Mac上创建符号链接
-          fs.symlinkSync(absoluteLogDir, logsDirLink);
-        }
-        console.log(`为会话 ${session.id} 创建日志目录链接: ${logsDirLink}`);
-      }
-    } catch (linkErr) {
-      console.error(`创建日志目录链接失败: ${linkErr.message}`);
-    }
-    
     // 打印完整的TensorBoard命令
     console.log(`启动TensorBoard命令: ${tensorboardCmd} ${tensorboardArgs.join(' ')}`);
     
@@ -436,6 +579,53 @@ setInterval(() => {
   SessionManager.cleanupSessions();
 }, 15 * 60 * 1000); // 每15分钟清理一次
 
+// 日志回收 - 会话销毁时保留日志目录，由gc子命令按存活时间、数量和总大小淘汰并压缩旧的运行
+const runLogRetention = () => {
+  const pythonCmd = process.platform === 'win32' 
+    ? path.join(venvBin, 'python.exe') 
+    : path.join(venvBin, 'python');
+  if (!fs.existsSync(pythonCmd)) {
+    return;
+  }
+  
+  const gcArgs = [path.join(__dirname, 'convert_tensorboard.py'), 'gc', '--root', path.join(__dirname, 'tb_logs')];
+  const retentionOptions = {
+    '--max-age-days': process.env.TB_LOGS_MAX_AGE_DAYS,
+    '--max-runs': process.env.TB_LOGS_MAX_RUNS,
+    '--max-mb': process.env.TB_LOGS_MAX_MB,
+    '--compact-after-hours': process.env.TB_LOGS_COMPACT_AFTER_HOURS
+  };
+  Object.entries(retentionOptions).forEach(([flag, value]) => {
+    if (value) {
+      gcArgs.push(flag, value);
+    }
+  });
+  
+  const gcProcess = spawn(pythonCmd, gcArgs);
+  let summary = '';
+  gcProcess.stdout.on('data', (data) => {
+    summary += data.toString();
+  });
+  gcProcess.on('error', (err) => {
+    console.error(`日志回收启动失败: ${err.message}`);
+  });
+  gcProcess.on('exit', (code) => {
+    if (code !== 0) {
+      console.error(`日志回收失败，退出码: ${code}`);
+      return;
+    }
+    try {
+      const result = JSON.parse(summary);
+      console.log(`日志回收完成: 删除 ${result.removed.length} 个运行，压缩 ${Object.keys(result.compacted).length} 个运行，` +
+                  `剩余 ${result.runs} 个运行 (${(result.bytes / 1024 / 1024).toFixed(1)}MB)`);
+    } catch (err) {
+      console.error(`解析日志回收结果失败: ${err.message}`);
+    }
+  });
+};
+
+setInterval(runLogRetention, 60 * 60 * 1000); // 每小时回收一次
+
 // 健康检查路由
 router.get('/health', (req, res) => {
   const scriptPath = path.join(__dirname, 'convert_tensorboard.py');
@@ -467,6 +657,14 @@ router.get('/status', (req, res) => {
   });
 });
 
+// 订阅转换进度（Server-Sent Events），每条消息是一个进度事件
+// 前端可先通过/status获得sessionId，再订阅并调用/prepare
+router.get('/progress', (req, res) => {
+  const { sessionId } = req.query;
+  const session = SessionManager.getOrCreateSession(sessionId);
+  ProgressHub.subscribe(session, res);
+});
+
 // 准备TensorBoard数据并启动服务
 router.post('/prepare', async (req, res) => {
   try {
@@ -491,7 +689,18 @@ router.post('/prepare', async (req, res) => {
     }
     
     // 运行Python脚本生成TensorBoard数据
-    await ProcessManager.runPythonScript(session, modelData);
+    const conversion = await ProcessManager.runPythonScript(session, modelData);
+    
+    // 无界面模式：不启动TensorBoard进程，前端通过/metrics读取指标
+    if (modelData.headless || process.env.TENSORBOARD_HEADLESS === '1') {
+      return res.json({
+        success: true,
+        message: '日志已生成，可通过/metrics读取指标',
+        headless: true,
+        truncated: conversion.truncated,
+        sessionId: session.id
+      });
+    }
     
     // 启动TensorBoard
     await ProcessManager.startTensorBoard(session);
@@ -501,6 +710,7 @@ router.post('/prepare', async (req, res) => {
       success: true, 
       message: 'TensorBoard已准备就绪', 
       url: `http://localhost:${session.port}`,
+      truncated: conversion.truncated,
       sessionId: session.id
     });
     
@@ -508,7 +718,40 @@ router.post('/prepare', async (req, res) => {
     console.error('TensorBoard准备错误:', error);
     res.status(500).json({ 
       success: false, 
-      error: error.message || '未知错误' 
+      error: error.message || '未知错误',
+      details: error.details
+    });
+  }
+});
+
+// 以JSON读取会话的标量、文本、直方图和计算图（不需要TensorBoard服务）
+// 请求体: { sessionId, cursor?, kinds? }，把返回的cursor传回即可增量轮询
+router.post('/metrics', async (req, res) => {
+  try {
+    const { sessionId, cursor, kinds } = req.body;
+    
+    if (!sessionId || !SessionManager.sessions[sessionId]) {
+      return res.status(404).json({
+        success: false,
+        error: '会话不存在'
+      });
+    }
+    
+    const session = SessionManager.sessions[sessionId];
+    const result = await ProcessManager.exportMetrics(session, cursor, kinds);
+    
+    res.json({
+      success: true,
+      sessionId: session.id,
+      runs: result.runs,
+      cursor: result.cursor,
+      eventsRead: result.events_read
+    });
+  } catch (error) {
+    console.error('导出指标错误:', error);
+    res.status(500).json({
+      success: false,
+      error: error.message || '未知错误'
     });
   }
 });
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""shape_inference的验证报告（不需要TensorFlow）"""
+
+import pytest
+
+from data_pipeline import DATA_ROOT_ENV
+from graph_compiler import NO_LAYERS_MESSAGE
+from shape_inference import validate_model_data
+
+@pytest.fixture(autouse=True)
+def data_root(tmp_path, monkeypatch):
+    monkeypatch.setenv(DATA_ROOT_ENV, str(tmp_path))
+    return tmp_path
+
+def _model(source_config):
+    return {
+        'modelStructure': [
+            {'type': 'useData', 'config': source_config},
+            {'type': 'dense', 'config': {'units': 4}},
+        ],
+        'edges': [],
+    }
+
+def test_missing_csv_is_reported_as_validation_error(tmp_path):
+    report = validate_model_data(_model({'dataPath': str(tmp_path / 'missing.csv')}))
+    assert report['valid'] is False
+    assert report['errors'][0]['type'] == 'useData'
+    assert 'missing.csv' in report['errors'][0]['message']
+
+def test_csv_input_shape_comes_from_header(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_text('a,b,c,label\n1,2,3,0\n4,5,6,1\n', encoding='utf-8')
+    report = validate_model_data(_model({'dataPath': str(path)}))
+    assert report['valid'] is True
+    assert report['input_shape'] == [3]
+
+def test_model_without_layer_nodes_is_rejected():
+    report = validate_model_data({'modelStructure': [{'type': 'mnist', 'config': {}},
+                                                     {'type': 'trainButton', 'config': {}}]})
+    assert report['valid'] is False
+    assert report['errors'][0]['message'] == NO_LAYERS_MESSAGE
+
+def test_data_path_outside_data_root_is_rejected(tmp_path):
+    outside = tmp_path.parent / 'outside.csv'
+    report = validate_model_data(_model({'dataPath': str(outside)}))
+    assert report['valid'] is False
+    assert '数据根目录' in report['errors'][0]['message']
+    report = validate_model_data(_model({'dataPath': '../outside.csv'}))
+    assert report['valid'] is False
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""training_budget的步数规划和截止回调"""
+
+import numpy as np
+import pytest
+
+from training_budget import TrainingBudget, deadline_callback
+
+@pytest.mark.parametrize('max_steps', [5, 7])
+def test_plan_covers_max_steps(max_steps):
+    budget = TrainingBudget(max_steps=max_steps)
+    plan = budget.plan_training(None, num_samples=2000, validation_split=0.2)
+    assert plan['epochs'] * plan['steps_per_epoch'] >= max_steps
+    assert (plan['epochs'] - 1) * plan['steps_per_epoch'] < max_steps
+    assert budget.truncated and budget.reason == 'max_steps'
+
+@pytest.mark.parametrize('max_steps', [5, 7, 9])
+def test_trains_exactly_max_steps(max_steps):
+    tf = pytest.importorskip('tensorflow')
+    budget = TrainingBudget(max_steps=max_steps)
+    plan = budget.plan_training(None, num_samples=2000, validation_split=0.2)
+    model = tf.keras.Sequential([tf.keras.Input((4,)), tf.keras.layers.Dense(2)])
+    model.compile(optimizer='sgd', loss='mse')
+    x = np.zeros((2000, 4), dtype=np.float32)
+    y = np.zeros((2000, 2), dtype=np.float32)
+    data = tf.data.Dataset.from_tensor_slices((x, y)).batch(plan['batch_size']).take(plan['steps_per_epoch'])
+    model.fit(data, epochs=plan['epochs'], callbacks=[deadline_callback(tf, budget)], verbose=0)
+    assert budget.steps == max_steps
+
+def test_unconstrained_max_steps_is_not_truncated():
+    tf = pytest.importorskip('tensorflow')
+    budget = TrainingBudget(max_steps=4)
+    # 40个训练样本、批大小32：每轮2步，两轮正好4步，max_steps不限制训练
+    plan = budget.plan_training(None, num_samples=50, validation_split=0.2)
+    assert plan['epochs'] * plan['steps_per_epoch'] == 4
+    model = tf.keras.Sequential([tf.keras.Input((4,)), tf.keras.layers.Dense(2)])
+    model.compile(optimizer='sgd', loss='mse')
+    data = tf.data.Dataset.from_tensor_slices((np.zeros((40, 4), np.float32), np.zeros((40, 2), np.float32)))
+    model.fit(data.batch(plan['batch_size']), epochs=plan['epochs'], callbacks=[deadline_callback(tf, budget)],
+              verbose=0)
+    assert budget.steps == 4
+    assert not budget.truncated
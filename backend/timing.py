@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+转换各阶段的耗时记录
+
+每个阶段记录墙钟时间和进程CPU时间（包含TensorFlow所有线程，因此可能大于
+墙钟时间）。嵌套阶段的名称用'/'连接，例如generate_logs/fit。结果连同进程
+的峰值内存写入日志目录的timings.json，并以timing/wall/<阶段>、
+timing/cpu/<阶段>标量写入运行的事件文件。
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+from atomic_io import write_json_atomic
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块
+    resource = None
+
+TIMINGS_FILE = 'timings.json'
+
+def peak_rss_bytes():
+    """当前进程的峰值常驻内存（字节），不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class PhaseTimer:
+    """按阶段累计墙钟时间和CPU时间"""
+
+    def __init__(self):
+        self.phases = []
+        self._stack = []
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    @contextmanager
+    def phase(self, name):
+        path = '/'.join(self._stack + [name])
+        self._stack.append(name)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            self.phases.append({
+                'phase': path,
+                'wall': round(time.perf_counter() - wall, 4),
+                'cpu': round(time.process_time() - cpu, 4),
+            })
+
+    def summary(self):
+        return {
+            'total_wall': round(time.perf_counter() - self._wall, 4),
+            'total_cpu': round(time.process_time() - self._cpu, 4),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'phases': list(self.phases),
+        }
+
+    def write_json(self, log_dir):
+        """写入timings.json；先写临时文件再替换，不会改动从缓存硬链接来的旧文件"""
+        return write_json_atomic(os.path.join(log_dir, TIMINGS_FILE), self.summary())
+
+    def write_scalars(self, tf, writer):
+        """把各阶段耗时以timing/标量写入运行的RunWriter"""
+        summary = self.summary()
+        with writer.scope():
+            for entry in summary['phases']:
+                tf.summary.scalar(f"timing/wall/{entry['phase']}", entry['wall'], step=0)
+                tf.summary.scalar(f"timing/cpu/{entry['phase']}", entry['cpu'], step=0)
+            tf.summary.scalar("timing/wall/total", summary['total_wall'], step=0)
+            tf.summary.scalar("timing/cpu/total", summary['total_cpu'], step=0)
+
+def parse_profile_batch(value):
+    """解析--profile参数：'5'表示只分析第5个批次，'2,5'表示第2到第5个批次"""
+    parts = [p.strip() for p in str(value).split(',')]
+    if len(parts) == 1:
+        parts = parts * 2
+    if len(parts) != 2 or not all(p.isdigit() for p in parts):
+        raise ValueError(f"无效的批次范围: {value}，格式应为N或START,END")
+    start, end = int(parts[0]), int(parts[1])
+    if start < 1 or end < start:
+        raise ValueError(f"无效的批次范围: {value}，批次从1开始且END不能小于START")
+    return start, end
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+训练的时间和步数预算：在截止时间前停止训练，仍然写出已有的日志
+
+TrainingBudget在任务开始时创建，time_budget从这一刻起计时，覆盖验证、构建、
+延迟测量、训练和写日志的全部过程。训练之前按开销估算规划批大小、每轮步数和
+验证步数，使估计的训练时间落在剩余预算内；训练中由Keras回调在每个批次后检查
+截止时间和max_steps，按上一个批次的耗时预计下一个批次会超时就停止训练，
+已完成的轮次和历史照常写入。单个批次（尤其是包含追踪的第一个批次）不能被
+中断，因此剩余时间不够编译和追踪（COMPILE_SECONDS）时直接跳过训练。
+
+训练比不设预算时更短（规划时缩减了步数，或被回调提前停止）的运行标记为
+truncated，原因和实际步数写入日志目录的training.json。吞吐量只是粗略估计，
+截止时间只在批次之间检查，写日志的时间由预留的比例兜底，不是严格保证。
+"""
+
+import math
+import time
+
+DEFAULT_EPOCHS = 2
+DEFAULT_BATCH_SIZE = 32
+MIN_BATCH_SIZE = 8
+TRAINING_FILE = 'training.json'
+# 规划时假设的每个线程的训练吞吐（FLOPs/秒）和每步的固定开销
+FLOPS_PER_SECOND_PER_THREAD = 4e9
+STEP_OVERHEAD_SECONDS = 0.005
+# 编译模型、追踪训练和验证函数的预计耗时
+COMPILE_SECONDS = 2.0
+# 批大小的训练内存估计上限，超过时减半
+MAX_TRAINING_MEMORY_BYTES = 1024 * 1024 * 1024
+# 每轮至少训练的步数；估计的步数不够时先减小批大小
+MIN_STEPS_PER_EPOCH = 4
+# 训练之后写摘要和计算图预留的时间：预算的一定比例，且不少于若干秒
+WRITE_RESERVE_FRACTION = 0.15
+MIN_WRITE_RESERVE_SECONDS = 1.0
+
+class TrainingBudget:
+    """单个任务的时间和步数预算，同时记录实际训练的步数和是否被截断"""
+
+    def __init__(self, time_budget=None, max_steps=None, started=None, fit_seconds=None):
+        """fit_seconds为固定的训练可用秒数（数据并行的各工作进程据此得到一致的规划），
+        设置时不按截止时间停止训练"""
+        if time_budget is not None and time_budget <= 0:
+            raise ValueError(f"time_budget必须为正数: {time_budget}")
+        if max_steps is not None and max_steps <= 0:
+            raise ValueError(f"max_steps必须为正整数: {max_steps}")
+        self.time_budget = time_budget
+        self.max_steps = max_steps
+        self.started = started or time.time()
+        self.deadline = self.started + time_budget if time_budget else None
+        self.fit_seconds = fit_seconds
+        self.plan = None
+        self.steps = 0
+        self.truncated = False
+        self.reason = None
+
+    @property
+    def active(self):
+        return self.time_budget is not None or self.max_steps is not None or self.fit_seconds is not None
+
+    def remaining(self):
+        """距截止时间的秒数，没有时间预算时为None"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.time()
+
+    def reserve(self):
+        return max(MIN_WRITE_RESERVE_SECONDS, self.time_budget * WRITE_RESERVE_FRACTION)
+
+    def fit_deadline(self):
+        """训练必须结束的时间：截止时间减去写日志预留的时间"""
+        if self.deadline is None:
+            return None
+        return self.deadline - self.reserve()
+
+    def expired(self, lookahead=0):
+        """训练的截止时间是否已过；lookahead为预计还要花费的秒数"""
+        fit_deadline = self.fit_deadline()
+        return fit_deadline is not None and time.time() + lookahead >= fit_deadline
+
+    def mark_truncated(self, reason):
+        if not self.truncated:
+            self.truncated = True
+            self.reason = reason
+
+    def plan_training(self, cost, num_samples, validation_split, threads=1):
+        """按开销估算规划批大小、轮数、每轮步数和验证步数，返回并记录规划
+
+        cost为cost_model.estimate_cost的结果；没有预算时保持默认的批大小和
+        完整的轮次。
+        """
+        val_count = int(num_samples * validation_split)
+        train_count = max(num_samples - val_count, 1)
+        batch_size = DEFAULT_BATCH_SIZE
+        epochs = DEFAULT_EPOCHS
+        totals = (cost or {}).get('totals')
+        step_seconds = None
+        affordable = None
+
+        if totals and self.active:
+            per_sample_flops = totals['training_flops_per_step'] / cost['batch_size']
+            per_sample_bytes = totals['activation_bytes'] / cost['batch_size'] \
+                + math.prod(cost['input_shape']) * 4
+            param_bytes = totals['training_memory_bytes'] - totals['activation_bytes'] \
+                - math.prod(cost['input_shape']) * 4 * cost['batch_size']
+            while batch_size > MIN_BATCH_SIZE and \
+                    param_bytes + batch_size * per_sample_bytes > MAX_TRAINING_MEMORY_BYTES:
+                batch_size //= 2
+
+            throughput = FLOPS_PER_SECOND_PER_THREAD * max(threads or 1, 1)
+            # 验证只有前向计算，约为训练一步的1/3
+            validation_factor = 1 + val_count / train_count / 3
+
+            def step_cost(size):
+                return (STEP_OVERHEAD_SECONDS + size * per_sample_flops / throughput) * validation_factor
+
+            fit_seconds = None
+            if self.fit_seconds is not None:
+                fit_seconds = max(self.fit_seconds - COMPILE_SECONDS, 0)
+            elif self.deadline is not None:
+                fit_seconds = max(self.fit_deadline() - time.time() - COMPILE_SECONDS, 0)
+            if fit_seconds is not None:
+                affordable = fit_seconds / step_cost(batch_size)
+                # 重模型先减小批大小，保证每轮有足够的步数画出曲线
+                while batch_size > MIN_BATCH_SIZE and affordable < epochs * MIN_STEPS_PER_EPOCH:
+                    batch_size //= 2
+                    affordable = fit_seconds / step_cost(batch_size)
+            step_seconds = step_cost(batch_size)
+
+        full_steps = math.ceil(train_count / batch_size)
+        steps = full_steps
+        reason = None
+        if affordable is not None and affordable < epochs * full_steps:
+            epochs = min(epochs, max(int(affordable), 1))
+            steps = max(int(affordable // epochs), 1)
+            reason = 'time_budget'
+        if self.max_steps is not None and self.max_steps < epochs * steps:
+            epochs, steps = self._split_steps(self.max_steps, epochs, full_steps)
+            reason = 'max_steps'
+        steps = min(steps, full_steps)
+
+        validation_steps = math.ceil(val_count / batch_size) if val_count else 0
+        if validation_steps and steps < full_steps:
+            validation_steps = max(math.ceil(validation_steps * steps / full_steps), 1)
+
+        if reason == 'max_steps':
+            # 最后一轮在第max_steps步处停止，按实际训练的步数判断
+            if self.max_steps < DEFAULT_EPOCHS * full_steps:
+                self.mark_truncated(reason)
+        elif reason and epochs * steps * batch_size < DEFAULT_EPOCHS * train_count:
+            self.mark_truncated(reason)
+        self.plan = {
+            'batch_size': batch_size,
+            'epochs': epochs,
+            'steps_per_epoch': steps,
+            'full_steps_per_epoch': full_steps,
+            'validation_steps': validation_steps,
+            # 按max_steps规划时记录总步数，回调在这一步停止
+            'max_steps': self.max_steps if reason == 'max_steps' else None,
+            'estimated_step_seconds': round(step_seconds, 4) if step_seconds is not None else None,
+        }
+        return self.plan
+
+    @staticmethod
+    def _split_steps(max_steps, epochs, full_steps):
+        """把max_steps分到不超过epochs的轮次中，返回(轮数, 每轮步数)
+
+        Keras每轮的步数相同，每轮步数向上取整，最后一轮由回调在第max_steps步处停止，
+        因此正好训练max_steps步；步数不够每轮MIN_STEPS_PER_EPOCH步且一轮放得下时只训练一轮。
+        """
+        count = min(epochs, max_steps)
+        if max_steps < count * MIN_STEPS_PER_EPOCH and max_steps <= full_steps:
+            count = 1
+        return count, min(math.ceil(max_steps / count), full_steps)
+
+    def to_json(self):
+        return {
+            'time_budget': self.time_budget,
+            'max_steps': self.max_steps,
+            'fit_seconds': self.fit_seconds,
+            'plan': self.plan,
+            'steps': self.steps,
+            'truncated': self.truncated,
+            'reason': self.reason,
+            'elapsed': round(time.time() - self.started, 3),
+        }
+
+def deadline_callback(tf, budget, reporter=None):
+    """创建在截止时间或最大步数处停止训练的Keras回调（TensorFlow延迟导入，因此在函数内定义）
+
+    reporter为ProgressReporter时，停止训练时输出truncated事件。
+    """
+
+    class DeadlineCallback(tf.keras.callbacks.Callback):
+        def _stop(self, reason):
+            budget.mark_truncated(reason)
+            if not self.model.stop_training and reporter is not None:
+                reporter.emit('truncated', reason=reason, steps=budget.steps)
+            self.model.stop_training = True
+
+        def on_train_batch_begin(self, batch, logs=None):
+            self.batch_started = time.time()
+
+        def on_train_batch_end(self, batch, logs=None):
+            budget.steps += 1
+            # 第一个批次包含追踪时间，据此预计偏保守
+            last_step = time.time() - self.batch_started
+            if budget.max_steps is not None and budget.steps >= budget.max_steps:
+                # 规划内的训练已完成，或规划已按max_steps分配步数（最后一轮可能多出
+                # 不足一轮的步数，是否截断在规划时已经确定）时只停止训练
+                plan = budget.plan
+                if plan is not None and (plan.get('max_steps') == budget.max_steps
+                                         or budget.steps >= plan['epochs'] * plan['steps_per_epoch']):
+                    self.model.stop_training = True
+                else:
+                    self._stop('max_steps')
+            elif budget.expired(lookahead=last_step):
+                self._stop('time_budget')
+
+        def on_test_batch_end(self, batch, logs=None):
+            # 验证也受截止时间约束；stop_evaluating在较新的Keras中生效
+            if budget.expired():
+                budget.mark_truncated('time_budget')
+                self.model.stop_evaluating = True
+
+    return DeadlineCallback()
@@ -820,6 +820,7 @@ function FlowComponent() {
         if (node.type === 'mnist' || node.type === 'useData') {
           // 数据源节点保持简单配置
           modelStructure.push({ 
+            id: node.id,
             type, 
             config: { 
               sequenceId: config.sequenceId || 0 
@@ -829,6 +830,7 @@ function FlowComponent() {
           const index = config.index || 0;
           const layerConfig = conv2dConfigs[index] || {};
           modelStructure.push({
+            id: node.id,
             type,
             config: { 
               ...config,
@@ -839,6 +841,7 @@ function FlowComponent() {
           const index = config.index || 0;
           const layerConfig = maxPooling2dConfigs[index] || {};
           modelStructure.push({
+            id: node.id,
             type,
             config: { 
               ...config,
@@ -849,6 +852,7 @@ function FlowComponent() {
           const index = config.index || 0;
           const layerConfig = denseConfigs[index] || {};
           modelStructure.push({
+            id: node.id,
             type,
             config: { 
               ...config,
@@ -859,6 +863,7 @@ function FlowComponent() {
           const index = config.index || 0;
           const layerConfig = dropoutConfigs[index] || {};
           modelStructure.push({
+            id: node.id,
             type,
             config: { 
               ...config,
@@ -869,6 +874,7 @@ function FlowComponent() {
           const index = config.index || 0;
           const layerConfig = batchNormConfigs[index] || {};
           modelStructure.push({
+            id: node.id,
             type,
             config: { 
               ...config,
@@ -879,6 +885,7 @@ function FlowComponent() {
           const index = config.index || 0;
           const layerConfig = flattenConfigs[index] || {};
           modelStructure.push({
+            id: node.id,
             type,
             config: { 
               ...config,
@@ -889,6 +896,7 @@ function FlowComponent() {
           const index = config.index || 0;
           const layerConfig = lstmConfigs[index] || {};
           modelStructure.push({
+            id: node.id,
             type,
             config: { 
               ...config,
@@ -899,6 +907,7 @@ function FlowComponent() {
           const index = config.index || 0;
           const layerConfig = gruConfigs[index] || {};
           modelStructure.push({
+            id: node.id,
             type,
             config: { 
               ...config,
@@ -909,6 +918,7 @@ function FlowComponent() {
           const index = config.index || 0;
           const layerConfig = reshapeConfigs[index] || {};
           modelStructure.push({
+            id: node.id,
             type,
             config: { 
               ...config,
@@ -919,6 +929,7 @@ function FlowComponent() {
           const index = config.index || 0;
           const layerConfig = activationConfigs[index] || {};
           modelStructure.push({
+            id: node.id,
             type,
             config: { 
               ...config,
@@ -929,6 +940,7 @@ function FlowComponent() {
           const index = config.index || 0;
           const layerConfig = avgPooling2dConfigs[index] || {};
           modelStructure.push({
+            id: node.id,
             type,
             config: { 
               ...config,
@@ -937,6 +949,7 @@ function FlowComponent() {
           });
         } else if (node.type === 'trainButton') {
           modelStructure.push({
+            id: node.id,
             type,
             config: {
               sequenceId: config.sequenceId || 0